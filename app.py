@@ -1,907 +1,42 @@
 import os
+import sys
+import bisect
+import hmac
+import json
 import logging
-from datetime import datetime
+import threading
+import time
+import uuid
+from datetime import date, datetime
 from contextlib import contextmanager
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+from functools import wraps
 
-import pandas as pd
+import click
 import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import RealDictCursor
 from flask import (
     Flask, render_template, request, redirect, url_for, flash, jsonify,
-    send_file
+    Response, stream_with_context, stream_template, send_file, has_request_context
 )
-from io import BytesIO
-from openpyxl.utils import get_column_letter
-
-app = Flask(__name__)
-app.secret_key = 'secreto'  # cámbiala a una variable de entorno en producción
-# Evita cacheo de plantillas en despliegues largos
-app.config['TEMPLATES_AUTO_RELOAD'] = True
-app.jinja_env.auto_reload = True
-
-DATA_DIR = 'data'
-os.makedirs(DATA_DIR, exist_ok=True)
-
-# =========================
-#  Conexión a Postgres/Neon
-# =========================
-
-def normalize_db_url(raw_url: str) -> str:
-    """
-    - Asegura sslmode=require.
-    - Elimina channel_binding (puede romper según cliente).
-    - Agrega application_name.
-    """
-    if not raw_url:
-        return raw_url
-    parsed = urlparse(raw_url)
-    q = dict(parse_qsl(parsed.query, keep_blank_values=True))
-    q.pop("channel_binding", None)
-    if "sslmode" not in q:
-        q["sslmode"] = "require"
-    if "application_name" not in q:
-        q["application_name"] = "mensajeria_plataf"
-    new_query = urlencode(q)
-    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
-
-DATABASE_URL = normalize_db_url(os.getenv("DATABASE_URL", ""))
-
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL no está definida. En Render pon tu URL POOLER de Neon en Environment Variables.")
-
-POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
-POOL_MAX = int(os.getenv("PG_POOL_MAX", "5"))
-
-pool = ThreadedConnectionPool(minconn=POOL_MIN, maxconn=POOL_MAX, dsn=DATABASE_URL)
-
-@contextmanager
-def get_conn():
-    conn = pool.getconn()
-    try:
-        yield conn
-        conn.commit()
-    finally:
-        pool.putconn(conn)
-
-def db_exec(sql, params=()):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-
-def db_fetchone_dict(sql, params=()):
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql, params)
-            return cur.fetchone()
-
-def db_fetchall_dict(sql, params=()):
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql, params)
-            return cur.fetchall()
-
-def read_sql_df(sql, params=None):
-    with get_conn() as conn:
-        return pd.read_sql(sql, conn, params=params)
-
-# =========================
-#   Esquema (si no existe)
-# =========================
-
-def ensure_schema():
-    # Zonas / Mensajeros / Guías
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS zonas (
-            nombre TEXT PRIMARY KEY,
-            tarifa NUMERIC NOT NULL
-        );
-    """)
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS mensajeros (
-            nombre TEXT PRIMARY KEY,
-            zona   TEXT REFERENCES zonas(nombre)
-        );
-    """)
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS guias (
-            remitente   TEXT,
-            numero_guia TEXT PRIMARY KEY,
-            destinatario TEXT,
-            direccion   TEXT,
-            ciudad      TEXT
-        );
-    """)
-    # Despachos / Recepciones
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS despachos (
-            numero_guia TEXT PRIMARY KEY,
-            mensajero   TEXT,
-            zona        TEXT,
-            fecha       TIMESTAMPTZ NOT NULL
-        );
-    """)
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS recepciones (
-            numero_guia TEXT PRIMARY KEY,
-            tipo        TEXT,           -- ENTREGADA / DEVUELTA
-            motivo      TEXT,
-            fecha       TIMESTAMPTZ NOT NULL
-        );
-    """)
-    # Recogidas
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS recogidas (
-            id          SERIAL PRIMARY KEY,
-            numero_guia TEXT,
-            fecha       TIMESTAMPTZ NOT NULL,
-            observaciones TEXT
-        );
-    """)
-
-    # Clientes y vínculo con Recogidas
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS clientes (
-            id SERIAL PRIMARY KEY,
-            nombre TEXT UNIQUE NOT NULL,
-            telefono TEXT,
-            direccion TEXT,
-            ciudad TEXT,
-            contacto TEXT
-        );
-    """)
-    db_exec("""
-        ALTER TABLE recogidas
-        ADD COLUMN IF NOT EXISTS cliente_id INTEGER REFERENCES clientes(id);
-    """)
-
-    # Índices útiles
-    db_exec("CREATE INDEX IF NOT EXISTS idx_mensajeros_zona ON mensajeros(zona);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_guias_numero ON guias(numero_guia);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_despachos_fecha ON despachos(fecha);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_recepciones_fecha ON recepciones(fecha);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_recogidas_fecha ON recogidas(fecha);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_recogidas_cliente ON recogidas(cliente_id);")
-
-# =========================
-#   Modelos en memoria
-# =========================
-
-class Zona:
-    def __init__(self, nombre, tarifa):
-        self.nombre = nombre
-        self.tarifa = float(tarifa) if tarifa is not None else 0.0
-
-class Mensajero:
-    def __init__(self, nombre, zona):
-        self.nombre = nombre
-        self.zona = zona
-
-zonas = []
-mensajeros = []
-guias = pd.DataFrame(columns=['remitente', 'numero_guia', 'destinatario', 'direccion', 'ciudad'])
-despachos = []
-recepciones = []
-recogidas = []
-clientes = []
-
-def cargar_datos_desde_db():
-    global zonas, mensajeros, guias, despachos, recepciones, recogidas, clientes
-
-    zrows = db_fetchall_dict("SELECT nombre, tarifa FROM zonas;")
-    zonas = [Zona(r["nombre"], r["tarifa"]) for r in zrows]
-
-    mrows = db_fetchall_dict("SELECT nombre, zona FROM mensajeros;")
-    zonas_map = {z.nombre: z for z in zonas}
-    mensajeros_local = []
-    for r in mrows:
-        zona_obj = zonas_map.get(r["zona"])
-        mensajeros_local.append(Mensajero(r["nombre"], zona_obj))
-    globals()["mensajeros"] = mensajeros_local
-
-    guias_df = read_sql_df("SELECT remitente, numero_guia, destinatario, direccion, ciudad FROM guias;")
-    globals()["guias"] = guias_df
-
-    despachos_list = db_fetchall_dict("SELECT numero_guia, mensajero, zona, fecha FROM despachos ORDER BY fecha DESC;")
-    recepciones_list = db_fetchall_dict("SELECT numero_guia, tipo, motivo, fecha FROM recepciones ORDER BY fecha DESC;")
-    recogidas_list = db_fetchall_dict("SELECT id, numero_guia, fecha, observaciones, cliente_id FROM recogidas ORDER BY fecha DESC;")
-    clientes_list = db_fetchall_dict("SELECT id, nombre, telefono, direccion, ciudad, contacto FROM clientes ORDER BY nombre;")
-
-    globals()["despachos"]  = despachos_list
-    globals()["recepciones"] = recepciones_list
-    globals()["recogidas"]   = recogidas_list
-    globals()["clientes"]    = clientes_list
-
-# Inicializa
-logging.basicConfig(level=logging.INFO)
-ensure_schema()
-cargar_datos_desde_db()
-
-# =========================
-#   Util: Excel en memoria
-# =========================
-
-def df_to_excel_download(df: pd.DataFrame, base_name: str, sheet_name: str = "Hoja1", date_format: str | None = None):
-    if df is None:
-        df = pd.DataFrame()
-
-    # Normaliza fechas a naive (excel-friendly)
-    for col in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            try:
-                df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
-            except Exception:
-                pass
-
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        sheet = sheet_name
-        (df if not df.empty else pd.DataFrame(columns=list(df.columns))).to_excel(
-            writer, index=False, sheet_name=sheet
-        )
-
-        ws = writer.sheets[sheet]
-        # auto width
-        for idx, col in enumerate(df.columns if len(df.columns) else [" "], start=1):
-            if df.empty:
-                max_len = len(str(col))
-            else:
-                max_len = max([len(str(col))] + [len(str(x)) for x in df[col].astype(str).values])
-            ws.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
-
-        # formato de fecha por nombre de columna típica
-        fmt = date_format if date_format else "yyyy-mm-dd hh:mm:ss"
-        for name in df.columns:
-            if "fecha" in name.lower():
-                col_idx = list(df.columns).index(name) + 1
-                for row in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx, max_row=ws.max_row):
-                    for cell in row:
-                        cell.number_format = fmt
-
-    buffer.seek(0)
-    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{base_name}_{stamp}.xlsx"
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-
-# =========================
-#          Rutas
-# =========================
-
-@app.route("/")
-def index():
-    return render_template('index.html')
-
-@app.route("/cargar_base", methods=["GET", "POST"])
-def cargar_base():
-    global guias
-    if request.method == 'POST':
-        archivo = request.files.get('archivo_excel')
-        if archivo:
-            df = pd.read_excel(archivo)
-            required_cols = ['remitente', 'numero_guia', 'destinatario', 'direccion', 'ciudad']
-            if all(col in df.columns for col in required_cols):
-                with get_conn() as conn:
-                    cur = conn.cursor()
-                    for _, row in df.iterrows():
-                        numero = str(row['numero_guia'])
-                        cur.execute("SELECT 1 FROM guias WHERE numero_guia = %s;", (numero,))
-                        existe = cur.fetchone()
-                        if not existe:
-                            cur.execute("""
-                                INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
-                                VALUES (%s, %s, %s, %s, %s);
-                            """, (row['remitente'], numero, row['destinatario'], row['direccion'], row['ciudad']))
-                guias = read_sql_df("SELECT remitente, numero_guia, destinatario, direccion, ciudad FROM guias;")
-                globals()["guias"] = guias
-
-                archivo.save(os.path.join(DATA_DIR, archivo.filename))
-                flash('Base de datos cargada correctamente.', 'success')
-            else:
-                flash('El archivo debe contener las columnas: ' + ", ".join(required_cols), 'danger')
-    return render_template('cargar_base.html')
-
-@app.route("/registrar_zona", methods=["GET", "POST"])
-def registrar_zona():
-    if request.method == 'POST':
-        nombre = request.form.get('nombre')
-        tarifa = request.form.get('tarifa')
-        if nombre and tarifa:
-            try:
-                tarifa_float = float(tarifa)
-                existe = db_fetchone_dict("SELECT 1 AS x FROM zonas WHERE nombre = %s;", (nombre,))
-                if existe:
-                    flash('La zona ya existe', 'warning')
-                else:
-                    db_exec("INSERT INTO zonas(nombre, tarifa) VALUES (%s, %s);", (nombre, tarifa_float))
-                    flash(f'Zona {nombre} registrada con tarifa {tarifa_float}', 'success')
-                cargar_datos_desde_db()
-            except ValueError:
-                flash('Tarifa inválida, debe ser un número', 'danger')
-        else:
-            flash('Debe completar todos los campos', 'danger')
-    return render_template('registrar_zona.html', zonas=zonas)
-
-@app.route("/registrar_mensajero", methods=["GET", "POST"])
-def registrar_mensajero():
-    if request.method == 'POST':
-        nombre = request.form.get('nombre')
-        zona_nombre = request.form.get('zona')
-        if nombre and zona_nombre:
-            zona_obj = next((z for z in zonas if z.nombre == zona_nombre), None)
-            if not zona_obj:
-                flash('Zona no encontrada', 'danger')
-                return redirect(url_for('registrar_mensajero'))
-
-            existe = db_fetchone_dict("SELECT 1 AS x FROM mensajeros WHERE nombre = %s;", (nombre,))
-            if existe:
-                flash('El mensajero ya existe', 'warning')
-            else:
-                db_exec("INSERT INTO mensajeros(nombre, zona) VALUES (%s, %s);", (nombre, zona_nombre))
-                flash(f'Mensajero {nombre} registrado en zona {zona_nombre}', 'success')
-            cargar_datos_desde_db()
-        else:
-            flash('Debe completar todos los campos', 'danger')
-    return render_template('registrar_mensajero.html', zonas=zonas, mensajeros=mensajeros)
-
-@app.route("/despachar_guias", methods=["GET", "POST"])
-def despachar_guias():
-    if request.method == 'POST':
-        mensajero_nombre = request.form.get('mensajero')
-        guias_input = request.form.get('guias', '')
-        guias_list = [g.strip() for g in guias_input.strip().splitlines() if g.strip()]
-        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        mensajero_obj = next((m for m in mensajeros if m.nombre == mensajero_nombre), None)
-
-        if not mensajero_obj:
-            flash('Mensajero no encontrado', 'danger')
-            return redirect(url_for('despachar_guias'))
-
-        zona_obj = mensajero_obj.zona
-        errores, exito = [], []
-
-        with get_conn() as conn:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            for numero in guias_list:
-                cur.execute("SELECT 1 FROM guias WHERE numero_guia = %s;", (numero,))
-                if not cur.fetchone():
-                    errores.append(f'Guía {numero} no existe (FALTANTE)')
-                    continue
-                cur.execute("SELECT * FROM recepciones WHERE numero_guia = %s;", (numero,))
-                recepcion_existente = cur.fetchone()
-                if recepcion_existente:
-                    errores.append(f"Guía {numero} ya fue {recepcion_existente['tipo']}")
-                    continue
-                cur.execute("SELECT * FROM despachos WHERE numero_guia = %s;", (numero,))
-                despacho_existente = cur.fetchone()
-                if despacho_existente:
-                    errores.append(f'Guía {numero} ya fue despachada a {despacho_existente["mensajero"]}')
-                    continue
-                cur.execute("""
-                    INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
-                    VALUES (%s, %s, %s, %s);
-                """, (numero, mensajero_nombre, zona_obj.nombre if zona_obj else None, fecha))
-                exito.append(f'Guía {numero} despachada a {mensajero_nombre}')
-
-        if errores:
-            flash("Errores:<br>" + "<br>".join(errores), 'danger')
-        if exito:
-            flash("Despachos exitosos:<br>" + "<br>".join(exito), 'success')
-
-        cargar_datos_desde_db()
-        return redirect(url_for('ver_despacho'))
-
-    return render_template('despachar_guias.html',
-                           mensajeros=[m.nombre for m in mensajeros],
-                           zonas=[z.nombre for z in zonas])
-
-# ---------- Ver despachos (RESUMEN) + export ----------
-
-@app.route("/ver_despacho")
-def ver_despacho():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    sql = """
-        SELECT
-            DATE(d.fecha) AS fecha,
-            d.mensajero,
-            d.zona,
-            COUNT(*) AS total_guias
-        FROM despachos d
-        WHERE 1=1
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " GROUP BY DATE(d.fecha), d.mensajero, d.zona ORDER BY DATE(d.fecha) DESC"
-
-    resumen = db_fetchall_dict(sql, params=params)
-
-    return render_template(
-        'ver_despacho.html',
-        resumen=resumen,
-        mensajeros=[m.nombre for m in mensajeros],
-        mensajero_sel=mensa,
-        fi=fi, ff=ff
-    )
-
-@app.get("/ver_despacho/export")
-def export_despacho():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    sql = """
-        SELECT
-            DATE(d.fecha) AS fecha,
-            d.mensajero,
-            d.zona,
-            COUNT(*) AS total_guias
-        FROM despachos d
-        WHERE 1=1
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " GROUP BY DATE(d.fecha), d.mensajero, d.zona ORDER BY DATE(d.fecha) DESC"
-
-    df = read_sql_df(sql, params=params)
-    return df_to_excel_download(df, base_name="despachos_resumen", sheet_name="Resumen", date_format="yyyy-mm-dd")
-
-# ---------- PENDIENTE + export ----------
-
-@app.route("/pendiente")
-def pendiente():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    sql = """
-        SELECT
-            d.numero_guia,
-            d.mensajero,
-            d.zona,
-            d.fecha     AS fecha_asignada,
-            g.remitente,
-            g.destinatario,
-            g.direccion,
-            g.ciudad
-        FROM despachos d
-        LEFT JOIN recepciones r ON r.numero_guia = d.numero_guia
-        LEFT JOIN guias g       ON g.numero_guia = d.numero_guia
-        WHERE r.numero_guia IS NULL
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " ORDER BY d.fecha DESC"
-
-    rows = db_fetchall_dict(sql, params=params)
-    return render_template("pendiente.html",
-                           rows=rows,
-                           mensajeros=[m.nombre for m in mensajeros],
-                           mensajero_sel=mensa,
-                           fi=fi, ff=ff)
-
-@app.get("/pendiente/export")
-def pendiente_export():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    sql = """
-        SELECT
-            d.numero_guia,
-            d.mensajero,
-            d.zona,
-            d.fecha     AS fecha_asignada,
-            g.remitente,
-            g.destinatario,
-            g.direccion,
-            g.ciudad
-        FROM despachos d
-        LEFT JOIN recepciones r ON r.numero_guia = d.numero_guia
-        LEFT JOIN guias g       ON g.numero_guia = d.numero_guia
-        WHERE r.numero_guia IS NULL
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " ORDER BY d.fecha DESC"
-
-    df = read_sql_df(sql, params=params)
-    return df_to_excel_download(df, base_name="pendiente", sheet_name="Pendiente", date_format="yyyy-mm-dd")
-
-# ---------- Registrar / ver recepciones + export ----------
-# Soporte de importación por TXT para ENTREGADA
-
-def _parse_txt_guias(file_storage) -> list:
-    """
-    Lee un FileStorage .txt y devuelve una lista de guías normalizada.
-    Acepta: una por línea, o separadas por comas/espacios.
-    """
-    raw = file_storage.read()
-    try:
-        text = raw.decode('utf-8', errors='ignore')
-    except Exception:
-        text = raw.decode('latin-1', errors='ignore')
-
-    text = text.replace(',', '\n').replace('\r', '\n')
-    tokens = []
-    for line in text.split('\n'):
-        line = line.strip()
-        if not line:
-            continue
-        for chunk in line.split():
-            chunk = chunk.strip()
-            if chunk:
-                tokens.append(chunk)
-    # quitar duplicados conservando orden
-    seen = set()
-    gui_list = []
-    for t in tokens:
-        if t not in seen:
-            gui_list.append(t)
-            seen.add(t)
-    return gui_list
-
-@app.route("/registrar_recepcion", methods=["GET", "POST"])
-def registrar_recepcion():
-    if request.method == 'POST':
-        tipo = request.form.get('estado')  # ENTREGADA o DEVUELTA
-        motivo = request.form.get('motivo', '')
-        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        archivo_txt = request.files.get('archivo_txt')
-
-        # ===== MODO LOTE por TXT (solo ENTREGADA) =====
-        if archivo_txt and tipo == 'ENTREGADA':
-            nombre_archivo = (archivo_txt.filename or '').lower()
-            if not nombre_archivo.endswith('.txt'):
-                flash('El archivo debe ser .txt', 'danger')
-                return redirect(url_for('registrar_recepcion'))
-
-            guias_list = _parse_txt_guias(archivo_txt)
-            if not guias_list:
-                flash('El archivo .txt no contiene guías válidas.', 'warning')
-                return redirect(url_for('registrar_recepcion'))
-
-            errores, exito = [], []
-            with get_conn() as conn:
-                cur = conn.cursor(cursor_factory=RealDictCursor)
-                for numero_guia in guias_list:
-                    cur.execute("SELECT 1 AS x FROM guias WHERE numero_guia = %s;", (numero_guia,))
-                    if not cur.fetchone():
-                        errores.append(f'Guía {numero_guia}: no existe en la base (FALTANTE)')
-                        continue
-
-                    cur.execute("SELECT * FROM despachos WHERE numero_guia = %s;", (numero_guia,))
-                    despacho_existente = cur.fetchone()
-                    if not despacho_existente:
-                        errores.append(f'Guía {numero_guia}: no ha sido despachada aún')
-                        continue
-
-                    cur.execute("SELECT 1 AS x FROM recepciones WHERE numero_guia = %s;", (numero_guia,))
-                    if cur.fetchone():
-                        errores.append(f'Guía {numero_guia}: ya está recepcionada')
-                        continue
-
-                    cur.execute("""
-                        INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
-                        VALUES (%s, %s, %s, %s);
-                    """, (numero_guia, 'ENTREGADA', '', fecha))
-                    exito.append(f'Guía {numero_guia}: ENTREGADA')
-
-            if errores:
-                flash("Errores en lote:<br>" + "<br>".join(errores), 'danger')
-            if exito:
-                flash("Recepciones registradas:<br>" + "<br>".join(exito), 'success')
-
-            cargar_datos_desde_db()
-            return redirect(url_for('registrar_recepcion'))
-
-        # ===== MODO INDIVIDUAL (comportamiento existente) =====
-        numero_guia = request.form.get('numero_guia', '').strip()
-        if not numero_guia:
-            flash('Debe ingresar un número de guía o subir un .txt (si ENTREGADA).', 'warning')
-            return redirect(url_for('registrar_recepcion'))
-
-        existe_guia = db_fetchone_dict("SELECT 1 AS x FROM guias WHERE numero_guia = %s;", (numero_guia,))
-        if not existe_guia:
-            flash('Número de guía no existe en la base (FALTANTE)', 'danger')
-            return redirect(url_for('registrar_recepcion'))
-
-        despacho_existente = db_fetchone_dict("SELECT * FROM despachos WHERE numero_guia = %s;", (numero_guia,))
-        if not despacho_existente:
-            flash('La guía no ha sido despachada aún', 'warning')
-            return redirect(url_for('registrar_recepcion'))
-
-        recepcion_existente = db_fetchone_dict("SELECT 1 AS x FROM recepciones WHERE numero_guia = %s;", (numero_guia,))
-        if recepcion_existente:
-            flash('La recepción para esta guía ya está registrada', 'warning')
-            return redirect(url_for('registrar_recepcion'))
-
-        db_exec("""
-            INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
-            VALUES (%s, %s, %s, %s);
-        """, (numero_guia, tipo, (motivo if tipo == 'DEVUELTA' else ''), fecha))
-
-        flash(f'Recepción de guía {numero_guia} registrada como {tipo}', 'success')
-        cargar_datos_desde_db()
-        return redirect(url_for('registrar_recepcion'))
-
-    return render_template('registrar_recepcion.html')
-
-@app.route("/ver_recepciones")
-def ver_recepciones():
-    numero = (request.args.get('numero_guia') or '').strip().lower()
-    tipo = (request.args.get('tipo') or '').strip().upper()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    lista = recepciones
-    if numero:
-        lista = [r for r in lista if numero in (r['numero_guia'] or '').lower()]
-    if tipo:
-        lista = [r for r in lista if (r['tipo'] or '').upper() == tipo]
-    if fi:
-        lista = [r for r in lista if str(r['fecha'])[:10] >= fi]
-    if ff:
-        lista = [r for r in lista if str(r['fecha'])[:10] <= ff]
-
-    return render_template('ver_recepciones.html', recepciones=list(lista))
-
-@app.get("/ver_recepciones/export")
-def export_recepciones():
-    numero = (request.args.get('numero_guia') or '').strip().lower()
-    tipo = (request.args.get('tipo') or '').strip().upper()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    sql = """
-        SELECT numero_guia, tipo, motivo, fecha
-        FROM recepciones
-        WHERE 1=1
-    """
-    params = []
-    if numero:
-        sql += " AND LOWER(COALESCE(numero_guia,'')) LIKE %s"
-        params.append(f"%{numero}%")
-    if tipo:
-        sql += " AND UPPER(COALESCE(tipo,'')) = %s"
-        params.append(tipo)
-    if fi:
-        sql += " AND DATE(fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(fecha) <= %s"
-        params.append(ff)
-    sql += " ORDER BY fecha DESC"
-
-    df = read_sql_df(sql, params=params)
-    return df_to_excel_download(df, base_name="recepciones", sheet_name="Recepciones", date_format="yyyy-mm-dd")
-
-# ---------- Consulta estado ----------
-
-@app.route("/consultar_estado", methods=["GET", "POST"])
-def consultar_estado():
-    resultado = None
-    if request.method == 'POST':
-        numero_guia = request.form.get('numero_guia', '').strip()
-        if not numero_guia:
-            flash('Debe ingresar un número de guía', 'warning')
-            return redirect(url_for('consultar_estado'))
-
-        existe_guia = db_fetchone_dict("SELECT 1 AS x FROM guias WHERE numero_guia = %s;", (numero_guia,))
-        if not existe_guia:
-            resultado = {'numero_guia': numero_guia, 'estado': 'FALTANTE', 'motivo': '', 'mensajero': '', 'zona': '', 'fecha': ''}
-        else:
-            despacho = db_fetchone_dict("SELECT * FROM despachos WHERE numero_guia = %s;", (numero_guia,))
-            recepcion = db_fetchone_dict("SELECT * FROM recepciones WHERE numero_guia = %s;", (numero_guia,))
-
-            if recepcion:
-                estado = recepcion['tipo']
-                motivo = recepcion['motivo']
-                mensajero = despacho['mensajero'] if despacho else ''
-                zona = despacho['zona'] if despacho else ''
-                fecha = recepcion['fecha']
-            elif despacho:
-                estado = 'DESPACHADA'
-                motivo = ''
-                mensajero = despacho['mensajero']
-                zona = despacho['zona']
-                fecha = despacho['fecha']
-            else:
-                estado = 'EN VERIFICACION'
-                motivo = ''
-                mensajero = ''
-                zona = ''
-                fecha = ''
-
-            resultado = {
-                'numero_guia': numero_guia,
-                'estado': estado,
-                'motivo': motivo,
-                'mensajero': mensajero,
-                'zona': zona,
-                'fecha': fecha
-            }
-    return render_template('consultar_estado.html', resultado=resultado)
-
-# ---------- Liquidación + export ----------
-
-@app.route("/liquidacion", methods=["GET", "POST"])
-def liquidacion():
-    liquidacion = None
-    if request.method == 'POST':
-        mensajero_nombre = request.form.get('mensajero')
-        fecha_inicio = request.form.get('fecha_inicio')
-        fecha_fin = request.form.get('fecha_fin')
-
-        try:
-            datetime.strptime(fecha_inicio, '%Y-%m-%d')
-            datetime.strptime(fecha_fin,  '%Y-%m-%d')
-        except Exception:
-            flash('Formato de fechas inválido', 'danger')
-            return redirect(url_for('liquidacion'))
-
-        gui_despachadas = db_fetchall_dict(
-            'SELECT * FROM despachos WHERE mensajero = %s AND DATE(fecha) BETWEEN %s AND %s;',
-            (mensajero_nombre, fecha_inicio, fecha_fin)
-        )
-
-        cantidad_guias = len(gui_despachadas)
-        mensajero_obj = next((m for m in mensajeros if m.nombre == mensajero_nombre), None)
-        tarifa = mensajero_obj.zona.tarifa if mensajero_obj and mensajero_obj.zona else 0
-        total_pagar = cantidad_guias * tarifa
-
-        liquidacion = {
-            'mensajero': mensajero_nombre,
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-            'cantidad_guias': cantidad_guias,
-            'tarifa': tarifa,
-            'total_pagar': total_pagar
-        }
-    return render_template('liquidacion.html', mensajeros=mensajeros, liquidacion=liquidacion)
-
-@app.get("/liquidacion/export")
-def export_liquidacion():
-    mensajero_nombre = (request.args.get('mensajero') or '').strip()
-    fecha_inicio = (request.args.get('fecha_inicio') or '').strip()
-    fecha_fin = (request.args.get('fecha_fin') or '').strip()
-
-    if not mensajero_nombre or not fecha_inicio or not fecha_fin:
-        df_empty = pd.DataFrame(columns=["mensajero", "fecha_inicio", "fecha_fin", "cantidad_guias", "tarifa", "total_pagar"])
-        return df_to_excel_download(df_empty, base_name="liquidacion", sheet_name="Resumen", date_format="yyyy-mm-dd")
-
-    df_detalle = read_sql_df("""
-        SELECT numero_guia, mensajero, zona, fecha
-        FROM despachos
-        WHERE mensajero = %s AND DATE(fecha) BETWEEN %s AND %s
-        ORDER BY fecha DESC
-    """, params=[mensajero_nombre, fecha_inicio, fecha_fin])
-
-    cantidad_guias = len(df_detalle)
-    mensajero_obj = next((m for m in mensajeros if m.nombre == mensajero_nombre), None)
-    tarifa = mensajero_obj.zona.tarifa if mensajero_obj and mensajero_obj.zona else 0
-    total_pagar = cantidad_guias * tarifa
-
-    df_resumen = pd.DataFrame([{
-        "mensajero": mensajero_nombre,
-        "fecha_inicio": fecha_inicio,
-        "fecha_fin": fecha_fin,
-        "cantidad_guias": cantidad_guias,
-        "tarifa": tarifa,
-        "total_pagar": total_pagar
-    }])
-
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df_resumen.to_excel(writer, index=False, sheet_name="Resumen")
-        ws = writer.sheets["Resumen"]
-        for idx, col in enumerate(df_resumen.columns, start=1):
-            max_len = max([len(str(col))] + [len(str(x)) for x in df_resumen[col].astype(str).values])
-            ws.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
-
-        df_detalle2 = df_detalle.copy()
-        for col in df_detalle2.columns:
-            if pd.api.types.is_datetime64_any_dtype(df_detalle2[col]):
-                try:
-                    df_detalle2[col] = pd.to_datetime(df_detalle2[col]).dt.tz_localize(None)
-                except Exception:
-                    pass
-        df_detalle2.to_excel(writer, index=False, sheet_name="Detalle")
-        ws2 = writer.sheets["Detalle"]
-        for idx, col in enumerate(df_detalle2.columns, start=1):
-            max_len = max([len(str(col))] + [len(str(x)) for x in df_detalle2[col].astype(str).values]) if not df_detalle2.empty else len(str(col))
-            ws2.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
-        if "fecha" in df_detalle2.columns:
-            col_idx = list(df_detalle2.columns).index("fecha") + 1
-            for row in ws2.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx, max_row=ws2.max_row):
-                for cell in row:
-                    cell.number_format = "yyyy-mm-dd"
-
-    buffer.seek(0)
-    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"liquidacion_{stamp}.xlsx"
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-
-# ---------- Endpoints util ----------
-
-@app.route("/health")
-def health():
-    db_fetchone_dict("SELECT 1 AS ok;")
-    return jsonify(ok=True)
-
-@app.route("/init")
-def init():
-    ensure_schema()
-    new_id = db_fetchone_dict(
-        "INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad) VALUES (%s,%s,%s,%s,%s) ON CONFLICT (numero_guia) DO NOTHING RETURNING numero_guia;",
-        ("demo", "DUMMY-0001", "destino", "direccion", "ciudad")
-    )
-    return jsonify(ok=True, demo_insert=new_id)
-
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
-import os
-import logging
-from datetime import datetime
-from contextlib import contextmanager
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
-
-import pandas as pd
-import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
-from psycopg2.extras import RealDictCursor
-from flask import (
-    Flask, render_template, request, redirect, url_for, flash, jsonify,
-    send_file
+from markupsafe import escape
+
+from ingesta import COLUMNAS_GUIAS, ColumnasFaltantes, ingestar_guias, leer_lotes
+import lotes
+import paginacion
+import exportar
+import liquidaciones
+import trabajos
+import esquema
+import metricas
+from esquema import (
+    CLAVES_REFERENCIA, CANAL_CAMBIOS, ZONA_NEGOCIO, SQL_PENDIENTES_DIARIOS, SQL_ESTADO_DERIVADO, ESTADO_DISTINTO,
 )
-from io import BytesIO
-from openpyxl.utils import get_column_letter
+from filtros import Filtros
+from cache import CacheReferencias, EscuchaCambios, dsn_directo, normalize_db_url
+from cache_export import CacheExport
+from conexiones import PoolAgotado, PoolConexiones
+from consultas_lentas import ConsultasLentas
+from sentencias import Sentencias, es_pooler
 
 app = Flask(__name__)
 app.secret_key = 'secreto'  # cámbiala a una variable de entorno en producción
@@ -917,24 +52,6 @@ os.makedirs(DATA_DIR, exist_ok=True)
 #  Conexión a Postgres/Neon
 # =========================
 
-def normalize_db_url(raw_url: str) -> str:
-    """
-    - Asegura sslmode=require.
-    - Elimina channel_binding (puede romper según cliente).
-    - Agrega application_name.
-    """
-    if not raw_url:
-        return raw_url
-    parsed = urlparse(raw_url)
-    q = dict(parse_qsl(parsed.query, keep_blank_values=True))
-    q.pop("channel_binding", None)
-    if "sslmode" not in q:
-        q["sslmode"] = "require"
-    if "application_name" not in q:
-        q["application_name"] = "mensajeria_plataf"
-    new_query = urlencode(q)
-    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
-
 DATABASE_URL = normalize_db_url(os.getenv("DATABASE_URL", ""))
 
 if not DATABASE_URL:
@@ -943,16 +60,36 @@ if not DATABASE_URL:
 POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
 POOL_MAX = int(os.getenv("PG_POOL_MAX", "5"))
 
-pool = ThreadedConnectionPool(minconn=POOL_MIN, maxconn=POOL_MAX, dsn=DATABASE_URL)
+# Ver conexiones.py: espera acotada, chequeo de conexiones inactivas,
+# reciclaje por edad y keepalives. Sin conexión a tiempo -> 503.
+# Se abre con la primera conexión pedida, no al importar el módulo.
+pool = None
+_lock_pool = threading.Lock()
+
+def _abrir_pool():
+    global pool
+    with _lock_pool:
+        if pool is None:
+            pool = PoolConexiones(
+                DATABASE_URL, minimo=POOL_MIN, maximo=POOL_MAX,
+                espera=float(os.getenv("PG_POOL_ESPERA", "5")),            # segundos esperando una conexión libre
+                cola_max=int(os.getenv("PG_POOL_COLA", "50")),             # peticiones esperando a la vez
+                edad_max=float(os.getenv("PG_POOL_EDAD_MAX", "1800")),     # segundos de vida de una conexión
+                chequeo=float(os.getenv("PG_POOL_CHEQUEO", "30")),         # inactividad tras la que se prueba con SELECT 1
+                conectar_kwargs={'connection_factory': metricas.ConexionMedida},
+            )
+    return pool
 
 @contextmanager
 def get_conn():
-    conn = pool.getconn()
+    t0 = time.perf_counter()
+    conn = (pool or _abrir_pool()).obtener()
+    metricas.espera_pool(time.perf_counter() - t0)
     try:
         yield conn
         conn.commit()
     finally:
-        pool.putconn(conn)
+        pool.devolver(conn)
 
 def db_exec(sql, params=()):
     with get_conn() as conn:
@@ -971,88 +108,142 @@ def db_fetchall_dict(sql, params=()):
             cur.execute(sql, params)
             return cur.fetchall()
 
-def read_sql_df(sql, params=None):
-    # Pandas puede advertir sobre DBAPI2 distinto de SQLAlchemy, pero funciona.
+# =========================
+#   Métricas por petición (ver metricas.py)
+# =========================
+
+# Peticiones con más consultas que esto se anotan como posible N+1
+registro_metricas = metricas.Registro(max_consultas=int(os.getenv("METRICAS_MAX_CONSULTAS", "50")))
+
+@app.before_request
+def _medir_inicio():
+    registro_metricas.iniciar()
+
+@app.after_request
+def _medir_estado(resp):
+    registro_metricas.fijar_estado(resp.status_code)
+    return resp
+
+@app.teardown_request
+def _medir_fin(exc):
+    # En respuestas con stream_with_context corre al terminar de enviar
+    registro_metricas.terminar(request.endpoint, request.method)
+
+# Consultas lentas (ver consultas_lentas.py): sobre CONSULTA_LENTA_MS se
+# anotan en data/logs/consultas_lentas.log; a una fracción
+# CONSULTA_LENTA_MUESTREO se les agrega EXPLAIN (ANALYZE, BUFFERS).
+# CONSULTA_LENTA_MS=0 lo desactiva.
+CONSULTA_LENTA_MS = float(os.getenv("CONSULTA_LENTA_MS", "500"))
+
+def _origen_consulta():
+    return request.endpoint if has_request_context() else threading.current_thread().name
+
+consultas_lentas = ConsultasLentas(
+    DATABASE_URL, os.path.join(DATA_DIR, "logs", "consultas_lentas.log"),
+    umbral=CONSULTA_LENTA_MS / 1000,
+    muestreo=float(os.getenv("CONSULTA_LENTA_MUESTREO", "0.2")),
+    intervalo_plan=float(os.getenv("CONSULTA_LENTA_INTERVALO", "600")),   # segundos entre planes de una misma sentencia
+    origen=_origen_consulta,
+)
+if CONSULTA_LENTA_MS > 0:
+    metricas.observar_consultas(consultas_lentas.observar)
+
+# Consultas puntuales frecuentes, preparadas por conexión (ver sentencias.py).
+# PG_PREPARAR: 1 / 0 / auto (auto = no preparar si la URL es de un pooler).
+_preparar = os.getenv("PG_PREPARAR", "auto").lower()
+CONSULTAS_PUNTUALES = {
+    'guia_existe': "SELECT 1 AS x FROM guias WHERE numero_guia = %s",
+    'despacho_guia': "SELECT numero_guia, mensajero, zona, fecha FROM despachos WHERE numero_guia = %s",
+    'recepcion_existe': "SELECT 1 AS x FROM recepciones WHERE numero_guia = %s",
+    'estado_guia': """
+        SELECT numero_guia, estado, COALESCE(motivo, '') AS motivo, COALESCE(mensajero, '') AS mensajero,
+               COALESCE(zona, '') AS zona, COALESCE(fecha_recepcion, fecha_despacho) AS fecha
+        FROM guias WHERE numero_guia = %s
+    """,
+}
+sentencias = Sentencias(preparar=(not es_pooler(DATABASE_URL)) if _preparar == "auto" else _preparar in ("1", "true"))
+for _nombre, _sql in CONSULTAS_PUNTUALES.items():
+    sentencias.registrar(_nombre, _sql, ('text',))
+
+def db_fetchone_preparada(nombre, params=()):
     with get_conn() as conn:
-        return pd.read_sql(sql, conn, params=params)
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return sentencias.ejecutar(cur, nombre, params).fetchone()
 
 # =========================
-#   Esquema (si no existe)
+#   Esquema (ver esquema.py)
 # =========================
 
+TABLAS_REFERENCIA = tuple(CLAVES_REFERENCIA)
+
+# Conexión directa (sin pooler) para LISTEN y para las migraciones
+DATABASE_URL_DIRECTA = normalize_db_url(os.getenv("DATABASE_URL_DIRECTA", "")) or dsn_directo(DATABASE_URL)
+# 1: aplicar al arrancar las migraciones pendientes (útil en desarrollo).
+# Si no, la app no arranca con el esquema atrasado: `python esquema.py migrar`.
+MIGRAR_AL_ARRANCAR = os.getenv("MIGRAR_AL_ARRANCAR", "0") == "1"
+
 def ensure_schema():
-    # Zonas / Mensajeros / Guías
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS zonas (
-            nombre TEXT PRIMARY KEY,
-            tarifa NUMERIC NOT NULL
-        );
-    """)
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS mensajeros (
-            nombre TEXT PRIMARY KEY,
-            zona   TEXT REFERENCES zonas(nombre)
-        );
-    """)
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS guias (
-            remitente   TEXT,
-            numero_guia TEXT PRIMARY KEY,
-            destinatario TEXT,
-            direccion   TEXT,
-            ciudad      TEXT
-        );
-    """)
-    # Despachos / Recepciones
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS despachos (
-            numero_guia TEXT PRIMARY KEY,
-            mensajero   TEXT,
-            zona        TEXT,
-            fecha       TIMESTAMPTZ NOT NULL
-        );
-    """)
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS recepciones (
-            numero_guia TEXT PRIMARY KEY,
-            tipo        TEXT,           -- ENTREGADA / DEVUELTA
-            motivo      TEXT,
-            fecha       TIMESTAMPTZ NOT NULL
-        );
-    """)
-    # Recogidas
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS recogidas (
-            id          SERIAL PRIMARY KEY,
-            numero_guia TEXT,
-            fecha       TIMESTAMPTZ NOT NULL,
-            observaciones TEXT
-        );
-    """)
-
-    # Clientes y vínculo con Recogidas
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS clientes (
-            id SERIAL PRIMARY KEY,
-            nombre TEXT UNIQUE NOT NULL,
-            telefono TEXT,
-            direccion TEXT,
-            ciudad TEXT,
-            contacto TEXT
-        );
-    """)
-    db_exec("""
-        ALTER TABLE recogidas
-        ADD COLUMN IF NOT EXISTS cliente_id INTEGER REFERENCES clientes(id);
-    """)
-
-    # Índices útiles
-    db_exec("CREATE INDEX IF NOT EXISTS idx_mensajeros_zona ON mensajeros(zona);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_guias_numero ON guias(numero_guia);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_despachos_fecha ON despachos(fecha);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_recepciones_fecha ON recepciones(fecha);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_recogidas_fecha ON recogidas(fecha);")
-    db_exec("CREATE INDEX IF NOT EXISTS idx_recogidas_cliente ON recogidas(cliente_id);")
+    """
+    Al arrancar: una consulta a schema_version. Con migraciones pendientes
+    las aplica (MIGRAR_AL_ARRANCAR=1) o no deja arrancar la app.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            falta = esquema.faltantes(cur)
+    if not falta:
+        return
+    if MIGRAR_AL_ARRANCAR:
+        esquema.migrar(DATABASE_URL_DIRECTA)
+        return
+    raise RuntimeError(
+        "El esquema de la base está atrasado ({}). Corre `python esquema.py migrar` "
+        "antes de arrancar (o MIGRAR_AL_ARRANCAR=1).".format("; ".join(falta)))
+
+def reconstruir_resumen_despachos() -> int:
+    """Regenera despachos_diarios desde cero (ver esquema.py)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return esquema.reconstruir_resumen_despachos(cur)
+
+def reconstruir_resumen_pendientes() -> int:
+    """Regenera pendientes_diarios desde el estado guardado en `guias`."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return esquema.reconstruir_resumen_pendientes(cur)
+
+def verificar_resumen_pendientes() -> int:
+    """Cantidad de (día, mensajero) en que pendientes_diarios no coincide con `guias`."""
+    return db_fetchone_dict(f"""
+        SELECT COUNT(*) AS n
+        FROM pendientes_diarios p
+        FULL JOIN ({SQL_PENDIENTES_DIARIOS}) e USING (fecha, mensajero)
+        WHERE p.total IS DISTINCT FROM e.total;
+    """, (ZONA_NEGOCIO,))["n"]
+
+def reconstruir_estado_guias() -> int:
+    """
+    Recalcula el estado de todas las guías cuyo valor guardado no coincide
+    con despachos/recepciones. Devuelve cuántas cambiaron.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return esquema.reconstruir_estado_guias(cur)
+
+def verificar_estado_guias(limite: int = 20):
+    """(cantidad de guías con estado desactualizado, primeras `limite` diferencias)."""
+    sql = f"""
+        FROM guias g
+        JOIN ({SQL_ESTADO_DERIVADO}) e ON e.numero_guia = g.numero_guia
+        WHERE {ESTADO_DISTINTO}
+    """
+    cantidad = db_fetchone_dict("SELECT COUNT(*) AS n " + sql)["n"]
+    ejemplos = db_fetchall_dict(f"""
+        SELECT g.numero_guia, g.estado AS guardado, e.estado AS esperado,
+               g.mensajero AS mensajero_guardado, e.mensajero AS mensajero_esperado
+        {sql}
+        ORDER BY g.numero_guia LIMIT %s;
+    """, (limite,)) if cantidad else []
+    return cantidad, ejemplos
 
 # =========================
 #   Modelos en memoria
@@ -1068,101 +259,281 @@ class Mensajero:
         self.nombre = nombre
         self.zona = zona
 
-zonas = []
-mensajeros = []
-guias = pd.DataFrame(columns=['remitente', 'numero_guia', 'destinatario', 'direccion', 'ciudad'])
-despachos = []
-recepciones = []
-recogidas = []
-clientes = []
+def _cargar_zonas():
+    zrows = db_fetchall_dict("SELECT nombre, tarifa FROM zonas;")
+    return [Zona(r["nombre"], r["tarifa"]) for r in zrows]
+
+def _cargar_mensajeros():
+    mrows = db_fetchall_dict("SELECT nombre, zona FROM mensajeros;")
+    zonas_map = {z.nombre: z for z in get_zonas()}
+    return [Mensajero(r["nombre"], zonas_map.get(r["zona"])) for r in mrows]
+
+def _cargar_clientes():
+    return db_fetchall_dict("SELECT id, nombre, telefono, direccion, ciudad, contacto FROM clientes ORDER BY nombre;")
+
+def _leer_versiones():
+    return {r["tabla"]: r["version"] for r in db_fetchall_dict("SELECT tabla, version FROM versiones;")}
+
+def db_escribir(sql, params, tabla):
+    """
+    Ejecuta una escritura sobre una tabla cacheada y devuelve (fila, version):
+    la fila del RETURNING (o None) y la versión de `tabla` leída en la misma
+    transacción, para pasarla a cache.aplicar().
+    """
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql, params)
+            fila = cur.fetchone() if cur.description else None
+            cur.execute("SELECT version FROM versiones WHERE tabla = %s;", (tabla,))
+            row = cur.fetchone()
+            return fila, (row["version"] if row else 0)
+
+CACHE_SYNC_SEGUNDOS = float(os.getenv("CACHE_SYNC_SEGUNDOS", "5"))
+
+cache = CacheReferencias(_leer_versiones, intervalo=CACHE_SYNC_SEGUNDOS)
+cache.registrar('zonas', _cargar_zonas, dependientes=('mensajeros',))
+cache.registrar('mensajeros', _cargar_mensajeros)
+cache.registrar('clientes', _cargar_clientes)
+
+def _fila_referencia(tabla, clave):
+    sql = {
+        'zonas': "SELECT nombre, tarifa FROM zonas WHERE nombre = %s;",
+        'mensajeros': "SELECT nombre, zona FROM mensajeros WHERE nombre = %s;",
+        'clientes': "SELECT id, nombre, telefono, direccion, ciudad, contacto FROM clientes WHERE id = %s;",
+    }[tabla]
+    return db_fetchone_dict(sql, (clave,))
+
+def _delta_referencia(tabla, claves, fila):
+    """
+    Delta idempotente para cache.aplicar: quita las entradas con esas claves
+    y agrega `fila` (dict de la BD) si no es None.
+    """
+    claves = {str(c) for c in claves if c is not None}
+    if tabla == 'zonas':
+        def delta(zs):
+            actual = next((z for z in zs if z.nombre in claves), None)
+            if fila and actual:
+                # En sitio: los Mensajero guardan referencias a este objeto
+                nueva = Zona(fila["nombre"], fila["tarifa"])
+                actual.nombre, actual.tarifa = nueva.nombre, nueva.tarifa
+                return zs
+            resto = [z for z in zs if z.nombre not in claves]
+            return resto + [Zona(fila["nombre"], fila["tarifa"])] if fila else resto
+    elif tabla == 'mensajeros':
+        def delta(ms):
+            resto = [m for m in ms if m.nombre not in claves]
+            if fila:
+                zona_obj = next((z for z in get_zonas() if z.nombre == fila["zona"]), None)
+                resto.append(Mensajero(fila["nombre"], zona_obj))
+            return resto
+    else:
+        def delta(cs):
+            resto = [c for c in cs if str(c["id"]) not in claves]
+            if fila:
+                bisect.insort(resto, fila, key=lambda c: c["nombre"])
+            return resto
+    return delta
+
+def _aplicar_aviso(evento):
+    """Aplica un NOTIFY de notificar_cambio() al cache de este worker."""
+    tabla = evento.get("tabla")
+    if tabla not in CLAVES_REFERENCIA:
+        return
+    if evento.get("op") == "TRUNCATE":
+        cache.invalidar(tabla)
+        return
+    clave = evento.get("clave")
+    fila = _fila_referencia(tabla, clave) if clave is not None else None
+    cache.aplicar(tabla, evento["version"], _delta_referencia(tabla, [clave, evento.get("anterior")], fila))
+
+def get_zonas():
+    return cache.get('zonas')
+
+def get_mensajeros():
+    return cache.get('mensajeros')
+
+def get_clientes():
+    return cache.get('clientes')
 
 def cargar_datos_desde_db():
-    global zonas, mensajeros, guias, despachos, recepciones, recogidas, clientes
+    """Recarga completa del cache (arranque). Las escrituras usan cache.aplicar / cache.invalidar."""
+    cache.invalidar()
+    for tabla in TABLAS_REFERENCIA:
+        cache.get(tabla)
+
+# Avisos de cambios de otros workers (LISTEN/NOTIFY); se arranca en inicializar()
+escucha = None
+
+# Rutas que no esperan a inicializar(): las de monitoreo no tocan la base y
+# responden con la base caída o el pool agotado; /init informa el esquema
+# aunque esté atrasado (justo cuando inicializar() falla)
+SIN_ARRANQUE = {'health_pool', 'metrics', 'init'}
+
+@app.before_request
+def _inicializar_si_falta():
+    # Servidores que importan `app:app` en vez de llamar a create_app()
+    if request.endpoint not in SIN_ARRANQUE:
+        inicializar()
+
+@app.before_request
+def _sincronizar_cache():
+    # Con la escucha conectada no hace falta sondear. Si no, una consulta a
+    # `versiones` como mucho cada CACHE_SYNC_SEGUNDOS.
+    if request.endpoint in SIN_ARRANQUE:
+        return
+    if escucha is None or not escucha.conectado:
+        cache.sincronizar()
 
-    zrows = db_fetchall_dict("SELECT nombre, tarifa FROM zonas;")
-    zonas = [Zona(r["nombre"], r["tarifa"]) for r in zrows]
+# =========================
+#   Paginación de listados (ver paginacion.py)
+# =========================
 
-    mrows = db_fetchall_dict("SELECT nombre, zona FROM mensajeros;")
-    zonas_map = {z.nombre: z for z in zonas}
-    mensajeros_local = []
-    for r in mrows:
-        zona_obj = zonas_map.get(r["zona"])
-        mensajeros_local.append(Mensajero(r["nombre"], zona_obj))
-    globals()["mensajeros"] = mensajeros_local
-
-    guias_df = read_sql_df("SELECT remitente, numero_guia, destinatario, direccion, ciudad FROM guias;")
-    globals()["guias"] = guias_df
-
-    despachos_list = db_fetchall_dict("SELECT numero_guia, mensajero, zona, fecha FROM despachos ORDER BY fecha DESC;")
-    recepciones_list = db_fetchall_dict("SELECT numero_guia, tipo, motivo, fecha FROM recepciones ORDER BY fecha DESC;")
-    recogidas_list = db_fetchall_dict("SELECT id, numero_guia, fecha, observaciones, cliente_id FROM recogidas ORDER BY fecha DESC;")
-    clientes_list = db_fetchall_dict("SELECT id, nombre, telefono, direccion, ciudad, contacto FROM clientes ORDER BY nombre;")
-
-    globals()["despachos"]  = despachos_list
-    globals()["recepciones"] = recepciones_list
-    globals()["recogidas"]   = recogidas_list
-    globals()["clientes"]    = clientes_list
-
-# Inicializa
-logging.basicConfig(level=logging.INFO)
-ensure_schema()
-cargar_datos_desde_db()
+def _paginar(sql, params, claves):
+    """Una página de la vista actual según ?cursor=, ?n= y ?total=1."""
+    return paginacion.paginar(
+        db_fetchall_dict, sql, params, claves,
+        cursor=request.args.get('cursor'),
+        tamano=request.args.get('n'),
+        estimar=db_fetchone_dict if request.args.get('total') == '1' else None,
+    )
+
+@app.template_global()
+def url_pagina(cursor=None, **cambios):
+    """URL de la vista actual con los mismos filtros, otro cursor y `cambios`."""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    if cursor:
+        args['cursor'] = cursor
+    args.update(cambios)
+    return url_for(request.endpoint, **args)
 
 # =========================
-#   Util: Excel en memoria
+#   Trabajos en segundo plano (ver trabajos.py)
 # =========================
 
-def df_to_excel_download(df: pd.DataFrame, base_name: str, sheet_name: str = "Hoja1", date_format: str | None = None):
+# Trabajos simultáneos por tipo; cada uno ocupa una conexión del pool mientras corre
+LIMITES_TRABAJOS = {tipo: int(os.getenv(f"TRABAJOS_{tipo.upper()}", "1")) for tipo in ('carga', 'lote', 'export')}
+# Lotes por archivo con más guías que esto se procesan en segundo plano
+LOTE_SEGUNDO_PLANO = int(os.getenv("LOTE_SEGUNDO_PLANO", "2000"))
+
+@contextmanager
+def conexion_corta():
     """
-    Genera un Excel en memoria:
-    - Auto-anchos
-    - Formato de fecha configurable (default 'yyyy-mm-dd hh:mm:ss')
+    Conexión propia, fuera del pool, que se cierra al salir. Para el avance de
+    los trabajos: el trabajo ya ocupa una del pool y tomar otra por cada
+    avance competiría con las páginas (o agotaría el pool con varios a la vez).
     """
-    if df is None:
-        df = pd.DataFrame()
+    conn = psycopg2.connect(DATABASE_URL, connect_timeout=5)
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+# Los resultados quedan en disco local: los ve cualquier worker de la misma instancia
+cola_trabajos = trabajos.Trabajos(get_conn, os.path.join(DATA_DIR, "trabajos"), LIMITES_TRABAJOS,
+                                  conectar_progreso=conexion_corta)
+
+def _contar(progreso, filas, por_elemento=len):
+    for elemento in filas:
+        yield elemento
+        progreso.avanzar(por_elemento(elemento))
+
+def _trabajo_carga(progreso, lotes_guias):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return ingestar_guias(cur, _contar(progreso, lotes_guias))
+
+def _trabajo_lote(progreso, nombre, procesar, cantidad):
+    """procesar(cur) -> resultados de lotes.*_lote; el detalle queda en un CSV descargable."""
+    progreso.fijar_total(cantidad)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            resultados = procesar(cur)
+    progreso.avanzar(cantidad)
 
-    # Normaliza fechas a naive (excel-friendly)
-    for col in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            try:
-                df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
-            except Exception:
-                pass
-
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        sheet = sheet_name
-        (df if not df.empty else pd.DataFrame(columns=list(df.columns))).to_excel(
-            writer, index=False, sheet_name=sheet
-        )
-
-        ws = writer.sheets[sheet]
-        # auto width
-        for idx, col in enumerate(df.columns if len(df.columns) else [" "], start=1):
-            if df.empty:
-                max_len = len(str(col))
-            else:
-                max_len = max([len(str(col))] + [len(str(x)) for x in df[col].astype(str).values])
-            ws.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
-
-        # formato de fecha por nombre de columna típica
-        fmt = date_format if date_format else "yyyy-mm-dd hh:mm:ss"
-        for name in df.columns:
-            if "fecha" in name.lower():
-                col_idx = list(df.columns).index(name) + 1
-                for row in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx, max_row=ws.max_row):
-                    for cell in row:
-                        cell.number_format = fmt
-
-    buffer.seek(0)
     stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{base_name}_{stamp}.xlsx"
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    columnas = ['numero_guia', 'resultado', 'detalle']
+    filas = [tuple(r[c] for c in columnas) for r in resultados]
+    with open(progreso.ruta_resultado('csv', f"{nombre}_{stamp}.csv"), 'wb') as f:
+        for trozo in exportar.trozos('csv', [exportar.Hoja(nombre, columnas, iter(filas))]):
+            f.write(trozo)
+
+    conteo = {}
+    for r in resultados:
+        conteo[r['resultado']] = conteo.get(r['resultado'], 0) + 1
+    return conteo
+
+def _trabajo_export(progreso, formato, hojas, download_name):
+    _, ext = exportar.FORMATOS[formato]
+    with get_conn() as conn:
+        lista = hojas(conn)
+        for hoja in lista:
+            hoja.filas = _contar(progreso, hoja.filas, por_elemento=lambda _: 1)
+        with open(progreso.ruta_resultado(ext, download_name), 'wb') as f:
+            for trozo in exportar.trozos(formato, lista):
+                f.write(trozo)
+    return {'filas': progreso.progreso}
+
+# =========================
+#   Exportaciones en streaming (ver exportar.py y cache_export.py)
+# =========================
+
+EXPORT_CACHE_MB = int(os.getenv("EXPORT_CACHE_MB", "500"))  # 0 = sin cache
+cache_exports = CacheExport(os.getenv("EXPORT_CACHE_DIR", os.path.join(DATA_DIR, "exports")),
+                            EXPORT_CACHE_MB * 1024 * 1024)
+
+def exportar_respuesta(base_name: str, hojas, formato: str | None = None, tablas=()):
+    """
+    Respuesta por trozos. `hojas(conn)` devuelve la lista de exportar.Hoja y se
+    llama dentro del generador: la conexión queda tomada solo mientras se envía.
+    Formato: xlsx (defecto), csv o csv.gz, por argumento o por ?formato=.
+    Con ?segundo_plano=1 se genera como trabajo y se redirige a su estado.
+
+    tablas: las que lee el export. Si se indican, el resultado se guarda en
+    cache_exports con su versión y se responde con ETag; mientras ninguna
+    cambie, se sirve el archivo (o un 304) sin volver a consultar.
+    """
+    formato = exportar.formato_valido(formato or request.args.get('formato'))
+    mimetype, ext = exportar.FORMATOS[formato]
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    download_name = f"{base_name}_{stamp}.{ext}"
+
+    if request.args.get('segundo_plano') == '1':
+        id_trabajo = cola_trabajos.encolar('export', _trabajo_export, formato, hojas, download_name,
+                                           descripcion=f"Exportación {download_name}")
+        return redirect(url_for('ver_trabajo', id_trabajo=id_trabajo))
+
+    clave = None
+    if tablas and cache_exports.activo:
+        versiones = _leer_versiones()
+        clave = cache_exports.clave(request.endpoint, request.args.items(multi=True), formato,
+                                    {t: versiones.get(t, 0) for t in tablas})
+        if clave in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{clave}"', "Cache-Control": "private, no-cache"})
+        ruta = cache_exports.buscar(clave, ext)
+        if ruta:
+            resp = send_file(ruta, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                             etag=clave, conditional=True)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+
+    def generar():
+        with get_conn() as conn:
+            yield from exportar.trozos(formato, hojas(conn))
+
+    cuerpo = cache_exports.guardar(clave, ext, generar()) if clave else generar()
+    headers = {"Content-Disposition": f'attachment; filename="{download_name}"'}
+    if clave:
+        headers.update({"ETag": f'"{clave}"', "Cache-Control": "private, no-cache"})
+    return Response(stream_with_context(cuerpo), mimetype=mimetype, headers=headers)
+
+def exportar_consulta(sql, params, base_name: str, sheet_name: str = "Hoja1", date_format: str | None = None,
+                      tablas=()):
+    """Export de una sola consulta, leída con cursor del lado del servidor."""
+    return exportar_respuesta(base_name, lambda conn: [
+        exportar.hoja_desde_consulta(conn, sheet_name, sql, params, formato_fecha=date_format)
+    ], tablas=tablas)
 
 # =========================
 #          Rutas
@@ -1174,32 +545,32 @@ def index():
 
 @app.route("/cargar_base", methods=["GET", "POST"])
 def cargar_base():
-    global guias
     if request.method == 'POST':
         archivo = request.files.get('archivo_excel')
         if archivo:
-            df = pd.read_excel(archivo)
-            required_cols = ['remitente', 'numero_guia', 'destinatario', 'direccion', 'ciudad']
-            if all(col in df.columns for col in required_cols):
-                with get_conn() as conn:
-                    cur = conn.cursor()
-                    for _, row in df.iterrows():
-                        numero = str(row['numero_guia'])
-                        cur.execute("SELECT 1 FROM guias WHERE numero_guia = %s;", (numero,))
-                        existe = cur.fetchone()
-                        if not existe:
-                            cur.execute("""
-                                INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
-                                VALUES (%s, %s, %s, %s, %s);
-                            """, (row['remitente'], numero, row['destinatario'], row['direccion'], row['ciudad']))
-                guias = read_sql_df("SELECT remitente, numero_guia, destinatario, direccion, ciudad FROM guias;")
-                globals()["guias"] = guias
-
-                # Guardar archivo (efímero en Render, útil para debug)
-                archivo.save(os.path.join(DATA_DIR, archivo.filename))
-                flash('Base de datos cargada correctamente.', 'success')
-            else:
-                flash('El archivo debe contener las columnas: ' + ", ".join(required_cols), 'danger')
+            nombre = os.path.basename(archivo.filename or '')
+            if not nombre.lower().endswith(('.xlsx', '.csv')):
+                flash('El archivo debe ser .xlsx o .csv', 'danger')
+                return render_template('cargar_base.html')
+
+            # Se guarda primero (efímero en Render, útil para debug) y se lee
+            # desde disco por lotes: la base nunca se carga completa en memoria.
+            ruta = os.path.join(DATA_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}_{nombre}")
+            archivo.save(ruta)
+            try:
+                filas = leer_lotes(ruta)
+            except ColumnasFaltantes:
+                flash('El archivo debe contener las columnas: ' + ", ".join(COLUMNAS_GUIAS), 'danger')
+                return render_template('cargar_base.html')
+            except Exception:
+                logging.exception("No se pudo leer %s", ruta)
+                flash('No se pudo leer el archivo. Verifique que sea un .xlsx o .csv válido.', 'danger')
+                return render_template('cargar_base.html')
+
+            # COPY a tabla temporal + un solo INSERT ... ON CONFLICT, en segundo
+            # plano: el encabezado ya se validó, el resto no bloquea la petición
+            id_trabajo = cola_trabajos.encolar('carga', _trabajo_carga, filas, descripcion=f"Carga de base {nombre}")
+            return redirect(url_for('ver_trabajo', id_trabajo=id_trabajo))
     return render_template('cargar_base.html')
 
 @app.route("/registrar_zona", methods=["GET", "POST"])
@@ -1214,14 +585,15 @@ def registrar_zona():
                 if existe:
                     flash('La zona ya existe', 'warning')
                 else:
-                    db_exec("INSERT INTO zonas(nombre, tarifa) VALUES (%s, %s);", (nombre, tarifa_float))
+                    _, version = db_escribir("INSERT INTO zonas(nombre, tarifa) VALUES (%s, %s);",
+                                             (nombre, tarifa_float), 'zonas')
+                    cache.aplicar('zonas', version, _delta_referencia('zonas', [nombre], {"nombre": nombre, "tarifa": tarifa_float}))
                     flash(f'Zona {nombre} registrada con tarifa {tarifa_float}', 'success')
-                cargar_datos_desde_db()
             except ValueError:
                 flash('Tarifa inválida, debe ser un número', 'danger')
         else:
             flash('Debe completar todos los campos', 'danger')
-    return render_template('registrar_zona.html', zonas=zonas)
+    return render_template('registrar_zona.html', zonas=get_zonas())
 
 @app.route("/registrar_mensajero", methods=["GET", "POST"])
 def registrar_mensajero():
@@ -1229,7 +601,7 @@ def registrar_mensajero():
         nombre = request.form.get('nombre')
         zona_nombre = request.form.get('zona')
         if nombre and zona_nombre:
-            zona_obj = next((z for z in zonas if z.nombre == zona_nombre), None)
+            zona_obj = next((z for z in get_zonas() if z.nombre == zona_nombre), None)
             if not zona_obj:
                 flash('Zona no encontrada', 'danger')
                 return redirect(url_for('registrar_mensajero'))
@@ -1238,12 +610,21 @@ def registrar_mensajero():
             if existe:
                 flash('El mensajero ya existe', 'warning')
             else:
-                db_exec("INSERT INTO mensajeros(nombre, zona) VALUES (%s, %s);", (nombre, zona_nombre))
+                _, version = db_escribir("INSERT INTO mensajeros(nombre, zona) VALUES (%s, %s);",
+                                         (nombre, zona_nombre), 'mensajeros')
+                cache.aplicar('mensajeros', version, _delta_referencia('mensajeros', [nombre], {"nombre": nombre, "zona": zona_nombre}))
                 flash(f'Mensajero {nombre} registrado en zona {zona_nombre}', 'success')
-            cargar_datos_desde_db()
         else:
             flash('Debe completar todos los campos', 'danger')
-    return render_template('registrar_mensajero.html', zonas=zonas, mensajeros=mensajeros)
+    return render_template('registrar_mensajero.html', zonas=get_zonas(), mensajeros=get_mensajeros())
+
+# Máximo de líneas por mensaje flash (la sesión viaja en una cookie de ~4 KB)
+MAX_LINEAS_FLASH = 50
+
+def _lineas_flash(lineas: list) -> str:
+    if len(lineas) <= MAX_LINEAS_FLASH:
+        return "<br>".join(lineas)
+    return "<br>".join(lineas[:MAX_LINEAS_FLASH]) + f"<br>... y {len(lineas) - MAX_LINEAS_FLASH} más"
 
 @app.route("/despachar_guias", methods=["GET", "POST"])
 def despachar_guias():
@@ -1251,205 +632,182 @@ def despachar_guias():
         mensajero_nombre = request.form.get('mensajero')
         guias_input = request.form.get('guias', '')
         guias_list = [g.strip() for g in guias_input.strip().splitlines() if g.strip()]
+
+        # Lista también desde archivo (.txt / .csv), una o varias por línea
+        archivo = request.files.get('archivo_guias')
+        if archivo and archivo.filename:
+            if not archivo.filename.lower().endswith(('.txt', '.csv')):
+                flash('El archivo debe ser .txt o .csv', 'danger')
+                return redirect(url_for('despachar_guias'))
+            guias_list += _parse_txt_guias(archivo)
+
         fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        mensajero_obj = next((m for m in mensajeros if m.nombre == mensajero_nombre), None)
+        mensajero_obj = next((m for m in get_mensajeros() if m.nombre == mensajero_nombre), None)
 
         if not mensajero_obj:
             flash('Mensajero no encontrado', 'danger')
             return redirect(url_for('despachar_guias'))
+        if not guias_list:
+            flash('Debe ingresar guías o subir un archivo.', 'warning')
+            return redirect(url_for('despachar_guias'))
 
         zona_obj = mensajero_obj.zona
         errores, exito = [], []
 
+        if len(guias_list) > LOTE_SEGUNDO_PLANO:
+            zona_nombre = zona_obj.nombre if zona_obj else None
+            id_trabajo = cola_trabajos.encolar(
+                'lote', _trabajo_lote, 'despacho',
+                lambda cur: lotes.despachar_lote(cur, guias_list, mensajero_nombre, zona_nombre, fecha),
+                len(guias_list), descripcion=f"Despacho de {len(guias_list)} guías a {mensajero_nombre}")
+            return redirect(url_for('ver_trabajo', id_trabajo=id_trabajo))
+
+        # Una consulta de validación + un INSERT para todo el lote
         with get_conn() as conn:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            for numero in guias_list:
-                # guía existe
-                cur.execute("SELECT 1 FROM guias WHERE numero_guia = %s;", (numero,))
-                if not cur.fetchone():
-                    errores.append(f'Guía {numero} no existe (FALTANTE)')
-                    continue
-                # ya recepcionada?
-                cur.execute("SELECT * FROM recepciones WHERE numero_guia = %s;", (numero,))
-                recepcion_existente = cur.fetchone()
-                if recepcion_existente:
-                    errores.append(f"Guía {numero} ya fue {recepcion_existente['tipo']}")
-                    continue
-                # ya despachada?
-                cur.execute("SELECT * FROM despachos WHERE numero_guia = %s;", (numero,))
-                despacho_existente = cur.fetchone()
-                if despacho_existente:
-                    errores.append(f'Guía {numero} ya fue despachada a {despacho_existente["mensajero"]}')
-                    continue
-                # insertar
-                cur.execute("""
-                    INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
-                    VALUES (%s, %s, %s, %s);
-                """, (numero, mensajero_nombre, zona_obj.nombre if zona_obj else None, fecha))
+            with conn.cursor() as cur:
+                resultados = lotes.despachar_lote(cur, guias_list, mensajero_nombre,
+                                                   zona_obj.nombre if zona_obj else None, fecha)
+
+        for r in resultados:
+            numero = r['numero_guia']
+            if r['resultado'] == lotes.FALTANTE:
+                errores.append(f'Guía {numero} no existe (FALTANTE)')
+            elif r['resultado'] == lotes.RECEPCIONADA:
+                errores.append(f"Guía {numero} ya fue {r['detalle']}")
+            elif r['resultado'] == lotes.DESPACHADA:
+                errores.append(f"Guía {numero} ya fue despachada a {r['detalle']}")
+            else:
                 exito.append(f'Guía {numero} despachada a {mensajero_nombre}')
 
         if errores:
-            flash("Errores:<br>" + "<br>".join(errores), 'danger')
+            flash("Errores:<br>" + _lineas_flash(errores), 'danger')
         if exito:
-            flash("Despachos exitosos:<br>" + "<br>".join(exito), 'success')
-
-        cargar_datos_desde_db()
+            flash(f"Despachos exitosos ({len(exito)}):<br>" + _lineas_flash(exito), 'success')
         return redirect(url_for('ver_despacho'))
 
     return render_template('despachar_guias.html',
-                           mensajeros=[m.nombre for m in mensajeros],
-                           zonas=[z.nombre for z in zonas])
+                           mensajeros=[m.nombre for m in get_mensajeros()],
+                           zonas=[z.nombre for z in get_zonas()])
 
 # ---------- Ver despachos (RESUMEN) + export ----------
 
-@app.route("/ver_despacho")
-def ver_despacho():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
+def _sql_despacho(args):
+    mensa = (args.get('mensajero') or '').strip()
+    fi = (args.get('fi') or '').strip()
+    ff = (args.get('ff') or '').strip()
 
+    # Resumen precalculado (despachos_diarios, mantenido por trigger):
+    # fecha es el día en ZONA_NEGOCIO y mensajero/zona nunca son NULL.
+    f = Filtros().igual('mensajero', mensa).rango_dias('fecha', fi, ff)
     sql = """
-        SELECT
-            DATE(d.fecha) AS fecha,
-            d.mensajero,
-            d.zona,
-            COUNT(*) AS total_guias
-        FROM despachos d
+        SELECT fecha, mensajero, zona, total AS total_guias
+        FROM despachos_diarios
         WHERE 1=1
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " GROUP BY DATE(d.fecha), d.mensajero, d.zona ORDER BY DATE(d.fecha) DESC"
-
-    resumen = db_fetchall_dict(sql, params=params)
+    """ + f.sql
+    return sql, f.params
+
+CLAVES_DESPACHO = [('fecha', 'fecha', date), ('mensajero', 'mensajero', str), ('zona', 'zona', str)]
+
+@app.route("/ver_despacho")
+def ver_despacho():
+    sql, params = _sql_despacho(request.args)
+    pagina = _paginar(sql, params, CLAVES_DESPACHO)
 
     return render_template(
         'ver_despacho.html',
-        resumen=resumen,
-        mensajeros=[m.nombre for m in mensajeros],
-        mensajero_sel=mensa,
-        fi=fi, ff=ff
+        resumen=pagina.filas,
+        pagina=pagina,
+        mensajeros=[m.nombre for m in get_mensajeros()],
+        mensajero_sel=(request.args.get('mensajero') or '').strip(),
+        fi=(request.args.get('fi') or '').strip(),
+        ff=(request.args.get('ff') or '').strip()
     )
 
 @app.get("/ver_despacho/export")
 def export_despacho():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
+    sql, params = _sql_despacho(request.args)
+    sql += " ORDER BY fecha DESC, mensajero DESC, zona DESC"
 
-    sql = """
-        SELECT
-            DATE(d.fecha) AS fecha,
-            d.mensajero,
-            d.zona,
-            COUNT(*) AS total_guias
-        FROM despachos d
-        WHERE 1=1
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " GROUP BY DATE(d.fecha), d.mensajero, d.zona ORDER BY DATE(d.fecha) DESC"
-
-    df = read_sql_df(sql, params=params)
-    return df_to_excel_download(df, base_name="despachos_resumen", sheet_name="Resumen", date_format="yyyy-mm-dd")
+    return exportar_consulta(sql, params, base_name="despachos_resumen", sheet_name="Resumen", date_format="yyyy-mm-dd",
+                             tablas=("despachos",))
 
 # ---------- PENDIENTE + export ----------
 
-@app.route("/pendiente")
-def pendiente():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
+def _filtros_pendiente(args):
+    return (Filtros(ZONA_NEGOCIO)
+            .igual('g.mensajero', args.get('mensajero'))
+            .rango_fechas('g.fecha_despacho', args.get('fi'), args.get('ff')))
 
-    # Despachos sin recepción
+def _sql_pendiente(args):
+    # Despachadas sin recepción: el estado guardado en `guias` (índice parcial
+    # idx_guias_pendientes*), sin cruzar despachos con recepciones
     sql = """
         SELECT
-            d.numero_guia,
-            d.mensajero,
-            d.zona,
-            d.fecha     AS fecha_asignada,
+            g.numero_guia,
+            g.mensajero,
+            g.zona,
+            g.fecha_despacho AS fecha_asignada,
             g.remitente,
             g.destinatario,
             g.direccion,
             g.ciudad
-        FROM despachos d
-        LEFT JOIN recepciones r ON r.numero_guia = d.numero_guia
-        LEFT JOIN guias g       ON g.numero_guia = d.numero_guia
-        WHERE r.numero_guia IS NULL
+        FROM guias g
+        WHERE g.estado = 'DESPACHADA'
+    """
+    f = _filtros_pendiente(args)
+    return sql + f.sql, f.params
+
+CLAVES_PENDIENTE = [('g.fecha_despacho', 'fecha_asignada', datetime), ('g.numero_guia', 'numero_guia', str)]
+
+def _sql_antiguedad(args):
     """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " ORDER BY d.fecha DESC"
-
-    rows = db_fetchall_dict(sql, params=params)
+    Pendientes por mensajero en tramos de días desde el despacho (0-1, 2-3 y
+    4 o más), en días de ZONA_NEGOCIO. Sale de pendientes_diarios: una fila
+    por día y mensajero con pendientes, sin recorrer las guías.
+    """
+    f = (Filtros()
+         .igual('p.mensajero', args.get('mensajero'))
+         .rango_dias('p.fecha', args.get('fi'), args.get('ff')))
+    sql = f"""
+        WITH hoy AS (SELECT (now() AT TIME ZONE %s)::date AS dia)
+        SELECT p.mensajero,
+               COALESCE(SUM(p.total) FILTER (WHERE p.fecha >= hoy.dia - 1), 0)::int AS dias_0_1,
+               COALESCE(SUM(p.total) FILTER (WHERE p.fecha <  hoy.dia - 1
+                                               AND p.fecha >= hoy.dia - 3), 0)::int AS dias_2_3,
+               COALESCE(SUM(p.total) FILTER (WHERE p.fecha <  hoy.dia - 3), 0)::int AS dias_4_mas,
+               SUM(p.total)::int AS total
+        FROM pendientes_diarios p, hoy
+        WHERE TRUE{f.sql}
+        GROUP BY p.mensajero
+        ORDER BY p.mensajero;
+    """
+    return sql, [ZONA_NEGOCIO] + f.params
+
+@app.route("/pendiente")
+def pendiente():
+    sql, params = _sql_pendiente(request.args)
+    pagina = _paginar(sql, params, CLAVES_PENDIENTE)
+    antiguedad = db_fetchall_dict(*_sql_antiguedad(request.args))
     return render_template("pendiente.html",
-                           rows=rows,
-                           mensajeros=[m.nombre for m in mensajeros],
-                           mensajero_sel=mensa,
-                           fi=fi, ff=ff)
+                           rows=pagina.filas,
+                           pagina=pagina,
+                           antiguedad=antiguedad,
+                           mensajeros=[m.nombre for m in get_mensajeros()],
+                           mensajero_sel=(request.args.get('mensajero') or '').strip(),
+                           fi=(request.args.get('fi') or '').strip(),
+                           ff=(request.args.get('ff') or '').strip())
 
 @app.get("/pendiente/export")
 def pendiente_export():
-    mensa = (request.args.get('mensajero') or '').strip()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
+    sql, params = _sql_pendiente(request.args)
+    sql += " ORDER BY g.fecha_despacho DESC, g.numero_guia DESC"
 
-    sql = """
-        SELECT
-            d.numero_guia,
-            d.mensajero,
-            d.zona,
-            d.fecha     AS fecha_asignada,
-            g.remitente,
-            g.destinatario,
-            g.direccion,
-            g.ciudad
-        FROM despachos d
-        LEFT JOIN recepciones r ON r.numero_guia = d.numero_guia
-        LEFT JOIN guias g       ON g.numero_guia = d.numero_guia
-        WHERE r.numero_guia IS NULL
-    """
-    params = []
-    if mensa:
-        sql += " AND d.mensajero = %s"
-        params.append(mensa)
-    if fi:
-        sql += " AND DATE(d.fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(d.fecha) <= %s"
-        params.append(ff)
-    sql += " ORDER BY d.fecha DESC"
-
-    df = read_sql_df(sql, params=params)
-    return df_to_excel_download(df, base_name="pendiente", sheet_name="Pendiente", date_format="yyyy-mm-dd")
+    # Despachos y recepciones se reflejan en `guias` en la misma transacción
+    return exportar_consulta(sql, params, base_name="pendiente", sheet_name="Pendiente", date_format="yyyy-mm-dd",
+                             tablas=("guias",))
 
 # ---------- Registrar / ver recepciones + export ----------
-# Soporte de importación por TXT para ENTREGADA
+# Soporte de importación por TXT (lote) para ENTREGADA y DEVUELTA
 
 def _parse_txt_guias(file_storage) -> list:
     """
@@ -1461,7 +819,10 @@ def _parse_txt_guias(file_storage) -> list:
         text = raw.decode('utf-8', errors='ignore')
     except Exception:
         text = raw.decode('latin-1', errors='ignore')
+    return _guias_desde_texto(text)
 
+def _guias_desde_texto(text: str) -> list:
+    """Guías de un texto, una por línea o separadas por comas/espacios, sin duplicados."""
     # Normaliza separadores
     text = text.replace(',', '\n').replace('\r', '\n')
     tokens = []
@@ -1483,6 +844,37 @@ def _parse_txt_guias(file_storage) -> list:
             seen.add(t)
     return gui_list
 
+def _parse_txt_recepciones(file_storage) -> tuple:
+    """
+    Lee un FileStorage con líneas `numero_guia[,motivo]` (también ; o tab).
+    Devuelve (items, invalidas): items es la lista de (numero_guia, motivo);
+    invalidas, las líneas sin guía o con espacios en la guía (p. ej. varias
+    guías en una línea, como en ENTREGADA), como (número de línea, texto).
+    """
+    raw = file_storage.read()
+    try:
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = raw.decode('latin-1', errors='ignore')
+
+    items, invalidas = [], []
+    for n, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        for sep in (',', ';', '\t'):
+            if sep in line:
+                numero, motivo = line.split(sep, 1)
+                break
+        else:
+            numero, motivo = line, ''
+        numero = numero.strip()
+        if not numero or len(numero.split()) > 1:
+            invalidas.append((n, line))
+            continue
+        items.append((numero, motivo.strip()))
+    return items, invalidas
+
 @app.route("/registrar_recepcion", methods=["GET", "POST"])
 def registrar_recepcion():
     if request.method == 'POST':
@@ -1492,73 +884,76 @@ def registrar_recepcion():
 
         archivo_txt = request.files.get('archivo_txt')
 
-        # ===== MODO LOTE por TXT (solo ENTREGADA) =====
-        if archivo_txt and tipo == 'ENTREGADA':
+        # ===== MODO LOTE por TXT (ENTREGADA o DEVUELTA) =====
+        if archivo_txt and tipo in ('ENTREGADA', 'DEVUELTA'):
             nombre_archivo = (archivo_txt.filename or '').lower()
-            if not nombre_archivo.endswith('.txt'):
-                flash('El archivo debe ser .txt', 'danger')
+            if not nombre_archivo.endswith(('.txt', '.csv')):
+                flash('El archivo debe ser .txt o .csv', 'danger')
                 return redirect(url_for('registrar_recepcion'))
 
-            guias_list = _parse_txt_guias(archivo_txt)
-            if not guias_list:
-                flash('El archivo .txt no contiene guías válidas.', 'warning')
+            # ENTREGADA conserva el formato libre (comas/espacios, sin motivo);
+            # DEVUELTA lee una guía por línea con motivo opcional.
+            if tipo == 'ENTREGADA':
+                items = [(g, '') for g in _parse_txt_guias(archivo_txt)]
+            else:
+                items, invalidas = _parse_txt_recepciones(archivo_txt)
+                if invalidas:
+                    # No se registra nada: mejor corregir el archivo que recepcionar a medias
+                    flash(f"El archivo tiene {len(invalidas)} líneas que no son numero_guia,motivo "
+                          f"(una guía por línea); no se registró ninguna:<br>"
+                          + _lineas_flash([f"Línea {n}: {escape(texto[:120])}" for n, texto in invalidas]),
+                          'danger')
+                    return redirect(url_for('registrar_recepcion'))
+            if not items:
+                flash('El archivo no contiene guías válidas.', 'warning')
                 return redirect(url_for('registrar_recepcion'))
 
-            errores, exito = [], []
+            if len(items) > LOTE_SEGUNDO_PLANO:
+                id_trabajo = cola_trabajos.encolar(
+                    'lote', _trabajo_lote, 'recepcion',
+                    lambda cur: lotes.recepcionar_lote(cur, items, tipo, fecha, motivo_defecto=motivo.strip()),
+                    len(items), descripcion=f"Recepción {tipo} de {len(items)} guías")
+                return redirect(url_for('ver_trabajo', id_trabajo=id_trabajo))
+
             with get_conn() as conn:
-                cur = conn.cursor(cursor_factory=RealDictCursor)
-                for numero_guia in guias_list:
-                    # Valida existencia de guía
-                    cur.execute("SELECT 1 AS x FROM guias WHERE numero_guia = %s;", (numero_guia,))
-                    if not cur.fetchone():
-                        errores.append(f'Guía {numero_guia}: no existe en la base (FALTANTE)')
-                        continue
-
-                    # Debe estar despachada
-                    cur.execute("SELECT * FROM despachos WHERE numero_guia = %s;", (numero_guia,))
-                    despacho_existente = cur.fetchone()
-                    if not despacho_existente:
-                        errores.append(f'Guía {numero_guia}: no ha sido despachada aún')
-                        continue
-
-                    # No debe estar recepcionada
-                    cur.execute("SELECT 1 AS x FROM recepciones WHERE numero_guia = %s;", (numero_guia,))
-                    if cur.fetchone():
-                        errores.append(f'Guía {numero_guia}: ya está recepcionada')
-                        continue
-
-                    # Inserta recepción ENTREGADA (motivo vacío)
-                    cur.execute("""
-                        INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
-                        VALUES (%s, %s, %s, %s);
-                    """, (numero_guia, 'ENTREGADA', '', fecha))
-                    exito.append(f'Guía {numero_guia}: ENTREGADA')
+                with conn.cursor() as cur:
+                    resultados = lotes.recepcionar_lote(cur, items, tipo, fecha, motivo_defecto=motivo.strip())
+
+            errores, exito = [], []
+            for r in resultados:
+                numero_guia = r['numero_guia']
+                if r['resultado'] == lotes.FALTANTE:
+                    errores.append(f'Guía {numero_guia}: no existe en la base (FALTANTE)')
+                elif r['resultado'] == lotes.SIN_DESPACHO:
+                    errores.append(f'Guía {numero_guia}: no ha sido despachada aún')
+                elif r['resultado'] == lotes.RECEPCIONADA:
+                    errores.append(f"Guía {numero_guia}: ya está recepcionada ({r['detalle']})")
+                else:
+                    exito.append(f'Guía {numero_guia}: {tipo}')
 
             if errores:
-                flash("Errores en lote:<br>" + "<br>".join(errores), 'danger')
+                flash(f"Errores en lote ({len(errores)}):<br>" + _lineas_flash(errores), 'danger')
             if exito:
-                flash("Recepciones registradas:<br>" + "<br>".join(exito), 'success')
-
-            cargar_datos_desde_db()
+                flash(f"Recepciones registradas ({len(exito)}):<br>" + _lineas_flash(exito), 'success')
             return redirect(url_for('registrar_recepcion'))
 
         # ===== MODO INDIVIDUAL (comportamiento existente) =====
         numero_guia = request.form.get('numero_guia', '').strip()
         if not numero_guia:
-            flash('Debe ingresar un número de guía o subir un .txt (si ENTREGADA).', 'warning')
+            flash('Debe ingresar un número de guía o subir un .txt.', 'warning')
             return redirect(url_for('registrar_recepcion'))
 
-        existe_guia = db_fetchone_dict("SELECT 1 AS x FROM guias WHERE numero_guia = %s;", (numero_guia,))
+        existe_guia = db_fetchone_preparada('guia_existe', (numero_guia,))
         if not existe_guia:
             flash('Número de guía no existe en la base (FALTANTE)', 'danger')
             return redirect(url_for('registrar_recepcion'))
 
-        despacho_existente = db_fetchone_dict("SELECT * FROM despachos WHERE numero_guia = %s;", (numero_guia,))
+        despacho_existente = db_fetchone_preparada('despacho_guia', (numero_guia,))
         if not despacho_existente:
             flash('La guía no ha sido despachada aún', 'warning')
             return redirect(url_for('registrar_recepcion'))
 
-        recepcion_existente = db_fetchone_dict("SELECT 1 AS x FROM recepciones WHERE numero_guia = %s;", (numero_guia,))
+        recepcion_existente = db_fetchone_preparada('recepcion_existe', (numero_guia,))
         if recepcion_existente:
             flash('La recepción para esta guía ya está registrada', 'warning')
             return redirect(url_for('registrar_recepcion'))
@@ -1569,211 +964,188 @@ def registrar_recepcion():
         """, (numero_guia, tipo, (motivo if tipo == 'DEVUELTA' else ''), fecha))
 
         flash(f'Recepción de guía {numero_guia} registrada como {tipo}', 'success')
-        cargar_datos_desde_db()
         return redirect(url_for('registrar_recepcion'))
 
     return render_template('registrar_recepcion.html')
 
+def _sql_recepciones(args):
+    f = (Filtros(ZONA_NEGOCIO)
+         .contiene('numero_guia', args.get('numero_guia'))
+         .igual('tipo', (args.get('tipo') or '').upper())  # ENTREGADA/DEVUELTA
+         .rango_fechas('fecha', args.get('fi'), args.get('ff')))
+    sql = """
+        SELECT numero_guia, tipo, motivo, fecha
+        FROM recepciones
+        WHERE 1=1
+    """ + f.sql
+    return sql, f.params
+
+# Orden de la vista: el mismo del export, con numero_guia para desempatar
+CLAVES_RECEPCIONES = [('fecha', 'fecha', datetime), ('numero_guia', 'numero_guia', str)]
+
 @app.route("/ver_recepciones")
 def ver_recepciones():
-    numero = (request.args.get('numero_guia') or '').strip().lower()
-    tipo = (request.args.get('tipo') or '').strip().upper()  # ENTREGADA/DEVUELTA
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-
-    lista = recepciones
-    if numero:
-        lista = [r for r in lista if numero in (r['numero_guia'] or '').lower()]
-    if tipo:
-        lista = [r for r in lista if (r['tipo'] or '').upper() == tipo]
-    if fi:
-        lista = [r for r in lista if str(r['fecha'])[:10] >= fi]
-    if ff:
-        lista = [r for r in lista if str(r['fecha'])[:10] <= ff]
-
-    return render_template('ver_recepciones.html', recepciones=list(lista))
+    sql, params = _sql_recepciones(request.args)
+    pagina = _paginar(sql, params, CLAVES_RECEPCIONES)
+    return render_template('ver_recepciones.html', recepciones=pagina.filas, pagina=pagina)
 
 @app.get("/ver_recepciones/export")
 def export_recepciones():
-    numero = (request.args.get('numero_guia') or '').strip().lower()
-    tipo = (request.args.get('tipo') or '').strip().upper()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
+    sql, params = _sql_recepciones(request.args)
+    sql += " ORDER BY fecha DESC, numero_guia DESC"
+    return exportar_consulta(sql, params, base_name="recepciones", sheet_name="Recepciones", date_format="yyyy-mm-dd",
+                             tablas=("recepciones",))
 
-    sql = """
-        SELECT numero_guia, tipo, motivo, fecha
-        FROM recepciones
-        WHERE 1=1
-    """
-    params = []
-    if numero:
-        sql += " AND LOWER(COALESCE(numero_guia,'')) LIKE %s"
-        params.append(f"%{numero}%")
-    if tipo:
-        sql += " AND UPPER(COALESCE(tipo,'')) = %s"
-        params.append(tipo)
-    if fi:
-        sql += " AND DATE(fecha) >= %s"
-        params.append(fi)
-    if ff:
-        sql += " AND DATE(fecha) <= %s"
-        params.append(ff)
-    sql += " ORDER BY fecha DESC"
-
-    df = read_sql_df(sql, params=params)
-    return df_to_excel_download(df, base_name="recepciones", sheet_name="Recepciones", date_format="yyyy-mm-dd")
-
-# ---------- Consulta estado ----------
+# ---------- Consulta estado (una o muchas guías) ----------
+
+MAX_GUIAS_CONSULTA = int(os.getenv("MAX_GUIAS_CONSULTA", "50000"))
+
+def _estados(numeros):
+    """Estados de `numeros` por lotes; la conexión queda tomada solo mientras se recorren."""
+    with get_conn() as conn:
+        yield from lotes.consultar_estados(conn, numeros)
 
 @app.route("/consultar_estado", methods=["GET", "POST"])
 def consultar_estado():
-    resultado = None
-    if request.method == 'POST':
-        numero_guia = request.form.get('numero_guia', '').strip()
-        if not numero_guia:
-            flash('Debe ingresar un número de guía', 'warning')
-            return redirect(url_for('consultar_estado'))
-
-        existe_guia = db_fetchone_dict("SELECT 1 AS x FROM guias WHERE numero_guia = %s;", (numero_guia,))
-        if not existe_guia:
-            resultado = {'numero_guia': numero_guia, 'estado': 'FALTANTE', 'motivo': '', 'mensajero': '', 'zona': '', 'fecha': ''}
-        else:
-            despacho = db_fetchone_dict("SELECT * FROM despachos WHERE numero_guia = %s;", (numero_guia,))
-            recepcion = db_fetchone_dict("SELECT * FROM recepciones WHERE numero_guia = %s;", (numero_guia,))
-
-            if recepcion:
-                estado = recepcion['tipo']
-                motivo = recepcion['motivo']
-                mensajero = despacho['mensajero'] if despacho else ''
-                zona = despacho['zona'] if despacho else ''
-                fecha = recepcion['fecha']
-            elif despacho:
-                estado = 'DESPACHADA'
-                motivo = ''
-                mensajero = despacho['mensajero']
-                zona = despacho['zona']
-                fecha = despacho['fecha']
-            else:
-                estado = 'EN VERIFICACION'
-                motivo = ''
-                mensajero = ''
-                zona = ''
-                fecha = ''
-
-            resultado = {
-                'numero_guia': numero_guia,
-                'estado': estado,
-                'motivo': motivo,
-                'mensajero': mensajero,
-                'zona': zona,
-                'fecha': fecha
-            }
-    return render_template('consultar_estado.html', resultado=resultado)
+    if request.method != 'POST':
+        return render_template('consultar_estado.html', resultado=None)
+
+    texto = request.form.get('guias', '') + '\n' + request.form.get('numero_guia', '')
+    numeros = _guias_desde_texto(texto)
+    archivo = request.files.get('archivo_guias')
+    if archivo and archivo.filename:
+        numeros = lotes.unicos(numeros + _parse_txt_guias(archivo))
+
+    if not numeros:
+        flash('Debe ingresar al menos un número de guía', 'warning')
+        return redirect(url_for('consultar_estado'))
+    if len(numeros) > MAX_GUIAS_CONSULTA:
+        flash(f'Máximo {MAX_GUIAS_CONSULTA} guías por consulta (llegaron {len(numeros)}).', 'warning')
+        return redirect(url_for('consultar_estado'))
+
+    if len(numeros) == 1:
+        resultado = db_fetchone_preparada('estado_guia', (numeros[0],)) or {
+            'numero_guia': numeros[0], 'estado': lotes.FALTANTE, 'motivo': '', 'mensajero': '', 'zona': '', 'fecha': None}
+        return render_template('consultar_estado.html', resultado=resultado)
+    # Muchas guías: la tabla se envía a medida que se leen los lotes
+    return Response(stream_template('consultar_estado.html', resultado=None,
+                                    filas=_estados(numeros), cantidad=len(numeros)))
+
+@app.route("/api/estado_guias", methods=["GET", "POST"])
+def api_estado_guias():
+    """
+    Estado de muchas guías en JSON. Acepta un cuerpo JSON (lista o
+    {"guias": [...]}), texto plano, o el parámetro `guias` separado por
+    comas/espacios/líneas. Responde {"total": n, "resultados": [...]} por trozos.
+    """
+    datos = request.get_json(silent=True)
+    if isinstance(datos, dict):
+        datos = datos.get('guias')
+    if isinstance(datos, list):
+        numeros = lotes.unicos(str(n) for n in datos if n is not None)
+    elif request.mimetype == 'text/plain':
+        numeros = _guias_desde_texto(request.get_data(as_text=True))
+    else:
+        numeros = _guias_desde_texto(request.values.get('guias', ''))
+
+    if not numeros:
+        return jsonify(ok=False, error='Debe enviar al menos un número de guía'), 400
+    if len(numeros) > MAX_GUIAS_CONSULTA:
+        return jsonify(ok=False, error=f'Máximo {MAX_GUIAS_CONSULTA} guías por consulta',
+                       recibidas=len(numeros)), 413
+
+    def generar():
+        yield f'{{"total": {len(numeros)}, "resultados": ['
+        separador, partes = '', []
+        for fila in _estados(numeros):
+            partes.append(json.dumps(fila, ensure_ascii=False, default=lambda v: v.isoformat()))
+            if len(partes) >= lotes.TAMANO_LOTE_CONSULTA:
+                yield separador + ','.join(partes)
+                separador, partes = ',', []
+        if partes:
+            yield separador + ','.join(partes)
+        yield ']}'
+
+    return Response(stream_with_context(generar()), mimetype='application/json')
 
 # ---------- Liquidación + export ----------
 
+def _periodo(fuente):
+    """(fecha_inicio, fecha_fin) como date desde un form/args, o None si no son válidas."""
+    try:
+        fi = date.fromisoformat((fuente.get('fecha_inicio') or '').strip())
+        ff = date.fromisoformat((fuente.get('fecha_fin') or '').strip())
+    except ValueError:
+        return None
+    # date.max no sirve de fin: liquidar() consulta hasta el día siguiente
+    return (fi, ff) if fi <= ff < date.max else None
+
 @app.route("/liquidacion", methods=["GET", "POST"])
 def liquidacion():
     liquidacion = None
     if request.method == 'POST':
-        mensajero_nombre = request.form.get('mensajero')
-        fecha_inicio = request.form.get('fecha_inicio')
-        fecha_fin = request.form.get('fecha_fin')
-
-        try:
-            datetime.strptime(fecha_inicio, '%Y-%m-%d')
-            datetime.strptime(fecha_fin,  '%Y-%m-%d')
-        except Exception:
+        mensajero_nombre = (request.form.get('mensajero') or '').strip()
+        periodo = _periodo(request.form)
+        if not periodo:
             flash('Formato de fechas inválido', 'danger')
             return redirect(url_for('liquidacion'))
 
-        gui_despachadas = db_fetchall_dict(
-            'SELECT * FROM despachos WHERE mensajero = %s AND DATE(fecha) BETWEEN %s AND %s;',
-            (mensajero_nombre, fecha_inicio, fecha_fin)
-        )
-
-        cantidad_guias = len(gui_despachadas)
-        mensajero_obj = next((m for m in mensajeros if m.nombre == mensajero_nombre), None)
-        tarifa = mensajero_obj.zona.tarifa if mensajero_obj and mensajero_obj.zona else 0
-        total_pagar = cantidad_guias * tarifa
+        # Todos los mensajeros en una consulta (o la instantánea si el período ya cerró)
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                filas, creada = liquidaciones.liquidar(cur, *periodo, ZONA_NEGOCIO,
+                                                       recalcular=request.form.get('recalcular') == '1')
+        if mensajero_nombre:
+            filas = [f for f in filas if f['mensajero'] == mensajero_nombre]
 
         liquidacion = {
             'mensajero': mensajero_nombre,
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-            'cantidad_guias': cantidad_guias,
-            'tarifa': tarifa,
-            'total_pagar': total_pagar
+            'fecha_inicio': periodo[0].isoformat(),
+            'fecha_fin': periodo[1].isoformat(),
+            'filas': filas,
+            'creada': creada,
+            'cantidad_guias': sum(f['cantidad_guias'] for f in filas),
+            'total_pagar': sum(f['total_pagar'] for f in filas),
         }
-    return render_template('liquidacion.html', mensajeros=mensajeros, liquidacion=liquidacion)
+    return render_template('liquidacion.html', mensajeros=get_mensajeros(), liquidacion=liquidacion)
 
 @app.get("/liquidacion/export")
 def export_liquidacion():
     mensajero_nombre = (request.args.get('mensajero') or '').strip()
-    fecha_inicio = (request.args.get('fecha_inicio') or '').strip()
-    fecha_fin = (request.args.get('fecha_fin') or '').strip()
-
-    if not mensajero_nombre or not fecha_inicio or not fecha_fin:
-        df_empty = pd.DataFrame(columns=["mensajero", "fecha_inicio", "fecha_fin", "cantidad_guias", "tarifa", "total_pagar"])
-        return df_to_excel_download(df_empty, base_name="liquidacion", sheet_name="Resumen", date_format="yyyy-mm-dd")
-
-    df_detalle = read_sql_df("""
-        SELECT numero_guia, mensajero, zona, fecha
-        FROM despachos
-        WHERE mensajero = %s AND DATE(fecha) BETWEEN %s AND %s
-        ORDER BY fecha DESC
-    """, params=[mensajero_nombre, fecha_inicio, fecha_fin])
-
-    cantidad_guias = len(df_detalle)
-    mensajero_obj = next((m for m in mensajeros if m.nombre == mensajero_nombre), None)
-    tarifa = mensajero_obj.zona.tarifa if mensajero_obj and mensajero_obj.zona else 0
-    total_pagar = cantidad_guias * tarifa
-
-    df_resumen = pd.DataFrame([{
-        "mensajero": mensajero_nombre,
-        "fecha_inicio": fecha_inicio,
-        "fecha_fin": fecha_fin,
-        "cantidad_guias": cantidad_guias,
-        "tarifa": tarifa,
-        "total_pagar": total_pagar
-    }])
-
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        # Resumen
-        df_resumen.to_excel(writer, index=False, sheet_name="Resumen")
-        ws = writer.sheets["Resumen"]
-        for idx, col in enumerate(df_resumen.columns, start=1):
-            max_len = max([len(str(col))] + [len(str(x)) for x in df_resumen[col].astype(str).values])
-            ws.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
-        # Detalle
-        df_detalle2 = df_detalle.copy()
-        for col in df_detalle2.columns:
-            if pd.api.types.is_datetime64_any_dtype(df_detalle2[col]):
-                try:
-                    df_detalle2[col] = pd.to_datetime(df_detalle2[col]).dt.tz_localize(None)
-                except Exception:
-                    pass
-        df_detalle2.to_excel(writer, index=False, sheet_name="Detalle")
-        ws2 = writer.sheets["Detalle"]
-        for idx, col in enumerate(df_detalle2.columns, start=1):
-            max_len = max([len(str(col))] + [len(str(x)) for x in df_detalle2[col].astype(str).values]) if not df_detalle2.empty else len(str(col))
-            ws2.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
-        if "fecha" in df_detalle2.columns:
-            col_idx = list(df_detalle2.columns).index("fecha") + 1
-            for row in ws2.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx, max_row=ws2.max_row):
-                for cell in row:
-                    cell.number_format = "yyyy-mm-dd"
-
-    buffer.seek(0)
-    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"liquidacion_{stamp}.xlsx"
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    periodo = _periodo(request.args)
+    columnas_resumen = ["fecha_inicio", "fecha_fin"] + liquidaciones.COLUMNAS
+
+    if not periodo:
+        return exportar_respuesta("liquidacion", lambda conn: [
+            exportar.Hoja("Resumen", columnas_resumen, iter(()))
+        ], formato="xlsx")
+
+    f = (Filtros(ZONA_NEGOCIO)
+         .igual('mensajero', mensajero_nombre)
+         .rango_fechas('fecha', request.args.get('fecha_inicio'), request.args.get('fecha_fin')))
+
+    # Antes de armar la clave del cache: si el período cerró, liquidar() guarda
+    # la instantánea y sube la versión de `liquidaciones`; hecho dentro del
+    # generador, el archivo quedaría guardado con la versión anterior
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            filas, _ = liquidaciones.liquidar(cur, *periodo, ZONA_NEGOCIO)
+    resumen = [(periodo[0], periodo[1]) + tuple(fila[c] for c in liquidaciones.COLUMNAS)
+               for fila in filas if not mensajero_nombre or fila['mensajero'] == mensajero_nombre]
+
+    def hojas(conn):
+        # El detalle se lee por lotes
+        return [
+            exportar.Hoja("Resumen", columnas_resumen, iter(resumen), muestra=resumen, formato_fecha="yyyy-mm-dd"),
+            exportar.hoja_desde_consulta(conn, "Detalle", """
+                SELECT numero_guia, mensajero, zona, fecha
+                FROM despachos
+                WHERE TRUE
+            """ + f.sql + " ORDER BY fecha DESC", f.params, formato_fecha="yyyy-mm-dd"),
+        ]
+
+    return exportar_respuesta("liquidacion", hojas, formato="xlsx",
+                              tablas=("despachos", "mensajeros", "zonas", "liquidaciones"))
 
 # ---------- NUEVO: Clientes (crear/listar) ----------
 # Usamos endpoint explícito para que url_for('clientes_view') funcione seguro
@@ -1795,16 +1167,17 @@ def clientes_view():
         if ya:
             flash("Ese cliente ya existe.", "warning")
         else:
-            db_exec("""
+            fila, version = db_escribir("""
                 INSERT INTO clientes(nombre, telefono, direccion, ciudad, contacto)
-                VALUES (%s,%s,%s,%s,%s);
-            """, (nombre, telefono, direccion, ciudad, contacto))
+                VALUES (%s,%s,%s,%s,%s)
+                RETURNING id, nombre, telefono, direccion, ciudad, contacto;
+            """, (nombre, telefono, direccion, ciudad, contacto), 'clientes')
+            cache.aplicar('clientes', version, _delta_referencia('clientes', [fila["id"]], fila))
             flash("Cliente creado.", "success")
 
-        cargar_datos_desde_db()
         return redirect(url_for("clientes_view"))
 
-    return render_template("clientes.html", clientes=clientes)
+    return render_template("clientes.html", clientes=get_clientes())
 
 # ---- Alta rápida desde Registrar Recogida ----
 @app.post("/clientes_quick")
@@ -1817,9 +1190,12 @@ def clientes_quick():
     if ya:
         flash("Ese cliente ya existe.", "warning")
     else:
-        db_exec("INSERT INTO clientes(nombre) VALUES (%s);", (nombre,))
+        fila, version = db_escribir("""
+            INSERT INTO clientes(nombre) VALUES (%s)
+            RETURNING id, nombre, telefono, direccion, ciudad, contacto;
+        """, (nombre,), 'clientes')
+        cache.aplicar('clientes', version, _delta_referencia('clientes', [fila["id"]], fila))
         flash("Cliente creado.", "success")
-    cargar_datos_desde_db()
     return redirect(url_for("registrar_recogida"))
 
 # ---------- Recogidas + export (SOLO FECHA) ----------
@@ -1845,122 +1221,240 @@ def registrar_recogida():
         """, (numero_guia, fecha_raw, observaciones, cliente_id_val))
 
         flash(f'Recogida registrada para la guía {numero_guia}', 'success')
-        cargar_datos_desde_db()
         return redirect(url_for('registrar_recogida'))
 
-    return render_template('registrar_recogida.html', clientes=clientes)
+    return render_template('registrar_recogida.html', clientes=get_clientes())
 
-@app.route("/ver_recogidas")
-def ver_recogidas():
-    filtro_numero = (request.args.get('filtro_numero') or '').strip().lower()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-    cliente_id = (request.args.get('cliente_id') or '').strip()
+def _sql_recogidas(args):
+    # La fecha de una recogida se guarda como medianoche (%s::date) en la zona
+    # de la sesión; el rango se interpreta igual (Filtros sin zona).
+    f = (Filtros()
+         .contiene('r.numero_guia', args.get('filtro_numero'))
+         .rango_fechas('r.fecha', args.get('fi'), args.get('ff'))
+         .igual('r.cliente_id', args.get('cliente_id'), convertir=int))
 
     sql = """
         SELECT
             r.id,
             r.numero_guia,
             DATE(r.fecha) AS fecha,     -- solo fecha
+            r.fecha AS fecha_orden,
             r.observaciones,
             r.cliente_id,
             c.nombre AS cliente
         FROM recogidas r
         LEFT JOIN clientes c ON c.id = r.cliente_id
         WHERE 1=1
-    """
-    params = []
-
-    if filtro_numero:
-        sql += " AND LOWER(COALESCE(r.numero_guia,'')) LIKE %s"
-        params.append(f"%{filtro_numero}%")
-
-    if fi:
-        sql += " AND DATE(r.fecha) >= %s"
-        params.append(fi)
+    """ + f.sql
+    return sql, f.params
 
-    if ff:
-        sql += " AND DATE(r.fecha) <= %s"
-        params.append(ff)
+# r.fecha en vez de DATE(r.fecha): mismo orden (siempre es medianoche) y usa el índice
+CLAVES_RECOGIDAS = [('r.fecha', 'fecha_orden', datetime), ('r.id', 'id', int)]
 
-    if cliente_id and cliente_id.isdigit():
-        sql += " AND r.cliente_id = %s"
-        params.append(int(cliente_id))
-
-    sql += " ORDER BY DATE(r.fecha) DESC, r.id DESC"
-
-    rows = db_fetchall_dict(sql, params=params)
+@app.route("/ver_recogidas")
+def ver_recogidas():
+    sql, params = _sql_recogidas(request.args)
+    pagina = _paginar(sql, params, CLAVES_RECOGIDAS)
 
     return render_template(
         'ver_recogidas.html',
-        recogidas=rows,
-        clientes=clientes,          # para el select
-        cliente_sel=cliente_id,     # para mantener selección
-        fi=fi, ff=ff,
+        recogidas=pagina.filas,
+        pagina=pagina,
+        clientes=get_clientes(),    # para el select
+        cliente_sel=(request.args.get('cliente_id') or '').strip(),     # para mantener selección
+        fi=(request.args.get('fi') or '').strip(),
+        ff=(request.args.get('ff') or '').strip(),
         filtro_numero=(request.args.get('filtro_numero') or '').strip()
     )
 
 @app.get("/ver_recogidas/export")
 def export_recogidas():
-    filtro_numero = (request.args.get('filtro_numero') or '').strip().lower()
-    fi = (request.args.get('fi') or '').strip()
-    ff = (request.args.get('ff') or '').strip()
-    cliente_id = (request.args.get('cliente_id') or '').strip()
-
-    sql = """
-        SELECT
-            r.id,
-            r.numero_guia,
-            DATE(r.fecha) AS fecha,     -- solo fecha
-            r.observaciones,
-            c.nombre AS cliente
-        FROM recogidas r
-        LEFT JOIN clientes c ON c.id = r.cliente_id
-        WHERE 1=1
+    sql, params = _sql_recogidas(request.args)
+    sql = f"""
+        SELECT id, numero_guia, fecha, observaciones, cliente
+        FROM ({sql}) x
+        ORDER BY fecha DESC, id DESC
     """
-    params = []
-
-    if filtro_numero:
-        sql += " AND LOWER(COALESCE(r.numero_guia, '')) LIKE %s"
-        params.append(f"%{filtro_numero}%")
-
-    if fi:
-        sql += " AND DATE(r.fecha) >= %s"
-        params.append(fi)
-
-    if ff:
-        sql += " AND DATE(r.fecha) <= %s"
-        params.append(ff)
-
-    if cliente_id and cliente_id.isdigit():
-        sql += " AND r.cliente_id = %s"
-        params.append(int(cliente_id))
-
-    sql += " ORDER BY DATE(r.fecha) DESC, r.id DESC"
-
-    df = read_sql_df(sql, params=params)
-    if df.empty:
-        df = pd.DataFrame(columns=["id", "numero_guia", "fecha", "observaciones", "cliente"])
 
     # Fuerza formato de fecha sin hora en el Excel
-    return df_to_excel_download(df, base_name="recogidas", sheet_name="Recogidas", date_format="yyyy-mm-dd")
+    return exportar_consulta(sql, params, base_name="recogidas", sheet_name="Recogidas", date_format="yyyy-mm-dd",
+                             tablas=("recogidas", "clientes"))
+
+# ---------- Trabajos en segundo plano ----------
+
+def _trabajo_json(t):
+    total = t['total']
+    datos = {
+        'id': t['id'], 'tipo': t['tipo'], 'descripcion': t['descripcion'], 'estado': t['estado'],
+        'progreso': t['progreso'], 'total': total,
+        'porcentaje': round(100 * t['progreso'] / total, 1) if total else None,
+        'mensaje': t['mensaje'], 'resultado': t['resultado'],
+        'descarga': url_for('descargar_trabajo', id_trabajo=t['id']) if t['archivo'] else None,
+    }
+    for campo in ('creado', 'iniciado', 'terminado', 'actualizado'):
+        datos[campo] = t[campo].isoformat() if t[campo] else None
+    return datos
+
+@app.get("/jobs/<id_trabajo>")
+def ver_trabajo(id_trabajo):
+    """Estado y progreso: JSON con ?formato=json o Accept: application/json; si no, HTML."""
+    t = cola_trabajos.obtener(id_trabajo)
+    quiere_json = (request.args.get('formato') == 'json'
+                   or request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json')
+    if quiere_json:
+        if not t:
+            return jsonify(ok=False, error='Trabajo no encontrado'), 404
+        return jsonify(_trabajo_json(t))
+    if not t:
+        return render_template('trabajo.html', trabajo=None), 404
+    return render_template('trabajo.html', trabajo=_trabajo_json(t),
+                           en_curso=t['estado'] in (trabajos.PENDIENTE, trabajos.EN_CURSO))
+
+@app.get("/jobs/<id_trabajo>/descarga")
+def descargar_trabajo(id_trabajo):
+    t = cola_trabajos.obtener(id_trabajo)
+    if not t or t['estado'] != trabajos.TERMINADO or not t['archivo'] or not os.path.exists(t['archivo']):
+        flash('El resultado no está disponible.', 'warning')
+        return redirect(url_for('ver_trabajo', id_trabajo=id_trabajo))
+    mimetype = next((m for m, ext in exportar.FORMATOS.values() if t['archivo'].endswith('.' + ext)), None)
+    return send_file(t['archivo'], mimetype=mimetype, as_attachment=True, download_name=t['nombre_archivo'])
+
+# ---------- Administración ----------
+# Páginas de diagnóstico (consultas lentas, /init): HTTP Basic con
+# ADMIN_USUARIO / ADMIN_CLAVE. Sin ADMIN_CLAVE no existen (404).
+ADMIN_USUARIO = os.getenv("ADMIN_USUARIO", "admin")
+ADMIN_CLAVE = os.getenv("ADMIN_CLAVE", "")
+
+def solo_admin(vista):
+    @wraps(vista)
+    def envuelta(*args, **kwargs):
+        if not ADMIN_CLAVE:
+            return "No encontrado", 404
+        auth = request.authorization
+        if (auth is None or auth.type != "basic"
+                or not hmac.compare_digest((auth.username or "").encode(), ADMIN_USUARIO.encode())
+                or not hmac.compare_digest((auth.password or "").encode(), ADMIN_CLAVE.encode())):
+            return Response("Se requiere usuario de administración", 401,
+                            {"WWW-Authenticate": 'Basic realm="admin", charset="UTF-8"'})
+        return vista(*args, **kwargs)
+    return envuelta
 
 # ---------- Endpoints util ----------
 
+@app.errorhandler(PoolAgotado)
+def _pool_agotado(e):
+    logging.warning("Pool de conexiones agotado en %s: %s", request.path, e)
+    headers = {"Retry-After": str(e.reintentar)}
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        return jsonify(ok=False, error="Servicio ocupado, intente de nuevo"), 503, headers
+    return "Servicio ocupado, intente de nuevo en unos segundos.", 503, headers
+
 @app.route("/health")
 def health():
     db_fetchone_dict("SELECT 1 AS ok;")
-    return jsonify(ok=True)
+    return jsonify(ok=True, pool=pool.estadisticas())
+
+@app.route("/health/pool")
+def health_pool():
+    # Sin tocar la base: sirve aunque el pool esté agotado
+    if pool is None:
+        return jsonify(ok=False, error="Pool sin inicializar: todavía no se pidió ninguna conexión"), 503
+    return jsonify(pool.estadisticas())
+
+@app.route("/metrics")
+def metrics():
+    return Response(registro_metricas.texto(pool), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/admin/consultas_lentas")
+@solo_admin
+def admin_consultas_lentas():
+    orden = request.args.get('orden', 'total')
+    try:
+        limite = max(1, min(int(request.args.get('n', 30)), 200))
+    except ValueError:
+        limite = 30
+    return render_template(
+        "consultas_lentas.html",
+        filas=consultas_lentas.peores(limite, orden=orden),
+        orden=orden, limite=limite, activo=CONSULTA_LENTA_MS > 0,
+        umbral_ms=CONSULTA_LENTA_MS, muestreo=consultas_lentas.muestreo,
+    )
 
-@app.route("/init")
+@app.route("/init", methods=["POST"])
+@solo_admin
 def init():
-    ensure_schema()
-    new_id = db_fetchone_dict(
-        "INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad) VALUES (%s,%s,%s,%s,%s) ON CONFLICT (numero_guia) DO NOTHING RETURNING numero_guia;",
-        ("demo", "DUMMY-0001", "destino", "direccion", "ciudad")
-    )
-    return jsonify(ok=True, demo_insert=new_id)
+    # Solo informa: las migraciones se aplican con `python esquema.py migrar`
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            falta = esquema.faltantes(cur)
+    return jsonify(ok=not falta, version=esquema.VERSION_ESQUEMA, faltantes=falta)
+
+@app.cli.command("reconstruir-resumen")
+def reconstruir_resumen_cmd():
+    """Regenera despachos_diarios y pendientes_diarios."""
+    print(f"despachos_diarios: {reconstruir_resumen_despachos()} filas")
+    print(f"pendientes_diarios: {reconstruir_resumen_pendientes()} filas")
+
+@app.cli.command("verificar-estado")
+@click.option("--reparar", is_flag=True, help="Recalcula las guías con diferencias.")
+def verificar_estado_cmd(reparar):
+    """Compara el estado guardado en guias con despachos/recepciones."""
+    cantidad, ejemplos = verificar_estado_guias()
+    print(f"guías con estado desactualizado: {cantidad}")
+    for e in ejemplos:
+        print(f"  {e['numero_guia']}: {e['guardado']} / {e['mensajero_guardado']}"
+              f" -> {e['esperado']} / {e['mensajero_esperado']}")
+    if cantidad and reparar:
+        print(f"reparadas: {reconstruir_estado_guias()}")
+    pendientes = verificar_resumen_pendientes()
+    print(f"pendientes_diarios con diferencias: {pendientes}")
+    if pendientes and reparar:
+        print(f"pendientes_diarios regenerado: {reconstruir_resumen_pendientes()} filas")
+    if (cantidad or pendientes) and not reparar:
+        sys.exit(1)
+
+@app.cli.command("reconstruir-estado")
+def reconstruir_estado_cmd():
+    """Recalcula el estado guardado de todas las guías."""
+    print(f"guías actualizadas: {reconstruir_estado_guias()}")
+
+# =========================
+#   Arranque
+# =========================
+#
+# Importar el módulo no toca la base: define la app y sus rutas. Lo que sí la
+# toca (chequeo del esquema, cache de referencias, escucha LISTEN, limpieza de
+# trabajos abandonados) corre una sola vez por proceso en inicializar(), desde
+# create_app() o, si el servidor usa `app:app`, en la primera petición.
+
+_inicializada = False
+_lock_arranque = threading.Lock()
+
+def inicializar():
+    global _inicializada, escucha
+    if _inicializada:
+        return
+    with _lock_arranque:
+        if _inicializada:
+            return
+        ensure_schema()
+        cargar_datos_desde_db()
+        cola_trabajos.limpiar()
+        # LISTEN necesita conexión directa, no la del pooler (DATABASE_URL_DIRECTA)
+        if os.getenv("CACHE_NOTIFY", "1") == "1":
+            escucha = EscuchaCambios(
+                DATABASE_URL_DIRECTA, CANAL_CAMBIOS, _aplicar_aviso,
+                al_conectar=lambda: cache.sincronizar(forzar=True)
+            )
+            escucha.start()
+        _inicializada = True
+
+def create_app():
+    """Fábrica de la app: `gunicorn "app:create_app()"` o `flask --app app run`."""
+    logging.basicConfig(level=logging.INFO)
+    inicializar()
+    return app
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+    create_app().run(host="0.0.0.0", port=port)
@@ -0,0 +1,23 @@
+"""
+Base de pruebas para los benchmarks que siembran y borran datos.
+
+Esos scripts no leen DATABASE_URL (suele ser la de producción): la base se
+indica siempre con --base. Antes de sembrar se comprueba que no haya filas
+con el prefijo del script, porque al final se borra todo lo que lo tenga.
+"""
+import sys
+
+
+def agregar_argumento(ap):
+    ap.add_argument('--base', required=True, metavar='DSN',
+                    help='URL de una base de pruebas (no la de producción): el script siembra y borra datos')
+
+
+def exigir_sin_prefijo(cur, prefijo, tablas=('guias', 'despachos', 'recepciones', 'recogidas')):
+    """Sale si alguna tabla ya tiene números de guía con `prefijo` (no son del script)."""
+    for tabla in tablas:
+        cur.execute(f"SELECT count(*) FROM {tabla} WHERE numero_guia LIKE %s;", (prefijo + '%',))
+        n = cur.fetchone()[0]
+        if n:
+            sys.exit(f"La base ya tiene {n} filas en {tabla} con prefijo {prefijo}; "
+                     f"este script las borraría al terminar. Use una base de pruebas vacía.")
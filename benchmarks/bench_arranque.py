@@ -0,0 +1,94 @@
+"""
+Arranque de un worker: tiempo hasta tener la app lista y conexiones que deja
+abiertas en Postgres.
+
+Uso:
+    python benchmarks/bench_arranque.py --base postgresql://.../pruebas --veces 5 --revision HEAD~1
+
+Cada medición es un proceso nuevo que importa app.py y llama a create_app()
+(si la revisión no la tiene, basta el import). Al terminar cuenta en
+pg_stat_activity las conexiones de ese proceso, marcadas con un
+application_name propio. Con --revision mide también esa revisión (extraída
+con git archive en un directorio temporal) y compara.
+
+Solo contra una base de pruebas (--base, ver base_pruebas.py): el arranque
+puede migrar el esquema, y una revisión vieja corre su propio DDL.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import base_pruebas
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ARRANQUE = """
+import os, time
+import psycopg2
+t0 = time.perf_counter()
+import app
+if hasattr(app, 'create_app'):
+    app.create_app()
+dt = time.perf_counter() - t0
+with psycopg2.connect(os.environ['DSN_CONTEO']) as c, c.cursor() as cur:
+    cur.execute("SELECT count(*) FROM pg_stat_activity WHERE application_name = %s;",
+                (os.environ['NOMBRE_APP'],))
+    print(dt, cur.fetchone()[0])
+os._exit(0)
+"""
+
+
+def con_nombre(dsn, nombre):
+    parsed = urlparse(dsn)
+    q = dict(parse_qsl(parsed.query, keep_blank_values=True))
+    q['application_name'] = nombre
+    return urlunparse(parsed._replace(query=urlencode(q)))
+
+
+def medir(directorio, dsn, veces):
+    tiempos, conexiones = [], []
+    for i in range(veces + 1):
+        nombre = f"bench_arranque_{os.getpid()}_{i}"
+        # También la conexión directa (LISTEN, esquema): cuenta como del proceso
+        env = dict(os.environ, DATABASE_URL=con_nombre(dsn, nombre), DATABASE_URL_DIRECTA=con_nombre(dsn, nombre),
+                   DSN_CONTEO=dsn, NOMBRE_APP=nombre)
+        out = subprocess.run([sys.executable, '-W', 'ignore', '-c', ARRANQUE], cwd=directorio, env=env,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            sys.exit(f"Falló el arranque en {directorio}:\n{out.stderr[-2000:]}")
+        dt, n = out.stdout.strip().splitlines()[-1].split()
+        if i:  # la primera calienta caches del sistema
+            tiempos.append(float(dt))
+            conexiones.append(int(n))
+    return statistics.median(tiempos), max(conexiones)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--veces', type=int, default=5)
+    ap.add_argument('--revision', help='revisión de git con la que comparar (p. ej. HEAD~1)')
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+    dsn = args.base
+
+    filas = [('actual', *medir(RAIZ, dsn, args.veces))]
+    if args.revision:
+        with tempfile.TemporaryDirectory() as tmp:
+            archivo = subprocess.run(['git', 'archive', args.revision], cwd=RAIZ,
+                                     capture_output=True, check=True).stdout
+            subprocess.run(['tar', '-x', '-C', tmp], input=archivo, check=True)
+            filas.insert(0, (args.revision, *medir(tmp, dsn, args.veces)))
+
+    for nombre, dt, n in filas:
+        print(f"{nombre:<12} arranque {dt:6.3f} s (mediana de {args.veces})  conexiones abiertas {n}")
+    if len(filas) == 2:
+        (_, dt0, n0), (_, dt1, n1) = filas
+        print(f"arranque x{dt0 / dt1:.1f} más rápido, conexiones {n0} -> {n1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark de carga de la base de guías: fila por fila vs COPY + ON CONFLICT.
+
+Uso:
+    python benchmarks/bench_cargar_base.py --base postgresql://.../pruebas --filas 50000
+
+Trabaja sobre una tabla TEMP `guias` que oculta a la real durante la sesión,
+así que no modifica datos; aun así la base se indica con --base (ver
+base_pruebas.py) y nunca se toma de DATABASE_URL.
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_pruebas  # noqa: E402
+from ingesta import TAMANO_LOTE, ingestar_guias  # noqa: E402
+
+
+def generar_filas(n, desde=0):
+    for i in range(desde, desde + n):
+        yield ('REMITENTE %d' % (i % 50), str(7000000000 + i), 'Destinatario %d' % i,
+               'CL %d # %d-%d' % (i % 100, i % 90, i % 70), 'B/QUILLA')
+
+
+def en_lotes(filas, tamano=TAMANO_LOTE):
+    lote = []
+    for f in filas:
+        lote.append(f)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def preparar(cur):
+    cur.execute("DROP TABLE IF EXISTS pg_temp.guias;")
+    cur.execute("""
+        CREATE TEMP TABLE guias (
+            remitente   TEXT,
+            numero_guia TEXT PRIMARY KEY,
+            destinatario TEXT,
+            direccion   TEXT,
+            ciudad      TEXT
+        );
+    """)
+
+
+def fila_por_fila(cur, filas):
+    # Réplica del bucle anterior de cargar_base
+    for row in filas:
+        cur.execute("SELECT 1 FROM guias WHERE numero_guia = %s;", (row[1],))
+        if not cur.fetchone():
+            cur.execute("""
+                INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
+                VALUES (%s, %s, %s, %s, %s);
+            """, row)
+
+
+def medir(nombre, n, fn):
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f"{nombre:<22} {n:>9} filas  {dt:8.2f} s  {n / dt:12.0f} filas/s")
+    return dt
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    base_pruebas.agregar_argumento(ap)
+    ap.add_argument('--filas', type=int, default=20000)
+    ap.add_argument('--duplicadas', type=float, default=0.2,
+                    help='fracción de filas que ya existen en la tabla')
+    args = ap.parse_args()
+
+    n = args.filas
+    n_previas = int(n * args.duplicadas)
+
+    conn = psycopg2.connect(args.base)
+    try:
+        with conn.cursor() as cur:
+            preparar(cur)
+            fila_por_fila(cur, generar_filas(n_previas))
+            conn.commit()
+            t_lento = medir("fila por fila", n, lambda: fila_por_fila(cur, generar_filas(n)))
+            conn.rollback()
+
+            res = {}
+            t_rapido = medir("COPY + ON CONFLICT", n,
+                             lambda: res.update(ingestar_guias(cur, en_lotes(generar_filas(n)))))
+            conn.rollback()
+
+        print(f"resultado COPY: {res}")
+        print(f"aceleración: x{t_lento / t_rapido:.1f}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Memoria pico del export de pendientes: pandas + ExcelWriter vs exportar.py.
+
+Uso:
+    python benchmarks/bench_export.py --base postgresql://.../pruebas --guias 500000
+
+Siembra N despachos sin recepción con prefijo BX, exporta la consulta de
+/pendiente/export con cada método en un proceso aparte (xlsx y csv.gz para
+el motor en streaming) y borra lo sembrado.
+
+Solo contra una base de pruebas (--base, ver base_pruebas.py); no corre si
+ya hay guías BX.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+from io import BytesIO
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_pruebas  # noqa: E402
+import exportar  # noqa: E402
+
+SQL = """
+    SELECT d.numero_guia, d.mensajero, d.zona, d.fecha AS fecha_asignada,
+           g.remitente, g.destinatario, g.direccion, g.ciudad
+    FROM despachos d
+    LEFT JOIN recepciones r ON r.numero_guia = d.numero_guia
+    LEFT JOIN guias g       ON g.numero_guia = d.numero_guia
+    WHERE r.numero_guia IS NULL AND d.mensajero = 'BENCHX'
+    ORDER BY d.fecha DESC, d.numero_guia DESC
+"""
+
+
+def _pandas(dsn):
+    import pandas as pd
+    conn = psycopg2.connect(dsn)
+    df = pd.read_sql(SQL, conn)
+    df['fecha_asignada'] = pd.to_datetime(df['fecha_asignada'], utc=True).dt.tz_localize(None)
+    buf = BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Pendiente")
+    conn.close()
+    return len(buf.getvalue())
+
+
+def _streaming(formato):
+    def correr(dsn):
+        conn = psycopg2.connect(dsn)
+        hoja = exportar.hoja_desde_consulta(conn, "Pendiente", SQL, (), formato_fecha="yyyy-mm-dd")
+        n = sum(len(t) for t in exportar.trozos(formato, [hoja]))
+        conn.close()
+        return n
+    return correr
+
+
+def _medir(fn, dsn, cola):
+    t0 = time.perf_counter()
+    n = fn(dsn)
+    cola.put((n, time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def correr(nombre, fn, dsn):
+    cola = mp.Queue()
+    p = mp.Process(target=_medir, args=(fn, dsn, cola))
+    p.start()
+    n, dt, rss_kb = cola.get()
+    p.join()
+    print(f"{nombre:<18} {n / 1e6:8.1f} MB  {dt:8.2f} s  pico RSS {rss_kb / 1024:8.1f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--guias', type=int, default=200000)
+    ap.add_argument('--sin-pandas', action='store_true')
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+    dsn = args.base
+
+    # _streaming devuelve una clausura: los procesos hijos se crean con fork
+    mp.set_start_method('fork', force=True)
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        base_pruebas.exigir_sin_prefijo(cur, 'BX', tablas=('guias', 'despachos'))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
+                SELECT 'BENCH', 'BX' || g, 'Destinatario ' || g, 'CL ' || (g %% 100), 'B/QUILLA'
+                FROM generate_series(1, %s) g
+                ON CONFLICT (numero_guia) DO NOTHING;
+            """, (args.guias,))
+            cur.execute("""
+                INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
+                SELECT 'BX' || g, 'BENCHX', NULL, now() - (g %% 365) * interval '1 day'
+                FROM generate_series(1, %s) g
+                ON CONFLICT (numero_guia) DO NOTHING;
+            """, (args.guias,))
+        if not args.sin_pandas:
+            correr("pandas xlsx", _pandas, dsn)
+        correr("streaming xlsx", _streaming('xlsx'), dsn)
+        correr("streaming csv.gz", _streaming('csv.gz'), dsn)
+    finally:
+        with conn.cursor() as cur:
+            for tabla in ('despachos', 'guias'):
+                cur.execute(f"DELETE FROM {tabla} WHERE numero_guia LIKE %s;", ('BX%',))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Memoria pico al leer una base grande: pd.read_excel vs lector por lotes.
+
+Uso:
+    python benchmarks/bench_lector_base.py --filas 300000 [--csv]
+
+Cada lector corre en un proceso aparte para que el pico de RSS sea comparable.
+No necesita base de datos.
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingesta import COLUMNAS_GUIAS, leer_lotes  # noqa: E402
+
+
+def generar_archivo(ruta, n):
+    filas = (('REMITENTE %d' % (i % 50), 7000000000 + i, 'Destinatario %d' % i,
+              'CL %d # %d-%d' % (i % 100, i % 90, i % 70), 'B/QUILLA') for i in range(n))
+    if ruta.endswith('.csv'):
+        with open(ruta, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(COLUMNAS_GUIAS)
+            w.writerows(filas)
+    else:
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(COLUMNAS_GUIAS)
+        for f in filas:
+            ws.append(f)
+        wb.save(ruta)
+
+
+def _pandas(ruta):
+    import pandas as pd
+    df = pd.read_csv(ruta) if ruta.endswith('.csv') else pd.read_excel(ruta)
+    return sum(1 for _ in df.iterrows())
+
+
+def _lotes(ruta):
+    return sum(len(lote) for lote in leer_lotes(ruta))
+
+
+def _medir(fn, ruta, cola):
+    t0 = time.perf_counter()
+    n = fn(ruta)
+    cola.put((n, time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def correr(nombre, fn, ruta):
+    cola = mp.Queue()
+    p = mp.Process(target=_medir, args=(fn, ruta, cola))
+    p.start()
+    n, dt, rss_kb = cola.get()
+    p.join()
+    print(f"{nombre:<16} {n:>9} filas  {dt:8.2f} s  pico RSS {rss_kb / 1024:8.1f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--filas', type=int, default=100000)
+    ap.add_argument('--csv', action='store_true')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, 'base.csv' if args.csv else 'base.xlsx')
+        generar_archivo(ruta, args.filas)
+        print(f"archivo: {os.path.getsize(ruta) / 1e6:.1f} MB")
+        correr("pandas", _pandas, ruta)
+        correr("leer_lotes", _lotes, ruta)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Presupuesto de memoria: RSS y tiempo de arranque de un worker no deben crecer
+con el historial.
+
+Uso:
+    python benchmarks/bench_memoria.py --base postgresql://.../pruebas --guias 1000000
+
+Mide el arranque (create_app) con los datos actuales, siembra N guías
+(mitad despachadas, un cuarto recepcionadas) con prefijo BM, vuelve a medir
+y borra lo sembrado. Sale con código 1 si el RSS o el arranque crecen más
+que --tolerancia.
+
+Solo contra una base de pruebas (--base, ver base_pruebas.py); no corre si
+ya hay guías BM.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import psycopg2
+
+import base_pruebas
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ARRANQUE = """
+import resource, time
+t0 = time.perf_counter()
+import app
+app.create_app()
+dt = time.perf_counter() - t0
+print(dt, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def medir_arranque(dsn):
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', ARRANQUE], cwd=RAIZ,
+                         env=dict(os.environ, DATABASE_URL=dsn, DATABASE_URL_DIRECTA=dsn),
+                         capture_output=True, text=True, check=True).stdout
+    dt, rss_kb = out.strip().splitlines()[-1].split()
+    return float(dt), int(rss_kb) / 1024
+
+
+def sembrar(cur, n):
+    cur.execute("""
+        INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
+        SELECT 'BENCH', 'BM' || g, 'Destinatario ' || g, 'CL ' || (g %% 100) || ' # ' || (g %% 90), 'B/QUILLA'
+        FROM generate_series(1, %s) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
+        SELECT 'BM' || g, 'BENCH', NULL, now() - (g %% 365) * interval '1 day'
+        FROM generate_series(1, %s, 2) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
+        SELECT 'BM' || g, 'ENTREGADA', '', now() - (g %% 365) * interval '1 day'
+        FROM generate_series(1, %s, 4) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+
+
+def limpiar(cur):
+    for tabla in ('recepciones', 'despachos', 'guias'):
+        cur.execute(f"DELETE FROM {tabla} WHERE numero_guia LIKE %s;", ('BM%',))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--guias', type=int, default=1000000)
+    ap.add_argument('--tolerancia', type=float, default=0.25,
+                    help='crecimiento máximo permitido (0.25 = 25%%)')
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+    dsn = args.base
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        base_pruebas.exigir_sin_prefijo(cur, 'BM', tablas=('guias', 'despachos', 'recepciones'))
+
+    medir_arranque(dsn)  # calienta caches del sistema / esquema
+    t_base, rss_base = medir_arranque(dsn)
+    print(f"base:        arranque {t_base:6.2f} s  RSS {rss_base:8.1f} MB")
+
+    try:
+        with conn.cursor() as cur:
+            sembrar(cur, args.guias)
+        t_n, rss_n = medir_arranque(dsn)
+        print(f"+{args.guias} guías: arranque {t_n:6.2f} s  RSS {rss_n:8.1f} MB")
+    finally:
+        with conn.cursor() as cur:
+            limpiar(cur)
+        conn.close()
+
+    ok = rss_n <= rss_base * (1 + args.tolerancia) and t_n <= max(t_base * (1 + args.tolerancia), t_base + 0.5)
+    print("OK" if ok else "FALLA: el worker crece con el historial")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
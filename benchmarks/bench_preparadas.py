@@ -0,0 +1,116 @@
+"""
+Latencia de las consultas puntuales con y sin sentencias preparadas.
+
+Uso:
+    python benchmarks/bench_preparadas.py --base postgresql://.../pruebas --guias 200000 --consultas 20000
+
+Siembra N guías con prefijo BP (la mitad despachadas, un cuarto
+recepcionadas), corre cada consulta de app.CONSULTAS_PUNTUALES con números
+al azar sobre una misma conexión, primero con cur.execute y luego con
+PREPARE/EXECUTE (sentencias.py), e informa microsegundos por consulta.
+Borra lo sembrado al final.
+
+Solo contra una base de pruebas (--base, ver base_pruebas.py); no corre si
+ya hay guías BP.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_pruebas  # noqa: E402
+
+
+def sembrar(cur, n):
+    cur.execute("""
+        INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
+        SELECT 'BENCH', 'BP' || g, 'Destinatario ' || g, 'CL ' || (g %% 100), 'B/QUILLA'
+        FROM generate_series(1, %s) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
+        SELECT 'BP' || g, 'BENCHP' || (g %% 20), NULL, now() - (g %% 90) * interval '1 day'
+        FROM generate_series(1, %s, 2) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
+        SELECT 'BP' || g, 'ENTREGADA', '', now()
+        FROM generate_series(1, %s, 4) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("ANALYZE guias; ANALYZE despachos; ANALYZE recepciones;")
+
+
+def limpiar(cur):
+    for tabla in ('recepciones', 'despachos', 'guias'):
+        cur.execute(f"DELETE FROM {tabla} WHERE numero_guia LIKE %s;", ('BP%',))
+
+
+def medir(conn, sentencias, nombre, numeros):
+    tiempos = []
+    with conn.cursor() as cur:
+        sentencias.ejecutar(cur, nombre, (numeros[0],))  # el PREPARE queda fuera de la medición
+        cur.fetchall()
+        for numero in numeros:
+            t0 = time.perf_counter()
+            sentencias.ejecutar(cur, nombre, (numero,))
+            cur.fetchall()
+            tiempos.append((time.perf_counter() - t0) * 1e6)
+    conn.rollback()
+    return statistics.mean(tiempos), statistics.median(tiempos)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--guias', type=int, default=200000)
+    ap.add_argument('--consultas', type=int, default=20000)
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+
+    admin = psycopg2.connect(args.base)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        base_pruebas.exigir_sin_prefijo(cur, 'BP', tablas=('guias', 'despachos', 'recepciones'))
+
+    # La app (CONSULTAS_PUNTUALES) apunta a la misma base de pruebas (también la
+    # conexión directa de LISTEN y del esquema)
+    os.environ['DATABASE_URL'] = os.environ['DATABASE_URL_DIRECTA'] = args.base
+    import app
+    from sentencias import Sentencias
+
+    simples, preparadas = Sentencias(preparar=False), Sentencias(preparar=True)
+    for nombre, sql in app.CONSULTAS_PUNTUALES.items():
+        simples.registrar(nombre, sql, ('text',))
+        preparadas.registrar(nombre, sql, ('text',))
+
+    azar = random.Random(7)
+    numeros = [f"BP{azar.randint(1, args.guias)}" for _ in range(args.consultas)]
+
+    conn = psycopg2.connect(args.base)
+    try:
+        with admin.cursor() as cur:
+            sembrar(cur, args.guias)
+        print(f"{'consulta':<18} {'simple µs':>18} {'preparada µs':>18} {'ganancia':>9}")
+        print(f"{'':<18} {'media / mediana':>18} {'media / mediana':>18}")
+        for nombre in app.CONSULTAS_PUNTUALES:
+            s_media, s_med = medir(conn, simples, nombre, numeros)
+            p_media, p_med = medir(conn, preparadas, nombre, numeros)
+            print(f"{nombre:<18} {s_media:8.1f} / {s_med:7.1f} {p_media:8.1f} / {p_med:7.1f} "
+                  f"{100 * (s_media - p_media) / s_media:8.1f}%")
+    finally:
+        conn.close()
+        with admin.cursor() as cur:
+            limpiar(cur)
+        admin.close()
+
+
+if __name__ == "__main__":
+    main()
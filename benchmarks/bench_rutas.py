@@ -0,0 +1,477 @@
+"""
+Latencia y throughput de todas las rutas sobre los datos de generar_datos.py.
+
+Uso:
+    python benchmarks/generar_datos.py --base postgresql://.../pruebas --escala 100k
+    python benchmarks/bench_rutas.py --base postgresql://.../pruebas --repeticiones 30
+    python benchmarks/bench_rutas.py --base postgresql://.../pruebas --url http://localhost:5000 --concurrencia 8
+    python benchmarks/bench_rutas.py ... --comparar benchmarks/resultados/rutas_100k_20261017_101500.json
+
+Sin --url usa el cliente de pruebas de Flask en este proceso, sobre --base
+(también para LISTEN y el esquema: DATABASE_URL_DIRECTA se pisa con ella);
+con --url, HTTP contra un servidor ya levantado sobre esa misma base (--base
+hace falta igual: de ahí salen los mensajeros, guías, clientes y fechas de
+los escenarios, con --prefijo).
+
+Por escenario: --calentamiento peticiones sin medir y --repeticiones medidas,
+en --concurrencia hilos. Se informa p50/p95/p99 (rango más cercano), media,
+máximo, peticiones por segundo y errores (estado >= 400). El cuerpo se lee
+completo, así que los exports cuentan hasta el último byte. Los exports con
+cache (EXPORT_CACHE_MB) responden del disco desde la segunda vez; con
+--sin_cache_export (solo cliente de pruebas) se mide siempre la consulta.
+
+Con --escrituras también corren los POST que escriben (despacho, recepción,
+carga de base, altas); usan guías y nombres con el prefijo, así que
+generar_datos.py --borrar los limpia (los archivos que /cargar_base guarda en
+data/ se llaman *_bench_*.csv). Sin él, /jobs/<id> queda sin medir.
+Las páginas de administración (/admin/..., POST /init) se miden solo con
+ADMIN_CLAVE (y ADMIN_USUARIO) definidas, las mismas que usa la app.
+Las rutas de la app sin escenario se listan al final.
+
+El resultado queda en JSON (--salida; por defecto
+benchmarks/resultados/rutas_<escala>_<fecha>.json) para comparar corridas.
+"""
+import argparse
+import base64
+import io
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib import error, request as urlrequest
+from urllib.parse import urlencode
+
+import psycopg2
+
+import base_pruebas
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# armar(n) -> dict con query, form, files {campo: (nombre, bytes)}, json y/o headers
+Escenario = namedtuple('Escenario', 'nombre metodo ruta armar escritura')
+# Rutas que no se miden nunca
+EXCLUIDAS = {'static': 'archivos estáticos'}
+# Rutas detrás de solo_admin
+RUTAS_ADMIN = {'admin_consultas_lentas', 'init'}
+
+_secuencia = itertools.count()
+
+
+# ---------- Datos para los escenarios ----------
+
+def muestra(dsn, prefijo, n_guias=1000):
+    """Valores reales del conjunto generado para armar las peticiones."""
+    patron = prefijo + '%'
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM guias WHERE numero_guia LIKE %s;", (patron,))
+        total = cur.fetchone()[0]
+        if not total:
+            sys.exit(f"No hay guías con prefijo {prefijo}: corra antes benchmarks/generar_datos.py")
+        # Muestra fija entre corridas (mismo orden por md5)
+        cur.execute("SELECT numero_guia FROM guias WHERE numero_guia LIKE %s ORDER BY md5(numero_guia) LIMIT %s;",
+                    (patron, n_guias))
+        guias = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            SELECT mensajero, max(fecha)::date FROM despachos WHERE numero_guia LIKE %s
+            GROUP BY mensajero ORDER BY count(*) DESC LIMIT 1;
+        """, (patron,))
+        mensajero, ultima = cur.fetchone()
+        cur.execute("""
+            SELECT r.cliente_id FROM recogidas r JOIN clientes c ON c.id = r.cliente_id
+            WHERE c.nombre LIKE %s GROUP BY r.cliente_id ORDER BY count(*) DESC LIMIT 1;
+        """, (prefijo + ' %',))
+        cliente_id = cur.fetchone()[0]
+        cur.execute("SELECT nombre FROM zonas WHERE nombre LIKE %s ORDER BY nombre LIMIT 1;", (prefijo + '-%',))
+        zona = cur.fetchone()[0]
+        cur.execute("""
+            SELECT g.numero_guia FROM guias g
+            WHERE g.numero_guia LIKE %s AND NOT EXISTS (SELECT 1 FROM despachos d WHERE d.numero_guia = g.numero_guia)
+            ORDER BY g.numero_guia LIMIT 20000;
+        """, (patron,))
+        sin_despacho = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            SELECT d.numero_guia FROM despachos d
+            WHERE d.numero_guia LIKE %s AND NOT EXISTS (SELECT 1 FROM recepciones r WHERE r.numero_guia = d.numero_guia)
+            ORDER BY d.numero_guia LIMIT 20000;
+        """, (patron,))
+        sin_recepcion = [r[0] for r in cur.fetchall()]
+    return {
+        'total_guias': total, 'guias': guias, 'mensajero': mensajero, 'cliente_id': cliente_id, 'zona': zona,
+        'ff': ultima.isoformat(), 'fi': (ultima - timedelta(days=30)).isoformat(),
+        'sin_despacho': sin_despacho, 'sin_recepcion': sin_recepcion,
+    }
+
+
+def encabezado_admin():
+    """Authorization para las rutas de administración, o None sin ADMIN_CLAVE."""
+    clave = os.getenv("ADMIN_CLAVE")
+    if not clave:
+        return None
+    usuario = os.getenv("ADMIN_USUARIO", "admin")
+    return {'Authorization': 'Basic ' + base64.b64encode(f"{usuario}:{clave}".encode()).decode()}
+
+
+def escenarios(m, prefijo, escrituras=False, trabajos=None):
+    """Lista de Escenario; `trabajos` recibe los id creados por /cargar_base."""
+    guia = m['guias'][0]
+    guias = m['guias']
+    mes = {'fi': m['fi'], 'ff': m['ff']}
+    periodo = {'fecha_inicio': m['fi'], 'fecha_fin': datetime.now().date().isoformat()}
+
+    def fijo(**peticion):
+        return lambda n: peticion
+
+    lista = [
+        Escenario('inicio', 'GET', '/', fijo(), False),
+        Escenario('cargar_base (form)', 'GET', '/cargar_base', fijo(), False),
+        Escenario('registrar_zona (form)', 'GET', '/registrar_zona', fijo(), False),
+        Escenario('registrar_mensajero (form)', 'GET', '/registrar_mensajero', fijo(), False),
+        Escenario('despachar_guias (form)', 'GET', '/despachar_guias', fijo(), False),
+        Escenario('registrar_recepcion (form)', 'GET', '/registrar_recepcion', fijo(), False),
+        Escenario('consultar_estado (form)', 'GET', '/consultar_estado', fijo(), False),
+        Escenario('liquidacion (form)', 'GET', '/liquidacion', fijo(), False),
+        Escenario('clientes', 'GET', '/clientes', fijo(), False),
+        Escenario('registrar_recogida (form)', 'GET', '/registrar_recogida', fijo(), False),
+
+        Escenario('ver_despacho', 'GET', '/ver_despacho', fijo(), False),
+        Escenario('ver_despacho mensajero', 'GET', '/ver_despacho', fijo(query={'mensajero': m['mensajero']}), False),
+        Escenario('ver_despacho 30 días', 'GET', '/ver_despacho', fijo(query=mes), False),
+        Escenario('ver_despacho total=1', 'GET', '/ver_despacho', fijo(query={'total': '1'}), False),
+        Escenario('ver_despacho/export csv 30 días', 'GET', '/ver_despacho/export',
+                  fijo(query={**mes, 'formato': 'csv'}), False),
+        Escenario('ver_despacho/export xlsx mensajero', 'GET', '/ver_despacho/export',
+                  fijo(query={'mensajero': m['mensajero']}), False),
+        Escenario('pendiente', 'GET', '/pendiente', fijo(), False),
+        Escenario('pendiente mensajero', 'GET', '/pendiente', fijo(query={'mensajero': m['mensajero']}), False),
+        Escenario('pendiente/export csv', 'GET', '/pendiente/export', fijo(query={'formato': 'csv'}), False),
+        Escenario('ver_recepciones', 'GET', '/ver_recepciones', fijo(), False),
+        Escenario('ver_recepciones DEVUELTA', 'GET', '/ver_recepciones', fijo(query={'tipo': 'DEVUELTA'}), False),
+        Escenario('ver_recepciones número parcial', 'GET', '/ver_recepciones',
+                  fijo(query={'numero_guia': guia[-6:]}), False),
+        Escenario('ver_recepciones/export csv 30 días', 'GET', '/ver_recepciones/export',
+                  fijo(query={**mes, 'formato': 'csv'}), False),
+        Escenario('consultar_estado 1 guía', 'POST', '/consultar_estado', fijo(form={'numero_guia': guia}), False),
+        Escenario(f'consultar_estado {len(guias)} guías', 'POST', '/consultar_estado',
+                  fijo(form={'guias': "\n".join(guias)}), False),
+        Escenario('api/estado_guias 1 guía', 'GET', '/api/estado_guias', fijo(query={'guias': guia}), False),
+        Escenario(f'api/estado_guias {len(guias)} guías', 'POST', '/api/estado_guias',
+                  fijo(json={'guias': guias}), False),
+        Escenario('liquidacion período abierto', 'POST', '/liquidacion', fijo(form=periodo), False),
+        Escenario('liquidacion/export csv', 'GET', '/liquidacion/export', fijo(query={**periodo, 'formato': 'csv'}),
+                  False),
+        Escenario('ver_recogidas', 'GET', '/ver_recogidas', fijo(), False),
+        Escenario('ver_recogidas cliente', 'GET', '/ver_recogidas', fijo(query={'cliente_id': m['cliente_id']}), False),
+        Escenario('ver_recogidas número parcial', 'GET', '/ver_recogidas',
+                  fijo(query={'filtro_numero': guia[-6:]}), False),
+        Escenario('ver_recogidas/export csv 30 días', 'GET', '/ver_recogidas/export',
+                  fijo(query={**mes, 'formato': 'csv'}), False),
+        Escenario('health', 'GET', '/health', fijo(), False),
+        Escenario('health/pool', 'GET', '/health/pool', fijo(), False),
+        Escenario('metrics', 'GET', '/metrics', fijo(), False),
+    ]
+    admin = encabezado_admin()
+    if admin:
+        lista += [
+            Escenario('admin/consultas_lentas', 'GET', '/admin/consultas_lentas', fijo(headers=admin), False),
+            Escenario('init (chequeo del esquema)', 'POST', '/init', fijo(headers=admin), False),
+        ]
+    if not escrituras:
+        return lista
+
+    marca = uuid.uuid4().hex[:6].upper()
+    sin_despacho = iter(m['sin_despacho'])
+    sin_recepcion = iter(m['sin_recepcion'])
+    trabajos = trabajos if trabajos is not None else []
+
+    def tomar(origen, cantidad, que):
+        lote = list(itertools.islice(origen, cantidad))
+        if len(lote) < cantidad:
+            sys.exit(f"No quedan guías {que} con prefijo {prefijo}: regenere los datos o baje --repeticiones")
+        return lote
+
+    def despacho(n):
+        return {'form': {'mensajero': m['mensajero'], 'guias': "\n".join(tomar(sin_despacho, 20, 'sin despacho'))}}
+
+    def recepcion(n):
+        return {'form': {'estado': 'ENTREGADA', 'numero_guia': tomar(sin_recepcion, 1, 'sin recepción')[0]}}
+
+    def recepcion_archivo(n):
+        texto = "\n".join(tomar(sin_recepcion, 20, 'sin recepción'))
+        return {'form': {'estado': 'ENTREGADA'}, 'files': {'archivo_txt': ('recepcion.txt', texto.encode())}}
+
+    def carga(n):
+        buf = io.StringIO()
+        buf.write("remitente,numero_guia,destinatario,direccion,ciudad\n")
+        for i in range(200):
+            buf.write(f"BENCH,{prefijo}8{marca}{n:05d}{i:03d},DESTINO {i},CL {i} 1 1,B/QUILLA\n")
+        return {'files': {'archivo_excel': (f'bench_{marca}_{n}.csv', buf.getvalue().encode())}}
+
+    def trabajo(n):
+        if not trabajos:
+            sys.exit("/cargar_base no devolvió ningún trabajo")
+        return {'ruta': f"/jobs/{trabajos[n % len(trabajos)]}", 'query': {'formato': 'json'}}
+
+    def descarga(n):
+        return {'ruta': f"/jobs/{trabajos[n % len(trabajos)]}/descarga"}
+
+    lista += [
+        Escenario('despachar_guias 20 guías', 'POST', '/despachar_guias', despacho, True),
+        Escenario('registrar_recepcion 1 guía', 'POST', '/registrar_recepcion', recepcion, True),
+        Escenario('registrar_recepcion archivo 20 guías', 'POST', '/registrar_recepcion', recepcion_archivo, True),
+        Escenario('cargar_base csv 200 filas', 'POST', '/cargar_base', carga, True),
+        Escenario('jobs/<id>', 'GET', '/jobs/<id_trabajo>', trabajo, True),
+        Escenario('jobs/<id>/descarga', 'GET', '/jobs/<id_trabajo>/descarga', descarga, True),
+        Escenario('registrar_zona alta', 'POST', '/registrar_zona',
+                  lambda n: {'form': {'nombre': f"{prefijo}-BENCH {marca} {n}", 'tarifa': '5000'}}, True),
+        Escenario('registrar_mensajero alta', 'POST', '/registrar_mensajero',
+                  lambda n: {'form': {'nombre': f"{prefijo}-BENCH {marca} {n}", 'zona': m['zona']}}, True),
+        Escenario('clientes alta', 'POST', '/clientes',
+                  lambda n: {'form': {'nombre': f"{prefijo} BENCH {marca} {n}", 'ciudad': 'B/QUILLA'}}, True),
+        Escenario('clientes_quick alta', 'POST', '/clientes_quick',
+                  lambda n: {'form': {'nombre': f"{prefijo} BENCH RAPIDO {marca} {n}"}}, True),
+        Escenario('registrar_recogida alta', 'POST', '/registrar_recogida',
+                  lambda n: {'form': {'numero_guia': guias[n % len(guias)], 'fecha': m['ff'],
+                                      'observaciones': 'bench', 'cliente_id': str(m['cliente_id'])}}, True),
+    ]
+    return lista
+
+
+# ---------- Clientes ----------
+
+class ClientePrueba:
+    """Cliente de pruebas de Flask; uno por hilo."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def pedir(self, metodo, ruta, peticion):
+        datos = dict(peticion.get('form') or {})
+        for campo, (nombre, contenido) in (peticion.get('files') or {}).items():
+            datos[campo] = (io.BytesIO(contenido), nombre)
+        with self.app.test_client() as cliente:
+            resp = cliente.open(ruta, method=metodo, query_string=peticion.get('query'),
+                                data=datos or None, json=peticion.get('json'), headers=peticion.get('headers'))
+            try:
+                return resp.status_code, len(resp.get_data()), resp.headers.get('Location')
+            finally:
+                resp.close()
+
+
+class _SinRedireccion(urlrequest.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHttp:
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+        self._abrir = urlrequest.build_opener(_SinRedireccion).open
+
+    def pedir(self, metodo, ruta, peticion):
+        url = self.base + ruta
+        if peticion.get('query'):
+            url += '?' + urlencode(peticion['query'])
+        cuerpo, headers = None, {}
+        if peticion.get('json') is not None:
+            cuerpo, headers = json.dumps(peticion['json']).encode(), {'Content-Type': 'application/json'}
+        elif peticion.get('files'):
+            cuerpo, tipo = _multipart(peticion.get('form') or {}, peticion['files'])
+            headers = {'Content-Type': tipo}
+        elif peticion.get('form'):
+            cuerpo = urlencode(peticion['form']).encode()
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        headers.update(peticion.get('headers') or {})
+        try:
+            with self._abrir(urlrequest.Request(url, data=cuerpo, headers=headers, method=metodo), timeout=300) as r:
+                return r.status, _leer(r), r.headers.get('Location')
+        except error.HTTPError as e:
+            return e.code, _leer(e), e.headers.get('Location')
+
+
+def _leer(resp):
+    total = 0
+    while True:
+        trozo = resp.read(64 * 1024)
+        if not trozo:
+            return total
+        total += len(trozo)
+
+
+def _multipart(form, files):
+    limite = uuid.uuid4().hex
+    partes = []
+    for campo, valor in form.items():
+        partes.append(f'--{limite}\r\nContent-Disposition: form-data; name="{campo}"\r\n\r\n{valor}\r\n'.encode())
+    for campo, (nombre, contenido) in files.items():
+        partes.append(f'--{limite}\r\nContent-Disposition: form-data; name="{campo}"; filename="{nombre}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n'.encode() + contenido + b'\r\n')
+    partes.append(f'--{limite}--\r\n'.encode())
+    return b''.join(partes), f'multipart/form-data; boundary={limite}'
+
+
+# ---------- Medición ----------
+
+def percentil(ordenados, p):
+    """Rango más cercano sobre una lista ya ordenada."""
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def medir(crear_cliente, esc, repeticiones, calentamiento, concurrencia, trabajos):
+    def una(_):
+        peticion = esc.armar(next(_secuencia))
+        ruta = peticion.get('ruta', esc.ruta)
+        t0 = time.perf_counter()
+        estado, tamano, destino = crear_cliente().pedir(esc.metodo, ruta, peticion)
+        dt = time.perf_counter() - t0
+        if destino and '/jobs/' in destino and esc.ruta == '/cargar_base':
+            trabajos.append(destino.rstrip('/').rsplit('/', 1)[-1])
+        return dt, estado, tamano
+
+    with ThreadPoolExecutor(concurrencia) as ex:
+        list(ex.map(una, range(calentamiento)))
+        t0 = time.perf_counter()
+        resultados = list(ex.map(una, range(repeticiones)))
+        pared = time.perf_counter() - t0
+
+    tiempos = sorted(r[0] for r in resultados)
+    errores = [r[1] for r in resultados if r[1] >= 400]
+    return {
+        'metodo': esc.metodo, 'ruta': esc.ruta, 'escritura': esc.escritura, 'peticiones': len(tiempos),
+        'errores': len(errores), 'estados_error': sorted(set(errores)),
+        'p50_ms': round(percentil(tiempos, 50) * 1000, 2),
+        'p95_ms': round(percentil(tiempos, 95) * 1000, 2),
+        'p99_ms': round(percentil(tiempos, 99) * 1000, 2),
+        'media_ms': round(sum(tiempos) / len(tiempos) * 1000, 2),
+        'max_ms': round(tiempos[-1] * 1000, 2),
+        'por_segundo': round(len(tiempos) / pared, 1),
+        'bytes_medio': round(sum(r[2] for r in resultados) / len(resultados)),
+    }
+
+
+def sin_escenario(app, lista, escrituras):
+    """Rutas de la app que ningún escenario mide, con el motivo si se conoce."""
+    cubiertas = {(esc.ruta, esc.metodo) for esc in lista}
+    faltan = []
+    for regla in app.url_map.iter_rules():
+        for metodo in sorted(regla.methods - {'HEAD', 'OPTIONS'}):
+            if (regla.rule, metodo) in cubiertas:
+                continue
+            motivo = EXCLUIDAS.get(regla.endpoint)
+            if not motivo and regla.endpoint in RUTAS_ADMIN and not encabezado_admin():
+                motivo = 'requiere ADMIN_CLAVE'
+            if not motivo and not escrituras and (metodo == 'POST' or regla.rule.startswith('/jobs/')):
+                motivo = 'requiere --escrituras'
+            faltan.append((metodo, regla.rule, motivo or 'sin escenario'))
+    return faltan
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(anterior, actual):
+    print(f"\nComparación con {anterior['meta'].get('fecha')} ({anterior['meta'].get('commit')}):")
+    distintos = [k for k in ('escala', 'modo', 'concurrencia', 'cache_export')
+                 if anterior['meta'].get(k) != actual['meta'].get(k)]
+    if distintos:
+        print("  Ojo: las corridas difieren en " + ", ".join(
+            f"{k} ({anterior['meta'].get(k)} -> {actual['meta'].get(k)})" for k in distintos))
+    print(f"{'escenario':<42} {'p50 antes':>10} {'p50 ahora':>10} {'p95 antes':>10} {'p95 ahora':>10}  cambio p95")
+    for nombre, r in actual['rutas'].items():
+        a = anterior['rutas'].get(nombre)
+        if not a:
+            continue
+        cambio = r['p95_ms'] / a['p95_ms'] if a['p95_ms'] else float('inf')
+        # Por debajo de 1 ms de diferencia es ruido
+        diferencia = abs(r['p95_ms'] - a['p95_ms']) >= 1
+        marca = '  <-- más lento' if cambio > 1.2 and diferencia else ('  más rápido' if cambio < 0.8 and diferencia else '')
+        print(f"{nombre:<42} {a['p50_ms']:>10.1f} {r['p50_ms']:>10.1f} {a['p95_ms']:>10.1f} {r['p95_ms']:>10.1f}"
+              f"  x{cambio:.2f}{marca}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--url', help='servidor a medir por HTTP (por defecto, cliente de pruebas de Flask)')
+    ap.add_argument('--prefijo', default='SG')
+    ap.add_argument('--repeticiones', type=int, default=30)
+    ap.add_argument('--calentamiento', type=int, default=2)
+    ap.add_argument('--concurrencia', type=int, default=1)
+    ap.add_argument('--escrituras', action='store_true', help='mide también los POST que escriben')
+    ap.add_argument('--sin_cache_export', action='store_true', help='EXPORT_CACHE_MB=0 (solo cliente de pruebas)')
+    ap.add_argument('--filtro', help='solo escenarios cuyo nombre contenga este texto')
+    ap.add_argument('--salida', help='archivo JSON de resultados')
+    ap.add_argument('--comparar', help='JSON de una corrida anterior')
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+
+    dsn = args.base
+    os.environ['DATABASE_URL'] = os.environ['DATABASE_URL_DIRECTA'] = dsn
+    if args.sin_cache_export:
+        os.environ['EXPORT_CACHE_MB'] = '0'
+
+    import app as modulo_app  # después de fijar el entorno
+    if args.url:
+        crear_cliente = lambda: ClienteHttp(args.url)  # noqa: E731
+    else:
+        aplicacion = modulo_app.create_app()
+        crear_cliente = lambda: ClientePrueba(aplicacion)  # noqa: E731
+
+    m = muestra(dsn, args.prefijo)
+    trabajos = []
+    todos = escenarios(m, args.prefijo, args.escrituras, trabajos)
+    lista = [e for e in todos if not args.filtro or args.filtro in e.nombre]
+
+    escala = next((k for k, v in (('1m', 1_000_000), ('100k', 100_000), ('10k', 10_000))
+                   if m['total_guias'] >= v * 0.9), str(m['total_guias']))
+    resultado = {
+        'meta': {
+            'fecha': datetime.now().isoformat(timespec='seconds'), 'commit': commit_actual(),
+            'escala': escala, 'guias': m['total_guias'], 'modo': args.url or 'cliente de pruebas',
+            'repeticiones': args.repeticiones, 'calentamiento': args.calentamiento,
+            'concurrencia': args.concurrencia, 'escrituras': args.escrituras,
+            'cache_export': not args.sin_cache_export if not args.url else None,
+        },
+        'rutas': {},
+    }
+
+    print(f"{m['total_guias']} guías ({escala}), {args.repeticiones} repeticiones, concurrencia {args.concurrencia}")
+    print(f"{'escenario':<42} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'pet/s':>8} {'errores':>8}")
+    for esc in lista:
+        r = medir(crear_cliente, esc, args.repeticiones, args.calentamiento, args.concurrencia, trabajos)
+        resultado['rutas'][esc.nombre] = r
+        print(f"{esc.nombre:<42} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}"
+              f" {r['por_segundo']:>8.1f} {r['errores']:>8}")
+
+    faltan = sin_escenario(modulo_app.app, todos, args.escrituras)
+    if faltan:
+        print("\nSin medir:")
+        for metodo, ruta, motivo in faltan:
+            print(f"  {metodo:<5} {ruta:<34} {motivo}")
+    resultado['sin_medir'] = [{'metodo': me, 'ruta': r, 'motivo': mo} for me, r, mo in faltan]
+
+    salida = args.salida or os.path.join(RAIZ, 'benchmarks', 'resultados',
+                                         f"rutas_{escala}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            comparar(json.load(f), resultado)
+
+
+if __name__ == "__main__":
+    main()
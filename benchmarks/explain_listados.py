@@ -0,0 +1,159 @@
+"""
+Comprueba con EXPLAIN que cada consulta de listado usa índices.
+
+Uso:
+    python benchmarks/explain_listados.py --base postgresql://.../pruebas --guias 300000
+
+Siembra N guías despachadas (un tercio recepcionadas) y N/4 recogidas con
+prefijo BE, hace ANALYZE, arma la consulta de la primera y de la segunda
+página de cada listado tal como la arma la app (filtros.py + paginacion.py)
+y revisa que el plan no tenga Seq Scan sobre las tablas grandes. Borra lo
+sembrado al final. Sale con código 1 si alguna consulta recorre la tabla.
+
+Las búsquedas por "número contiene" solo se revisan si pg_trgm está instalado.
+
+Solo contra una base de pruebas (--base, ver base_pruebas.py); no corre si
+ya hay guías BE.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_pruebas  # noqa: E402
+
+TABLAS_GRANDES = {'guias', 'despachos', 'recepciones', 'recogidas', 'despachos_diarios'}
+
+
+def sembrar(cur, n):
+    cur.execute("""
+        INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
+        SELECT 'BENCH', 'BE' || g, 'Destinatario ' || g, 'CL ' || (g %% 100), 'B/QUILLA'
+        FROM generate_series(1, %s) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
+        SELECT 'BE' || g, 'BENCHE' || (g %% 40), NULL, now() - (g %% 720) * interval '12 hour'
+        FROM generate_series(1, %s) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
+        SELECT 'BE' || g, CASE WHEN g %% 6 = 0 THEN 'DEVUELTA' ELSE 'ENTREGADA' END, '',
+               now() - (g %% 720) * interval '12 hour' + interval '1 hour'
+        FROM generate_series(1, %s, 3) g
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """, (n,))
+    cur.execute("""
+        INSERT INTO recogidas(numero_guia, fecha, observaciones)
+        SELECT 'BE' || g, (now() - (g %% 365) * interval '1 day')::date, 'bench'
+        FROM generate_series(1, %s) g;
+    """, (n // 4,))
+    cur.execute("ANALYZE guias; ANALYZE despachos; ANALYZE recepciones; ANALYZE recogidas; ANALYZE despachos_diarios;")
+
+
+def limpiar(cur):
+    cur.execute("DELETE FROM recogidas WHERE numero_guia LIKE %s;", ('BE%',))
+    for tabla in ('recepciones', 'despachos', 'guias'):
+        cur.execute(f"DELETE FROM {tabla} WHERE numero_guia LIKE %s;", ('BE%',))
+
+
+def recorridos(plan):
+    """Tablas grandes leídas con Seq Scan en el plan."""
+    malas = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in TABLAS_GRANDES:
+        malas.append(plan['Relation Name'])
+    for hijo in plan.get('Plans', []):
+        malas += recorridos(hijo)
+    return malas
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--guias', type=int, default=300000)
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(args.base)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        base_pruebas.exigir_sin_prefijo(cur, 'BE')
+
+    # La app arma las consultas y lee de la misma base de pruebas (también la
+    # conexión directa de LISTEN y del esquema)
+    os.environ['DATABASE_URL'] = os.environ['DATABASE_URL_DIRECTA'] = args.base
+    import app
+    import paginacion
+
+    hoy = date.today()
+    hace_30 = (hoy - timedelta(days=30)).isoformat()
+    hace_60 = (hoy - timedelta(days=60)).isoformat()
+
+    def pagina(sql, params, claves, cursor=None):
+        capturada = []
+        paginacion.paginar(lambda q, p: capturada.append((q, p)) or [], sql, params, claves, cursor=cursor)
+        return capturada[0]
+
+    def siguiente(claves_valores):
+        return paginacion.codificar_cursor('s', claves_valores)
+
+    ahora = app.db_fetchone_dict("SELECT now() - interval '10 day' AS t;")['t']
+    casos = [
+        ("pendiente", app._sql_pendiente({}), app.CLAVES_PENDIENTE, None),
+        ("pendiente p2", app._sql_pendiente({}), app.CLAVES_PENDIENTE, siguiente([ahora, 'BE5000'])),
+        ("pendiente mensajero", app._sql_pendiente({'mensajero': 'BENCHE7'}), app.CLAVES_PENDIENTE, None),
+        ("pendiente fechas", app._sql_pendiente({'fi': hace_60, 'ff': hace_30}), app.CLAVES_PENDIENTE, None),
+        ("recepciones", app._sql_recepciones({}), app.CLAVES_RECEPCIONES, None),
+        ("recepciones p2", app._sql_recepciones({}), app.CLAVES_RECEPCIONES, siguiente([ahora, 'BE5000'])),
+        ("recepciones tipo", app._sql_recepciones({'tipo': 'DEVUELTA'}), app.CLAVES_RECEPCIONES, None),
+        ("recepciones fechas", app._sql_recepciones({'fi': hace_60, 'ff': hace_30}), app.CLAVES_RECEPCIONES, None),
+        ("recogidas", app._sql_recogidas({}), app.CLAVES_RECOGIDAS, None),
+        ("recogidas p2", app._sql_recogidas({}), app.CLAVES_RECOGIDAS, siguiente([ahora, 10 ** 9])),
+        ("recogidas fechas", app._sql_recogidas({'fi': hace_60, 'ff': hace_30}), app.CLAVES_RECOGIDAS, None),
+        ("recogidas cliente", app._sql_recogidas({'cliente_id': '1'}), app.CLAVES_RECOGIDAS, None),
+        ("ver_despacho", app._sql_despacho({}), app.CLAVES_DESPACHO, None),
+        ("ver_despacho mensajero", app._sql_despacho({'mensajero': 'BENCHE7'}), app.CLAVES_DESPACHO, None),
+    ]
+    trgm = app.db_fetchone_dict("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS ok;")['ok']
+    if trgm:
+        casos += [
+            ("recepciones numero", app._sql_recepciones({'numero_guia': 'E12345'}), app.CLAVES_RECEPCIONES, None),
+            ("recogidas numero", app._sql_recogidas({'filtro_numero': 'E12345'}), app.CLAVES_RECOGIDAS, None),
+        ]
+    else:
+        print("(pg_trgm no instalado: se omiten las búsquedas por número)")
+
+    fallas = 0
+    try:
+        with conn.cursor() as cur:
+            sembrar(cur, args.guias)
+            liquidacion = app.Filtros(app.ZONA_NEGOCIO).igual('mensajero', 'BENCHE7').rango_fechas('fecha', hace_60, hace_30)
+            explicar = [(nombre, pagina(sql, params, claves, cursor)) for nombre, (sql, params), claves, cursor in casos]
+            explicar.append(("liquidacion", ("SELECT COUNT(*) FROM despachos WHERE TRUE" + liquidacion.sql, liquidacion.params)))
+            explicar.append(("pendiente antigüedad", app._sql_antiguedad({})))
+            explicar.append(("pendiente antigüedad msj", app._sql_antiguedad({'mensajero': 'BENCHE7'})))
+            for nombre, (sql, params) in explicar:
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cur.fetchone()[0]
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+                malas = recorridos(plan)
+                fallas += bool(malas)
+                estado = f"SEQ SCAN en {', '.join(malas)}" if malas else "índice"
+                print(f"{nombre:<26} {estado:<30} costo {plan['Total Cost']:>12.1f}")
+    finally:
+        with conn.cursor() as cur:
+            limpiar(cur)
+        conn.close()
+
+    print("OK" if not fallas else f"FALLA: {fallas} consulta(s) recorren la tabla")
+    sys.exit(1 if fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
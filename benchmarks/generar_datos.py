@@ -0,0 +1,300 @@
+"""
+Datos sintéticos para benchmarks: guías, zonas, mensajeros, clientes,
+despachos, recepciones y recogidas a escala 10k / 100k / 1M guías.
+
+Uso:
+    python benchmarks/generar_datos.py --base postgresql://.../pruebas --escala 100k
+    python benchmarks/generar_datos.py --base postgresql://.../pruebas --borrar
+
+Con la misma --semilla se generan los mismos datos (las fechas se cuentan
+hacia atrás desde --hasta, por defecto hoy). Todo lleva el prefijo --prefijo
+(SG) en el número de guía y en los nombres, para convivir con datos reales y
+borrarse con --borrar. Solo contra una base de pruebas (--base, ver
+base_pruebas.py): a escala 1M son millones de filas.
+
+Distribuciones:
+- remitente y ciudad: las de data/guias.csv como cabeza, más una cola larga
+  de remitentes corporativos y municipios del área;
+- despachos: 85 % de las guías, en los últimos --dias días, menos sábados y
+  casi nada los domingos, de 7 a 18 h (hora de Bogotá); el mensajero sale
+  de las zonas de la ciudad de la guía, con carga desigual (Zipf);
+- recepciones: casi todas las despachadas hace más de 3 días y la mitad de
+  las recientes; 8 % DEVUELTA con motivo;
+- recogidas: una por cada 10 guías, por cliente (Zipf).
+Se cargan con COPY en bloques, así que los triggers de estado y resúmenes
+corren como en una carga real.
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, time as hora, timedelta, timezone
+
+import psycopg2
+
+import base_pruebas
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ESCALAS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+BLOQUE = 50_000
+BOGOTA = timezone(timedelta(hours=-5))
+
+# Ciudad -> zonas que la cubren (tarifa por guía)
+ZONAS = {
+    'B/QUILLA': [('NORTE', 4500), ('CENTRO', 4000), ('SUROCCIDENTE', 4200), ('SURORIENTE', 4200)],
+    'SANTA MARTA': [('SANTA MARTA', 6000), ('RODADERO', 6500)],
+    'CARTAGENA': [('CARTAGENA', 6000), ('BOCAGRANDE', 6500)],
+    'SOLEDAD': [('SOLEDAD', 5000)],
+    'MALAMBO': [('MALAMBO', 5500)],
+    'PUERTO COLOMBIA': [('PUERTO COLOMBIA', 5500)],
+    'VALLEDUPAR': [('VALLEDUPAR', 8000)],
+}
+# Cola de ciudades que no aparecen en data/guias.csv (peso relativo)
+CIUDADES_COLA = {'SOLEDAD': 1.2, 'MALAMBO': 0.4, 'PUERTO COLOMBIA': 0.3, 'VALLEDUPAR': 0.3}
+
+NOMBRES = ['LAURA', 'CAROLINA', 'ANDRES', 'JUAN', 'CARLOS', 'MARIA', 'JOSE', 'LUIS', 'ANA', 'DIANA', 'JHON',
+           'MILENIS', 'IVANA', 'JAIDYS', 'SANDRA', 'PAOLA', 'JORGE', 'KEVIN', 'YULIETH', 'ALEJANDRA']
+APELLIDOS = ['GONZALEZ', 'MARTINEZ', 'RODRIGUEZ', 'CORREA', 'VEGA', 'PINO', 'GARCES', 'TORDECILLA', 'RADA',
+             'QUIROZ', 'CHUNG', 'PEREZ', 'GOMEZ', 'DIAZ', 'MORALES', 'HERRERA', 'CASTRO', 'OROZCO']
+VIAS = ['CL', 'KR', 'CR', 'AV', 'TV', 'DG']
+COMPLEMENTOS = ['', '', '', ' APTO 302', ' OFICINA 1009', ' LOCAL 2A', ' CASA C17', ' TORRE 2 APTO 501', ' CC 20 DE JULIO']
+MOTIVOS = ['DIRECCION ERRADA', 'NO RESIDE', 'REHUSADO', 'CERRADO', 'ZONA DE DIFICIL ACCESO']
+OBSERVACIONES = ['', '', 'Recoger en portería', 'Paquete grande', 'Llamar antes', 'Segunda visita']
+
+
+def distribucion_base():
+    """Pesos de remitente y ciudad leídos de data/guias.csv."""
+    remitentes, ciudades = Counter(), Counter()
+    with open(os.path.join(RAIZ, 'data', 'guias.csv'), encoding='utf-8') as f:
+        for fila in csv.DictReader(f):
+            remitentes[fila['remitente'].strip()] += 1
+            ciudades[fila['ciudad'].strip()] += 1
+    return remitentes, ciudades
+
+
+def zipf(n, s=1.1):
+    return [1 / (i + 1) ** s for i in range(n)]
+
+
+def tamanos(guias):
+    return {'mensajeros': max(10, guias // 2500), 'clientes': max(20, guias // 1000), 'recogidas': guias // 10}
+
+
+def _copiar(cur, tabla, columnas, filas):
+    """COPY de `filas` en bloques de BLOQUE."""
+    total = 0
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= BLOQUE:
+            total += _copiar_bloque(cur, tabla, columnas, bloque)
+            bloque = []
+    if bloque:
+        total += _copiar_bloque(cur, tabla, columnas, bloque)
+    return total
+
+
+def _copiar_bloque(cur, tabla, columnas, bloque):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(bloque)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {tabla}({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv)", buf)
+    return len(bloque)
+
+
+def existentes(cur, prefijo):
+    cur.execute("SELECT count(*) FROM guias WHERE numero_guia LIKE %s;", (prefijo + '%',))
+    return cur.fetchone()[0]
+
+
+def generar(conn, guias, semilla=42, prefijo='SG', dias=180, hasta=None, salida=print):
+    """Genera y carga el conjunto. Devuelve {tabla: filas}."""
+    rnd = random.Random(semilla)
+    hasta = hasta or date.today()
+    ahora = datetime.combine(hasta, hora(18, 0), BOGOTA)
+    n = tamanos(guias)
+    cargado = {}
+
+    base_remitentes, base_ciudades = distribucion_base()
+    # Cabeza: los remitentes del CSV con el 60 % del volumen; cola Zipf con el resto
+    cola = [f"CLIENTE CORPORATIVO {i:03d}" for i in range(1, 201)]
+    total_base = sum(base_remitentes.values())
+    remitentes = list(base_remitentes) + cola
+    pesos_rem = [0.6 * c / total_base for c in base_remitentes.values()]
+    pesos_cola = zipf(len(cola))
+    pesos_rem += [0.4 * p / sum(pesos_cola) for p in pesos_cola]
+    ciudades = dict(base_ciudades)
+    ciudades.update(CIUDADES_COLA)
+
+    with conn.cursor() as cur:
+        # Zonas y mensajeros
+        zonas_ciudad = {c: [f"{prefijo}-{z}" for z, _ in zs] for c, zs in ZONAS.items()}
+        cur.executemany("INSERT INTO zonas(nombre, tarifa) VALUES (%s, %s) ON CONFLICT (nombre) DO NOTHING;",
+                        [(f"{prefijo}-{z}", t) for zs in ZONAS.values() for z, t in zs])
+        todas_zonas = [z for zs in zonas_ciudad.values() for z in zs]
+        mensajeros_zona = {z: [] for z in todas_zonas}
+        n['mensajeros'] = max(n['mensajeros'], len(todas_zonas))
+        for i in range(n['mensajeros']):
+            # Al menos uno por zona; el resto reparte según el peso de la ciudad
+            if i < len(todas_zonas):
+                zona = todas_zonas[i]
+            else:
+                ciudad = rnd.choices(list(ciudades), weights=list(ciudades.values()))[0]
+                zona = rnd.choice(zonas_ciudad[ciudad])
+            nombre = f"{prefijo}-{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {i:04d}"
+            mensajeros_zona[zona].append(nombre)
+        cur.executemany("INSERT INTO mensajeros(nombre, zona) VALUES (%s, %s) ON CONFLICT (nombre) DO NOTHING;",
+                        [(m, z) for z, ms in mensajeros_zona.items() for m in ms])
+        cargado['zonas'], cargado['mensajeros'] = len(todas_zonas), n['mensajeros']
+
+        # Clientes
+        cur.execute("""
+            INSERT INTO clientes(nombre, telefono, direccion, ciudad, contacto)
+            SELECT %s || ' ' || r || ' ' || lpad(g::text, 4, '0'), '300' || lpad((g * 7919 %% 10000000)::text, 7, '0'),
+                   'CL ' || (g %% 100) || ' ' || (g %% 60) || ' ' || (g %% 90), c, 'Contacto ' || g
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS t(r, c, g)
+            ON CONFLICT (nombre) DO NOTHING;
+        """, (prefijo,
+              rnd.choices(remitentes, weights=pesos_rem, k=n['clientes']),
+              rnd.choices(list(ciudades), weights=list(ciudades.values()), k=n['clientes'])))
+        cur.execute("SELECT id FROM clientes WHERE nombre LIKE %s ORDER BY id;", (prefijo + ' %',))
+        clientes = [r[0] for r in cur.fetchall()]
+        cargado['clientes'] = len(clientes)
+        conn.commit()
+
+        # Guías: se generan una vez y se reusan para despachos y recepciones
+        t0 = time.perf_counter()
+        lista_ciudades = rnd.choices(list(ciudades), weights=list(ciudades.values()), k=guias)
+        lista_remitentes = rnd.choices(remitentes, weights=pesos_rem, k=guias)
+        numeros = [f"{prefijo}{7000000000 + i}" for i in range(guias)]
+
+        def filas_guias():
+            for i in range(guias):
+                direccion = (f"{rnd.choice(VIAS)} {rnd.randint(1, 110)}{rnd.choice(['', '', 'A', 'B'])} "
+                             f"{rnd.randint(1, 99)} {rnd.randint(1, 150)}{rnd.choice(COMPLEMENTOS)}")
+                destinatario = f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+                yield (lista_remitentes[i], numeros[i], destinatario, direccion, lista_ciudades[i])
+
+        cargado['guias'] = _copiar(cur, 'guias', ('remitente', 'numero_guia', 'destinatario', 'direccion', 'ciudad'),
+                                   filas_guias())
+        conn.commit()
+        salida(f"guias: {cargado['guias']} ({time.perf_counter() - t0:.1f} s)")
+
+        # Despachos
+        t0 = time.perf_counter()
+        pesos_dia = [{5: 0.6, 6: 0.15}.get((hasta - timedelta(days=d)).weekday(), 1.0) for d in range(dias)]
+        pesos_mensajero = {z: zipf(len(ms), 0.8) for z, ms in mensajeros_zona.items()}
+        despachadas = []   # (indice, fecha)
+
+        def filas_despachos():
+            for i in range(guias):
+                if rnd.random() >= 0.85:
+                    continue
+                dia = rnd.choices(range(dias), weights=pesos_dia)[0]
+                fecha = datetime.combine(hasta - timedelta(days=dia), hora(7), BOGOTA) + \
+                    timedelta(seconds=rnd.randint(0, 11 * 3600))
+                zona = rnd.choice(zonas_ciudad[lista_ciudades[i]])
+                mensajero = rnd.choices(mensajeros_zona[zona], weights=pesos_mensajero[zona])[0]
+                despachadas.append((i, fecha))
+                yield (numeros[i], mensajero, zona, fecha.isoformat())
+
+        cargado['despachos'] = _copiar(cur, 'despachos', ('numero_guia', 'mensajero', 'zona', 'fecha'),
+                                       filas_despachos())
+        conn.commit()
+        salida(f"despachos: {cargado['despachos']} ({time.perf_counter() - t0:.1f} s)")
+
+        # Recepciones
+        t0 = time.perf_counter()
+
+        def filas_recepciones():
+            for i, fecha in despachadas:
+                antiguedad = (ahora - fecha).days
+                if rnd.random() >= (0.97 if antiguedad > 3 else 0.5):
+                    continue
+                recibida = fecha + timedelta(minutes=rnd.randint(90, 72 * 60))
+                if recibida > ahora:
+                    continue
+                devuelta = rnd.random() < 0.08
+                yield (numeros[i], 'DEVUELTA' if devuelta else 'ENTREGADA',
+                       rnd.choice(MOTIVOS) if devuelta else '', recibida.isoformat())
+
+        cargado['recepciones'] = _copiar(cur, 'recepciones', ('numero_guia', 'tipo', 'motivo', 'fecha'),
+                                         filas_recepciones())
+        conn.commit()
+        salida(f"recepciones: {cargado['recepciones']} ({time.perf_counter() - t0:.1f} s)")
+
+        # Recogidas
+        pesos_cliente = zipf(len(clientes))
+
+        def filas_recogidas():
+            for _ in range(n['recogidas']):
+                dia = rnd.choices(range(dias), weights=pesos_dia)[0]
+                fecha = datetime.combine(hasta - timedelta(days=dia), hora(8), BOGOTA) + \
+                    timedelta(seconds=rnd.randint(0, 9 * 3600))
+                numero = numeros[rnd.randrange(guias)] if rnd.random() < 0.7 else ''
+                cliente = rnd.choices(clientes, weights=pesos_cliente)[0]
+                yield (numero or None, fecha.isoformat(), rnd.choice(OBSERVACIONES), cliente)
+
+        cargado['recogidas'] = _copiar(cur, 'recogidas', ('numero_guia', 'fecha', 'observaciones', 'cliente_id'),
+                                       filas_recogidas())
+        conn.commit()
+
+        cur.execute("ANALYZE zonas; ANALYZE mensajeros; ANALYZE clientes; ANALYZE guias; ANALYZE despachos; "
+                    "ANALYZE recepciones; ANALYZE recogidas; ANALYZE despachos_diarios; ANALYZE pendientes_diarios;")
+        conn.commit()
+    return cargado
+
+
+def borrar(conn, prefijo='SG'):
+    patron = prefijo + '%'
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM recogidas
+            WHERE numero_guia LIKE %s OR cliente_id IN (SELECT id FROM clientes WHERE nombre LIKE %s);
+        """, (patron, prefijo + ' %'))
+        for tabla in ('recepciones', 'despachos', 'guias'):
+            cur.execute(f"DELETE FROM {tabla} WHERE numero_guia LIKE %s;", (patron,))
+        cur.execute("DELETE FROM liquidaciones WHERE mensajero LIKE %s;", (prefijo + '-%',))
+        cur.execute("DELETE FROM mensajeros WHERE nombre LIKE %s;", (prefijo + '-%',))
+        cur.execute("DELETE FROM zonas WHERE nombre LIKE %s;", (prefijo + '-%',))
+        cur.execute("DELETE FROM clientes WHERE nombre LIKE %s;", (prefijo + ' %',))
+    conn.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--escala', choices=list(ESCALAS), default='10k')
+    ap.add_argument('--guias', type=int, help='cantidad exacta de guías (en vez de --escala)')
+    ap.add_argument('--semilla', type=int, default=42)
+    ap.add_argument('--prefijo', default='SG')
+    ap.add_argument('--dias', type=int, default=180, help='días de historial')
+    ap.add_argument('--hasta', type=date.fromisoformat, help='último día del historial (AAAA-MM-DD)')
+    ap.add_argument('--borrar', action='store_true', help='borra lo generado con --prefijo y termina')
+    base_pruebas.agregar_argumento(ap)
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(args.base)
+    try:
+        if args.borrar:
+            borrar(conn, args.prefijo)
+            print(f"Borrados los datos con prefijo {args.prefijo}")
+            return
+        with conn.cursor() as cur:
+            previas = existentes(cur, args.prefijo)
+        if previas:
+            sys.exit(f"Ya hay {previas} guías con prefijo {args.prefijo}: use --borrar antes o otro --prefijo")
+        guias = args.guias or ESCALAS[args.escala]
+        t0 = time.perf_counter()
+        cargado = generar(conn, guias, args.semilla, args.prefijo, args.dias, args.hasta)
+        print(", ".join(f"{k}: {v}" for k, v in cargado.items()) + f" en {time.perf_counter() - t0:.1f} s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+import logging
+import select
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import psycopg2
+
+# =========================
+#   Cache versionado en memoria
+# =========================
+#
+# Cada tabla cacheada tiene un contador en la tabla `versiones` de Postgres,
+# que un trigger incrementa en cada INSERT/UPDATE/DELETE (en las tablas de
+# referencia, uno por fila que además hace NOTIFY con la clave).
+# - sincronizar(): una sola consulta a `versiones`; marca como vencidas solo
+#   las tablas cuya versión cambió (se recargan al leerlas).
+# - aplicar(): una escritura de este proceso aplica su delta sin recargar.
+# - EscuchaCambios: hilo con LISTEN que recibe los NOTIFY de otros workers
+#   y aplica solo la fila cambiada.
+
+
+class _Tabla:
+    def __init__(self, nombre, cargar, dependientes):
+        self.nombre = nombre
+        self.cargar = cargar
+        self.dependientes = dependientes
+        self.datos = None
+        self.version = None
+        self.vigente = False
+
+
+class CacheReferencias:
+    def __init__(self, leer_versiones, intervalo=5.0):
+        """
+        leer_versiones: callable sin argumentos que devuelve {tabla: version}.
+        intervalo: segundos mínimos entre dos sincronizaciones.
+        """
+        self._leer_versiones = leer_versiones
+        self.intervalo = intervalo
+        self._tablas = {}
+        self._lock = threading.RLock()
+        self._ultima_sync = 0.0
+
+    def registrar(self, nombre, cargar, dependientes=()):
+        """
+        cargar: callable sin argumentos que devuelve los datos de la tabla.
+        dependientes: tablas que se invalidan cuando esta se recarga
+        (p. ej. mensajeros guarda referencias a objetos Zona).
+        """
+        with self._lock:
+            self._tablas[nombre] = _Tabla(nombre, cargar, tuple(dependientes))
+
+    def get(self, nombre):
+        with self._lock:
+            t = self._tablas[nombre]
+            if not t.vigente or t.datos is None:
+                # La versión se lee ANTES que los datos: si alguien escribe en
+                # medio, la próxima sincronización verá una versión mayor y
+                # recargará de nuevo (nunca se pierde un cambio).
+                version = self._leer_versiones().get(nombre, 0)
+                t.datos = t.cargar()
+                t.version = version
+                t.vigente = True
+                for dep in t.dependientes:
+                    self.invalidar(dep)
+            return t.datos
+
+    def invalidar(self, nombre=None):
+        with self._lock:
+            for t in ([self._tablas[nombre]] if nombre else self._tablas.values()):
+                t.vigente = False
+
+    def sincronizar(self, forzar=False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultima_sync < self.intervalo:
+            return
+        versiones = self._leer_versiones()
+        with self._lock:
+            self._ultima_sync = ahora
+            for t in self._tablas.values():
+                if t.version != versiones.get(t.nombre, 0):
+                    t.vigente = False
+
+    def aplicar(self, nombre, version, delta):
+        """
+        Aplica el cambio de una escritura propia.
+
+        version: versión de la tabla leída dentro de la misma transacción que
+        la escritura. Solo se aplica si es exactamente la siguiente a la que
+        tenemos; si otro proceso escribió entretanto, la tabla se marca vencida.
+        delta: callable que recibe los datos actuales y devuelve los nuevos.
+        """
+        with self._lock:
+            t = self._tablas[nombre]
+            if t.datos is None or t.version is None:
+                t.vigente = False
+            elif version == t.version + 1:
+                t.datos = delta(t.datos)
+                t.version = version
+            elif version > t.version:
+                t.vigente = False
+
+
+def normalize_db_url(raw_url: str) -> str:
+    """
+    - Asegura sslmode=require.
+    - Elimina channel_binding (puede romper según cliente).
+    - Agrega application_name.
+    """
+    if not raw_url:
+        return raw_url
+    parsed = urlparse(raw_url)
+    q = dict(parse_qsl(parsed.query, keep_blank_values=True))
+    q.pop("channel_binding", None)
+    if "sslmode" not in q:
+        q["sslmode"] = "require"
+    if "application_name" not in q:
+        q["application_name"] = "mensajeria_plataf"
+    new_query = urlencode(q)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
+
+
+def dsn_directo(dsn: str) -> str:
+    """
+    LISTEN no funciona a través de PgBouncer en modo transacción. Si la URL es
+    la del pooler de Neon (host con '-pooler'), devuelve la del endpoint directo.
+    """
+    parsed = urlparse(dsn)
+    if parsed.hostname and '-pooler' in parsed.hostname:
+        return urlunparse(parsed._replace(netloc=parsed.netloc.replace('-pooler', '', 1)))
+    return dsn
+
+
+class EscuchaCambios(threading.Thread):
+    """
+    Hilo daemon que hace LISTEN en `canal` y llama a manejar(evento) por cada
+    NOTIFY, con el payload JSON ya decodificado. Si la conexión se cae,
+    reintenta; al (re)conectar llama a al_conectar() porque pudo perder avisos.
+    """
+
+    def __init__(self, dsn, canal, manejar, al_conectar=None, espera=5.0):
+        super().__init__(name=f"escucha-{canal}", daemon=True)
+        self.dsn = dsn
+        self.canal = canal
+        self.manejar = manejar
+        self.al_conectar = al_conectar
+        self.espera = espera
+        self.conectado = False
+        self._parar = threading.Event()
+
+    def detener(self):
+        self._parar.set()
+
+    def run(self):
+        while not self._parar.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.canal};")
+                self.conectado = True
+                if self.al_conectar:
+                    self.al_conectar()
+                while not self._parar.is_set():
+                    if select.select([conn], [], [], self.espera) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        try:
+                            self.manejar(json.loads(aviso.payload))
+                        except Exception:
+                            logging.exception("No se pudo aplicar el aviso %s", aviso.payload)
+            except Exception:
+                logging.exception("Escucha de %s desconectada; reintentando", self.canal)
+                self._parar.wait(self.espera)
+            finally:
+                self.conectado = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+# =========================
+#   Cache de exportaciones en disco
+# =========================
+#
+# Un export queda determinado por el endpoint, sus filtros, el formato y la
+# versión (tabla `versiones`) de cada tabla que lee. Esa combinación es la
+# clave del archivo y también el ETag: si ninguna tabla cambió, el mismo
+# export se sirve desde disco (o con 304 si el navegador ya lo tiene).
+#
+# - Escritura atómica: se escribe en un .tmp y se renombra al terminar; un
+#   envío cortado a la mitad nunca deja un archivo incompleto en el cache.
+# - LRU por tamaño: cada acierto actualiza el mtime; al pasar del tope se
+#   borran los archivos con mtime más antiguo.
+
+# Parámetros de la vista que no cambian el contenido del export
+PARAMS_IGNORADOS = {'cursor', 'n', 'total'}
+
+# Segundos tras los que un .tmp sin terminar se considera abandonado
+TMP_ABANDONADO = 3600
+
+
+class CacheExport:
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if self.activo:
+            os.makedirs(directorio, exist_ok=True)
+
+    @property
+    def activo(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def clave(endpoint, args, formato, versiones) -> str:
+        """
+        args: pares (nombre, valor) de la petición; se ignoran los vacíos y
+        los de paginación, y se ordenan para que el orden en la URL no importe.
+        versiones: {tabla: version} solo de las tablas que lee el export.
+        """
+        filtros = sorted((k, v.strip()) for k, v in args
+                         if k not in PARAMS_IGNORADOS and k != 'formato' and (v or '').strip())
+        crudo = json.dumps([endpoint, formato, filtros, sorted(versiones.items())], separators=(',', ':'))
+        return hashlib.sha256(crudo.encode()).hexdigest()[:32]
+
+    def _ruta(self, clave, ext):
+        return os.path.join(self.directorio, f"{clave}.{ext}")
+
+    def buscar(self, clave, ext):
+        """Ruta del archivo si está en cache (y lo marca como recién usado)."""
+        ruta = self._ruta(clave, ext)
+        try:
+            os.utime(ruta)
+        except OSError:
+            return None
+        return ruta
+
+    def guardar(self, clave, ext, trozos):
+        """Devuelve los mismos trozos y a la vez los escribe en el cache."""
+        ruta = self._ruta(clave, ext)
+        tmp = f"{ruta}.{uuid.uuid4().hex[:8]}.tmp"
+        completo = False
+        try:
+            with open(tmp, 'wb') as f:
+                for trozo in trozos:
+                    f.write(trozo)
+                    yield trozo
+            os.replace(tmp, ruta)
+            completo = True
+        finally:
+            if not completo:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        self.recortar()
+
+    def recortar(self):
+        """Borra los archivos menos usados hasta quedar bajo max_bytes."""
+        with self._lock:
+            try:
+                archivos = []
+                limite_tmp = time.time() - TMP_ABANDONADO
+                for entrada in os.scandir(self.directorio):
+                    if not entrada.is_file():
+                        continue
+                    st = entrada.stat()
+                    if not entrada.name.endswith('.tmp'):
+                        archivos.append((st.st_mtime, st.st_size, entrada.path))
+                    elif st.st_mtime < limite_tmp:
+                        # restos de un proceso que murió a mitad de un export
+                        os.remove(entrada.path)
+            except OSError:
+                logging.exception("No se pudo revisar el cache de exportaciones")
+                return
+            total = sum(a[1] for a in archivos)
+            for _, tamano, ruta in sorted(archivos):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tamano
+                except OSError:
+                    pass
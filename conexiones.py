@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+# =========================
+#   Pool de conexiones a Postgres
+# =========================
+#
+# Reemplaza a psycopg2.pool.ThreadedConnectionPool, que lanza PoolError en
+# cuanto se agota:
+# - Cola de espera acotada: si todas las conexiones están en uso, la petición
+#   espera hasta `espera` segundos; si ya hay `cola_max` esperando, se rechaza
+#   de inmediato. En ambos casos se lanza PoolAgotado (la app responde 503).
+# - Chequeo al entregar: una conexión que estuvo libre más de `chequeo`
+#   segundos se prueba con SELECT 1 (Neon corta las inactivas); si falla se
+#   descarta y se entrega otra.
+# - Reciclaje: las conexiones con más de `edad_max` segundos se cierran al
+#   devolverlas (o al sacarlas de las libres) y se abren nuevas a demanda.
+# - Keepalives TCP para detectar antes una conexión cortada.
+
+KEEPALIVES = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 3}
+
+
+class PoolAgotado(Exception):
+    """No hubo conexión libre a tiempo. `reintentar`: segundos sugeridos al cliente."""
+
+    def __init__(self, mensaje, reintentar=1):
+        super().__init__(mensaje)
+        self.reintentar = reintentar
+
+
+class _Conexion:
+    __slots__ = ('conn', 'creada', 'liberada')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.creada = time.monotonic()
+        self.liberada = self.creada
+
+
+class PoolConexiones:
+    def __init__(self, dsn, minimo=1, maximo=5, espera=5.0, cola_max=50, edad_max=1800.0,
+                 chequeo=30.0, conectar_kwargs=None):
+        self.dsn = dsn
+        self.minimo = minimo
+        self.maximo = maximo
+        self.espera = espera
+        self.cola_max = cola_max
+        self.edad_max = edad_max
+        self.chequeo = chequeo
+        self.conectar_kwargs = dict(KEEPALIVES, **(conectar_kwargs or {}))
+
+        self._cond = threading.Condition()
+        self._libres = deque()   # _Conexion; se reusa la última devuelta (LIFO)
+        self._en_uso = {}        # id(conn) -> _Conexion
+        self._abriendo = 0
+        self._esperando = 0
+        self._stats = {'creadas': 0, 'descartadas': 0, 'recicladas': 0, 'timeouts': 0, 'rechazadas': 0,
+                       'entregadas': 0, 'espera_total_ms': 0.0, 'espera_max_ms': 0.0}
+
+        for _ in range(minimo):
+            self._libres.append(self._abrir())
+
+    # ---------- Apertura / cierre ----------
+
+    def _abrir(self):
+        conn = psycopg2.connect(self.dsn, **self.conectar_kwargs)
+        with self._cond:
+            self._stats['creadas'] += 1
+        return _Conexion(conn)
+
+    @staticmethod
+    def _cerrar(c):
+        try:
+            c.conn.close()
+        except Exception:
+            pass
+
+    def _viva(self, c) -> bool:
+        if c.conn.closed:
+            return False
+        if time.monotonic() - c.liberada < self.chequeo:
+            return True
+        try:
+            with c.conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            c.conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @property
+    def _total(self):
+        return len(self._libres) + len(self._en_uso) + self._abriendo
+
+    # ---------- Entrega / devolución ----------
+
+    def obtener(self, espera=None):
+        """Entrega una conexión o lanza PoolAgotado tras `espera` segundos."""
+        espera = self.espera if espera is None else espera
+        inicio = time.monotonic()
+        limite = inicio + espera
+        while True:
+            c = None
+            with self._cond:
+                if not self._libres and self._total >= self.maximo:
+                    if self._esperando >= self.cola_max:
+                        self._stats['rechazadas'] += 1
+                        raise PoolAgotado("Cola de espera de conexiones llena", reintentar=max(1, round(espera)))
+                    self._esperando += 1
+                    try:
+                        while not self._libres and self._total >= self.maximo:
+                            restante = limite - time.monotonic()
+                            if restante <= 0:
+                                self._stats['timeouts'] += 1
+                                raise PoolAgotado(f"Sin conexión libre tras {espera:.1f} s",
+                                                  reintentar=max(1, round(espera)))
+                            self._cond.wait(restante)
+                    finally:
+                        self._esperando -= 1
+                # La conexión cuenta como en uso desde que se toma (también
+                # mientras se prueba o se abre): así _total nunca pasa de maximo
+                if self._libres:
+                    c = self._libres.pop()
+                    self._en_uso[id(c.conn)] = c
+                else:
+                    self._abriendo += 1
+
+            if c is None:
+                try:
+                    c = self._abrir()
+                except BaseException:
+                    with self._cond:
+                        self._abriendo -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._abriendo -= 1
+                    self._en_uso[id(c.conn)] = c
+            else:
+                motivo = ('recicladas' if time.monotonic() - c.creada > self.edad_max
+                          else None if self._viva(c) else 'descartadas')
+                if motivo:
+                    self._cerrar(c)
+                    with self._cond:
+                        self._en_uso.pop(id(c.conn), None)
+                        self._stats[motivo] += 1
+                        self._cond.notify()
+                    continue
+
+            esperado = (time.monotonic() - inicio) * 1000
+            with self._cond:
+                self._stats['entregadas'] += 1
+                self._stats['espera_total_ms'] += esperado
+                self._stats['espera_max_ms'] = max(self._stats['espera_max_ms'], esperado)
+            return c.conn
+
+    def devolver(self, conn, descartar=False):
+        """Devuelve la conexión; se deshace lo que haya quedado sin commit."""
+        with self._cond:
+            c = self._en_uso.pop(id(conn), None)
+        if c is None:
+            return
+        motivo = None
+        if descartar or conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            motivo = 'descartadas'
+        else:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    motivo = 'descartadas'
+            if motivo is None and time.monotonic() - c.creada > self.edad_max:
+                motivo = 'recicladas'
+
+        with self._cond:
+            if motivo:
+                self._stats[motivo] += 1
+            else:
+                c.liberada = time.monotonic()
+                self._libres.append(c)
+            self._cond.notify()
+        if motivo:
+            self._cerrar(c)
+
+    def cerrar_todas(self):
+        with self._cond:
+            libres, self._libres = list(self._libres), deque()
+        for c in libres:
+            self._cerrar(c)
+
+    # ---------- Monitoreo ----------
+
+    def estadisticas(self) -> dict:
+        with self._cond:
+            datos = dict(self._stats)
+            datos.update({
+                'maximo': self.maximo,
+                'abiertas': self._total,
+                'en_uso': len(self._en_uso),
+                'libres': len(self._libres),
+                'esperando': self._esperando,
+            })
+        datos['espera_promedio_ms'] = round(datos['espera_total_ms'] / datos['entregadas'], 2) if datos['entregadas'] else 0.0
+        datos['espera_total_ms'] = round(datos['espera_total_ms'], 2)
+        datos['espera_max_ms'] = round(datos['espera_max_ms'], 2)
+        return datos
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+import psycopg2
+
+# =========================
+#   Registro de consultas lentas
+# =========================
+#
+# Cada consulta que tarda más de `umbral` segundos (medida en el cursor, ver
+# metricas.py) se anota como una línea JSON en un log local rotativo: fecha,
+# origen (ruta o hilo), duración, SQL y la forma de los parámetros. Los
+# valores no se guardan (son guías, nombres, direcciones): de un texto queda
+# solo su largo, de una lista su tamaño; números, fechas y NULL van tal cual.
+#
+# A una fracción `muestreo` de ellas se les agrega el plan de
+# EXPLAIN (ANALYZE, BUFFERS). EXPLAIN ANALYZE vuelve a ejecutar la consulta,
+# así que:
+# - solo se hace con SELECT sin escrituras, bloqueos ni funciones con efectos;
+# - corre en un hilo aparte con su propia conexión, en una transacción
+#   READ ONLY que se deshace y con statement_timeout; la petición no espera;
+# - la misma sentencia se explica como mucho una vez cada `intervalo_plan`
+#   segundos y la cola es acotada (si se llena, la entrada va sin plan).
+# Las que usan tablas temporales o sentencias preparadas de otra conexión
+# quedan con el error del EXPLAIN en lugar del plan.
+#
+# La página de administración lee solo el final del log actual (MAX_LECTURA
+# bytes), no las copias rotadas.
+
+LOGGER = 'consultas_lentas'
+MAX_SQL = 4000
+MAX_PARAMS = 1000
+MAX_LECTURA = 1024 * 1024
+
+_SOLO_LECTURA = re.compile(r'^\s*(select|with)\b', re.I)
+_EFECTOS = re.compile(r'\b(insert|update|delete|merge|truncate|share|nextval|setval|pg_advisory\w*|pg_notify|'
+                      r'recalcular_\w+|reconstruir_\w+|dblink\w*|lo_\w+)\b', re.I)
+
+
+def explicable(sql: str) -> bool:
+    """SELECT (o WITH) sin nada que escriba o bloquee al ejecutarse dos veces."""
+    return bool(_SOLO_LECTURA.match(sql)) and not _EFECTOS.search(sql)
+
+
+def _texto(cur, query):
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    if isinstance(query, str):
+        return query
+    try:
+        return query.as_string(cur)   # psycopg2.sql.Composed
+    except Exception:
+        return repr(query)
+
+
+def _plantilla(sql):
+    return ' '.join(sql.split())[:MAX_SQL]
+
+
+def _forma(valor):
+    if valor is None or isinstance(valor, (bool, int, float, date)):
+        return repr(valor)
+    if isinstance(valor, (str, bytes)):
+        return f"<texto {len(valor)}>"
+    if isinstance(valor, (list, tuple)):
+        return f"<lista {len(valor)}>"
+    return f"<{type(valor).__name__}>"
+
+
+def resumir_params(params):
+    """Parámetros sin sus valores de texto: ['<texto 10>', 42, datetime.date(2024, 5, 1)]."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        texto = "{" + ", ".join(f"{k!r}: {_forma(v)}" for k, v in params.items()) + "}"
+    elif isinstance(params, (list, tuple)):
+        texto = "[" + ", ".join(_forma(v) for v in params) + "]"
+    else:
+        texto = _forma(params)
+    return texto[:MAX_PARAMS]
+
+
+class ConsultasLentas:
+    def __init__(self, dsn, ruta_log, umbral=0.5, muestreo=0.2, intervalo_plan=600,
+                 max_bytes=5 * 1024 * 1024, copias=3, origen=None):
+        """
+        umbral: segundos; muestreo: fracción (0..1) que se explica;
+        origen: función que devuelve la ruta o el hilo de la consulta.
+        """
+        self.dsn = dsn
+        self.ruta_log = ruta_log
+        self.umbral = umbral
+        self.muestreo = muestreo
+        self.intervalo_plan = intervalo_plan
+        self.origen = origen or (lambda: threading.current_thread().name)
+
+        os.makedirs(os.path.dirname(ruta_log) or '.', exist_ok=True)
+        self._log = logging.getLogger(LOGGER)
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        if not any(isinstance(h, RotatingFileHandler) and h.baseFilename == os.path.abspath(ruta_log)
+                   for h in self._log.handlers):
+            handler = RotatingFileHandler(ruta_log, maxBytes=max_bytes, backupCount=copias, encoding='utf-8',
+                                          delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._log.addHandler(handler)
+
+        self._cola = queue.Queue(maxsize=100)
+        self._explicadas = {}     # plantilla -> monotonic del último plan
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._conn = None
+
+    # ---------- Desde el cursor ----------
+
+    def observar(self, cur, query, params, segundos) -> bool:
+        """Llamada por el cursor medido tras cada consulta. True si la anotó."""
+        if segundos < self.umbral:
+            return False
+        try:
+            sql = _texto(cur, query)
+            entrada = {
+                'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'origen': str(self.origen() or ''),
+                'ms': round(segundos * 1000, 1),
+                'sql': _plantilla(sql),
+                'params': resumir_params(params),
+            }
+            if self._toca_plan(entrada['sql']):
+                completa = cur.mogrify(query, params) if params is not None else sql
+                completa = completa.decode('utf-8', 'replace') if isinstance(completa, bytes) else completa
+                try:
+                    self._arrancar()
+                    self._cola.put_nowait((entrada, completa, segundos))
+                    return True
+                except queue.Full:
+                    entrada['plan_error'] = 'cola de EXPLAIN llena'
+            self._escribir(entrada)
+        except Exception:
+            logging.exception("No se pudo registrar una consulta lenta")
+        return True
+
+    def _toca_plan(self, plantilla):
+        if random.random() >= self.muestreo or not explicable(plantilla):
+            return False
+        ahora = time.monotonic()
+        with self._lock:
+            ultimo = self._explicadas.get(plantilla)
+            if ultimo is not None and ahora - ultimo < self.intervalo_plan:
+                return False
+            self._explicadas[plantilla] = ahora
+            if len(self._explicadas) > 1000:
+                self._explicadas.clear()
+        return True
+
+    def _escribir(self, entrada):
+        self._log.info(json.dumps(entrada, ensure_ascii=False, default=str))
+
+    # ---------- Hilo de EXPLAIN ----------
+
+    def _arrancar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name='explain-lentas', daemon=True)
+                self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            entrada, sql, segundos = self._cola.get()
+            try:
+                entrada['plan'] = self._explicar(sql, segundos)
+            except psycopg2.Error as e:
+                entrada['plan_error'] = str(e).strip()[:500]
+            except Exception as e:
+                entrada['plan_error'] = f"{type(e).__name__}: {e}"[:500]
+            self._escribir(entrada)
+
+    def _explicar(self, sql, segundos):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+        conn = self._conn
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION READ ONLY;")
+                # Tope: varias veces lo que tardó la original
+                cur.execute("SET LOCAL statement_timeout = %s;", (int(max(segundos * 4, 5) * 1000),))
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+                return "\n".join(r[0] for r in cur.fetchall())
+        finally:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+
+    # ---------- Lectura para la página de administración ----------
+
+    def entradas(self, max_bytes=MAX_LECTURA):
+        """Entradas de los últimos `max_bytes` del log actual, de la más vieja a la más nueva."""
+        try:
+            f = open(self.ruta_log, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            tamano = f.seek(0, os.SEEK_END)
+            f.seek(max(0, tamano - max_bytes))
+            if tamano > max_bytes:
+                f.readline()   # la primera línea queda cortada
+            for linea in f:
+                try:
+                    yield json.loads(linea.decode('utf-8', 'replace'))
+                except ValueError:
+                    continue
+
+    def peores(self, limite=20, orden='total'):
+        """
+        Sentencias agrupadas por texto: veces, ms total / máximo / promedio,
+        orígenes, últimos parámetros y el plan más reciente. orden: total | max.
+        """
+        grupos = defaultdict(lambda: {'veces': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'origenes': set(),
+                                      'ultima': None, 'params': None, 'plan': None, 'plan_fecha': None,
+                                      'plan_error': None})
+        for e in self.entradas():
+            g = grupos[e.get('sql', '')]
+            g['veces'] += 1
+            g['total_ms'] += e.get('ms', 0)
+            g['max_ms'] = max(g['max_ms'], e.get('ms', 0))
+            g['origenes'].add(e.get('origen', ''))
+            g['ultima'] = e.get('fecha')
+            g['params'] = e.get('params')
+            if e.get('plan'):
+                g['plan'], g['plan_fecha'], g['plan_error'] = e['plan'], e.get('fecha'), None
+            elif e.get('plan_error') and not g['plan']:
+                g['plan_error'] = e['plan_error']
+        filas = []
+        for sql, g in grupos.items():
+            g['sql'] = sql
+            g['promedio_ms'] = round(g['total_ms'] / g['veces'], 1)
+            g['total_ms'] = round(g['total_ms'], 1)
+            g['origenes'] = ", ".join(sorted(o for o in g['origenes'] if o))
+            filas.append(g)
+        filas.sort(key=lambda g: g['max_ms' if orden == 'max' else 'total_ms'], reverse=True)
+        return filas[:limite]
@@ -0,0 +1,663 @@
+import hashlib
+import logging
+import os
+import sys
+
+import click
+import psycopg2
+from psycopg2 import errorcodes
+
+import trabajos
+from cache import dsn_directo, normalize_db_url
+
+# =========================
+#   Esquema y migraciones
+# =========================
+#
+# El esquema se crea y se cambia con migraciones numeradas (MIGRACIONES) que
+# se aplican una sola vez y quedan anotadas en `schema_version`. Al arrancar,
+# la app solo compara la versión de la base con la última de esta lista (una
+# consulta); las migraciones se aplican con:
+#
+#     python esquema.py migrar        (o python esquema.py estado)
+#
+# Cada migración es una lista de pasos:
+# - SQL (str) o función(cur): corren en una transacción, junto con el registro
+#   en schema_version. Si algo falla no queda nada a medias.
+# - fuera_de_transaccion(...): en autocommit. Es lo que necesita
+#   CREATE INDEX CONCURRENTLY, que no bloquea las escrituras en tablas grandes;
+#   ver indice_concurrente().
+# Las migraciones ya aplicadas no se editan: un cambio es una migración nueva.
+#
+# Las funciones de trigger que dependen de la configuración (ZONA_NEGOCIO) son
+# REPETIBLES: se guardan con un checksum en `schema_repetibles` y se vuelven a
+# crear, regenerando su resumen, cuando el SQL cambia.
+
+# Tablas con contador en `versiones`. Solo las de referencia viven en memoria;
+# el historial (guias, despachos, recepciones, recogidas) se consulta siempre en SQL.
+TABLAS_VERSIONADAS = ('zonas', 'mensajeros', 'clientes', 'guias', 'despachos', 'recepciones', 'recogidas',
+                      'liquidaciones')
+# Tablas de referencia -> columna clave enviada en el NOTIFY
+CLAVES_REFERENCIA = {'zonas': 'nombre', 'mensajeros': 'nombre', 'clientes': 'id'}
+CANAL_CAMBIOS = 'cambios_referencia'
+
+# Zona horaria del negocio: define a qué día pertenece cada despacho en los resúmenes
+ZONA_NEGOCIO = os.getenv("ZONA_NEGOCIO", "America/Bogota")
+
+# Estado actual de una guía según despachos y recepciones; el que se guarda en
+# `guias` (COLUMNAS_ESTADO) debe coincidir siempre con este.
+COLUMNAS_ESTADO = ('estado', 'mensajero', 'zona', 'fecha_despacho', 'fecha_recepcion', 'motivo')
+# Fragmentos sobre `guias g` y el estado derivado `e`
+SET_ESTADO = "({}) = ({})".format(", ".join(COLUMNAS_ESTADO), ", ".join(f"e.{c}" for c in COLUMNAS_ESTADO))
+ESTADO_DISTINTO = "({}) IS DISTINCT FROM ({})".format(", ".join(f"g.{c}" for c in COLUMNAS_ESTADO),
+                                                      ", ".join(f"e.{c}" for c in COLUMNAS_ESTADO))
+# Contenido esperado de pendientes_diarios (parámetro: ZONA_NEGOCIO)
+SQL_PENDIENTES_DIARIOS = """
+    SELECT (fecha_despacho AT TIME ZONE %s)::date AS fecha, COALESCE(mensajero, '') AS mensajero, COUNT(*)::int AS total
+    FROM guias
+    WHERE estado = 'DESPACHADA'
+    GROUP BY 1, 2
+"""
+SQL_ESTADO_DERIVADO = """
+    SELECT g.numero_guia,
+           CASE WHEN r.numero_guia IS NOT NULL THEN r.tipo
+                WHEN d.numero_guia IS NOT NULL THEN 'DESPACHADA'
+                ELSE 'EN VERIFICACION' END AS estado,
+           d.mensajero, d.zona, d.fecha AS fecha_despacho, r.fecha AS fecha_recepcion, r.motivo
+    FROM guias g
+    LEFT JOIN despachos d   ON d.numero_guia = g.numero_guia
+    LEFT JOIN recepciones r ON r.numero_guia = g.numero_guia
+"""
+
+# Una migración a la vez aunque arranquen varios procesos (pg_advisory_lock)
+LLAVE_MIGRACION = 720_021
+# Espera máxima por el lock de una tabla en uso: mejor fallar y reintentar
+# que dejar en cola todas las consultas detrás de un ALTER TABLE
+LOCK_TIMEOUT = os.getenv("MIGRACION_LOCK_TIMEOUT", "10s")
+
+SQL_CONTROL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version     INTEGER PRIMARY KEY,
+        descripcion TEXT NOT NULL,
+        aplicada    TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS schema_repetibles (
+        nombre    TEXT PRIMARY KEY,
+        checksum  TEXT NOT NULL,
+        aplicada  TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+
+class fuera_de_transaccion:
+    """Paso que corre en autocommit (SQL o función(cur))."""
+
+    def __init__(self, paso):
+        self.paso = paso
+
+
+def indice_concurrente(nombre, definicion):
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS `nombre` `definicion`. Si un
+    intento anterior se cortó, el índice quedó marcado inválido: se borra y se
+    vuelve a crear.
+    """
+    def crear(cur):
+        cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s);", (nombre,))
+        fila = cur.fetchone()
+        if fila and not fila[0]:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre};")
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} {definicion};")
+    return fuera_de_transaccion(crear)
+
+
+def _triggers_por_evento(nombre, tabla, funcion):
+    """
+    Triggers por sentencia con tablas de transición (nuevas / viejas). Una
+    tabla de transición solo se admite en triggers de un único evento.
+    """
+    pasos = [f"""
+        CREATE OR REPLACE TRIGGER {nombre}_{evento.lower()}
+        AFTER {evento} ON {tabla}
+        REFERENCING {referencias}
+        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+    """ for evento, referencias in (('INSERT', 'NEW TABLE AS nuevas'),
+                                    ('UPDATE', 'OLD TABLE AS viejas NEW TABLE AS nuevas'),
+                                    ('DELETE', 'OLD TABLE AS viejas'))]
+    pasos.append(f"""
+        CREATE OR REPLACE TRIGGER {nombre}_truncate
+        AFTER TRUNCATE ON {tabla}
+        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+    """)
+    return pasos
+
+
+def _indices_trgm(cur):
+    # "Número de guía contiene" (ILIKE '%x%') con índices trigram, si el
+    # servidor permite pg_trgm; si no, la búsqueda funciona igual sin índice.
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    except psycopg2.Error:
+        logging.warning("pg_trgm no disponible: la búsqueda por número de guía no usará índice")
+        return
+    for tabla in ('recepciones', 'recogidas'):
+        indice_concurrente(f"idx_{tabla}_numero_trgm",
+                           f"ON {tabla} USING gin (numero_guia gin_trgm_ops)").paso(cur)
+
+
+def _triggers_versiones():
+    pasos = []
+    for tabla in TABLAS_VERSIONADAS:
+        if tabla in CLAVES_REFERENCIA:
+            pasos += [f"""
+                CREATE OR REPLACE TRIGGER trg_version_{tabla}
+                AFTER INSERT OR UPDATE OR DELETE ON {tabla}
+                FOR EACH ROW EXECUTE FUNCTION notificar_cambio('{CLAVES_REFERENCIA[tabla]}');
+            """, f"""
+                CREATE OR REPLACE TRIGGER trg_version_{tabla}_truncate
+                AFTER TRUNCATE ON {tabla}
+                FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio('{CLAVES_REFERENCIA[tabla]}');
+            """]
+        else:
+            pasos.append(f"""
+                CREATE OR REPLACE TRIGGER trg_version_{tabla}
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabla}
+                FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version();
+            """)
+    return pasos
+
+
+def _llenar_estado_guias(cur):
+    # Columnas recién agregadas sobre un historial existente: se llenan una vez
+    reconstruir_estado_guias(cur)
+
+
+# (versión, descripción, pasos). Solo se agregan al final.
+MIGRACIONES = [
+    (1, "Tablas base", ["""
+        CREATE TABLE IF NOT EXISTS zonas (
+            nombre TEXT PRIMARY KEY,
+            tarifa NUMERIC NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS mensajeros (
+            nombre TEXT PRIMARY KEY,
+            zona   TEXT REFERENCES zonas(nombre)
+        );
+        CREATE TABLE IF NOT EXISTS guias (
+            remitente   TEXT,
+            numero_guia TEXT PRIMARY KEY,
+            destinatario TEXT,
+            direccion   TEXT,
+            ciudad      TEXT
+        );
+        CREATE TABLE IF NOT EXISTS despachos (
+            numero_guia TEXT PRIMARY KEY,
+            mensajero   TEXT,
+            zona        TEXT,
+            fecha       TIMESTAMPTZ NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS recepciones (
+            numero_guia TEXT PRIMARY KEY,
+            tipo        TEXT,           -- ENTREGADA / DEVUELTA
+            motivo      TEXT,
+            fecha       TIMESTAMPTZ NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS recogidas (
+            id          SERIAL PRIMARY KEY,
+            numero_guia TEXT,
+            fecha       TIMESTAMPTZ NOT NULL,
+            observaciones TEXT
+        );
+        CREATE TABLE IF NOT EXISTS clientes (
+            id SERIAL PRIMARY KEY,
+            nombre TEXT UNIQUE NOT NULL,
+            telefono TEXT,
+            direccion TEXT,
+            ciudad TEXT,
+            contacto TEXT
+        );
+        ALTER TABLE recogidas
+        ADD COLUMN IF NOT EXISTS cliente_id INTEGER REFERENCES clientes(id);
+
+        CREATE INDEX IF NOT EXISTS idx_mensajeros_zona ON mensajeros(zona);
+        CREATE INDEX IF NOT EXISTS idx_guias_numero ON guias(numero_guia);
+        CREATE INDEX IF NOT EXISTS idx_despachos_fecha ON despachos(fecha);
+        CREATE INDEX IF NOT EXISTS idx_recepciones_fecha ON recepciones(fecha);
+        CREATE INDEX IF NOT EXISTS idx_recogidas_fecha ON recogidas(fecha);
+        CREATE INDEX IF NOT EXISTS idx_recogidas_cliente ON recogidas(cliente_id);
+    """]),
+
+    # Instantáneas de liquidación de períodos cerrados (ver liquidaciones.py)
+    # y estado de los trabajos en segundo plano (ver trabajos.py)
+    (2, "Liquidaciones y trabajos", ["""
+        CREATE TABLE IF NOT EXISTS liquidaciones (
+            id             SERIAL PRIMARY KEY,
+            fecha_inicio   DATE NOT NULL,
+            fecha_fin      DATE NOT NULL,
+            mensajero      TEXT NOT NULL,
+            zona           TEXT NOT NULL DEFAULT '',
+            cantidad_guias INTEGER NOT NULL,
+            tarifa         NUMERIC NOT NULL,
+            total_pagar    NUMERIC NOT NULL,
+            creada         TIMESTAMPTZ NOT NULL DEFAULT now(),
+            UNIQUE (fecha_inicio, fecha_fin, mensajero, zona)
+        );
+    """, trabajos.SQL_ESQUEMA]),
+
+    # Filtros de los listados (ver filtros.py): igualdad + rango/orden por fecha
+    (3, "Índices de los listados", [
+        indice_concurrente("idx_despachos_fecha_numero", "ON despachos(fecha, numero_guia)"),
+        indice_concurrente("idx_recepciones_fecha_numero", "ON recepciones(fecha, numero_guia)"),
+        indice_concurrente("idx_despachos_mensajero_fecha", "ON despachos(mensajero, fecha, numero_guia)"),
+        indice_concurrente("idx_recepciones_tipo_fecha", "ON recepciones(tipo, fecha, numero_guia)"),
+        indice_concurrente("idx_recogidas_fecha_id", "ON recogidas(fecha, id)"),
+        indice_concurrente("idx_recogidas_cliente_fecha", "ON recogidas(cliente_id, fecha, id)"),
+        fuera_de_transaccion(_indices_trgm),
+    ]),
+
+    # Versión por tabla para el cache en memoria (ver cache.py). Tablas de
+    # referencia: versión por fila + NOTIFY {tabla, op, clave, anterior, version}
+    # para que los demás workers apliquen solo esa fila (ver EscuchaCambios).
+    (4, "Versiones y avisos del cache", ["""
+        CREATE TABLE IF NOT EXISTS versiones (
+            tabla   TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+        CREATE OR REPLACE FUNCTION incrementar_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO versiones(tabla, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (tabla) DO UPDATE SET version = versiones.version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """, f"""
+        CREATE OR REPLACE FUNCTION notificar_cambio() RETURNS trigger AS $$
+        DECLARE
+            nueva    BIGINT;
+            clave    TEXT;
+            anterior TEXT;
+        BEGIN
+            INSERT INTO versiones(tabla, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (tabla) DO UPDATE SET version = versiones.version + 1
+            RETURNING version INTO nueva;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                clave := to_jsonb(NEW) ->> TG_ARGV[0];
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                anterior := to_jsonb(OLD) ->> TG_ARGV[0];
+            END IF;
+            PERFORM pg_notify('{CANAL_CAMBIOS}', json_build_object(
+                'tabla', TG_TABLE_NAME, 'op', TG_OP,
+                'clave', clave, 'anterior', anterior, 'version', nueva
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """, *_triggers_versiones()]),
+
+    # Resumen diario de despachos para ver_despacho: conteo por día (en
+    # ZONA_NEGOCIO) / mensajero / zona. Lo mantienen triggers por sentencia con
+    # tablas de transición, dentro de la misma transacción que el despacho.
+    # La función resumir_despachos() es repetible (depende de ZONA_NEGOCIO).
+    (5, "Resumen diario de despachos", ["""
+        CREATE TABLE IF NOT EXISTS despachos_diarios (
+            fecha     DATE NOT NULL,
+            mensajero TEXT NOT NULL DEFAULT '',
+            zona      TEXT NOT NULL DEFAULT '',
+            total     INTEGER NOT NULL,
+            PRIMARY KEY (fecha, mensajero, zona)
+        );
+        CREATE INDEX IF NOT EXISTS idx_despachos_diarios_mensajero ON despachos_diarios(mensajero, fecha, zona);
+    """, *_triggers_por_evento('trg_resumen_despachos', 'despachos', 'resumir_despachos')]),
+
+    # Estado actual de cada guía en la propia fila de `guias` (estado,
+    # mensajero, zona, fechas de despacho y recepción, motivo). Lo recalculan
+    # triggers por sentencia en despachos y recepciones, en la misma
+    # transacción que la escritura; la consulta de estado lee solo `guias`.
+    (6, "Estado actual en guias", ["""
+        ALTER TABLE guias
+            ADD COLUMN IF NOT EXISTS estado          TEXT DEFAULT 'EN VERIFICACION',
+            ADD COLUMN IF NOT EXISTS mensajero       TEXT,
+            ADD COLUMN IF NOT EXISTS zona            TEXT,
+            ADD COLUMN IF NOT EXISTS fecha_despacho  TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS fecha_recepcion TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS motivo          TEXT;
+    """, f"""
+        CREATE OR REPLACE FUNCTION recalcular_estado_guias(numeros TEXT[]) RETURNS void AS $$
+            UPDATE guias g
+            SET {SET_ESTADO}
+            FROM ({SQL_ESTADO_DERIVADO} WHERE g.numero_guia = ANY(numeros)) e
+            WHERE g.numero_guia = e.numero_guia AND {ESTADO_DISTINTO};
+        $$ LANGUAGE sql;
+    """, """
+        CREATE OR REPLACE FUNCTION actualizar_estado_guias() RETURNS trigger AS $$
+        DECLARE
+            numeros TEXT[] := '{}';
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                numeros := ARRAY(SELECT numero_guia FROM guias WHERE estado <> 'EN VERIFICACION');
+            ELSIF TG_TABLE_NAME = 'guias' THEN
+                -- guía cargada (o vuelta a cargar) con despacho ya registrado
+                numeros := ARRAY(SELECT n.numero_guia FROM nuevas n
+                                 JOIN despachos d ON d.numero_guia = n.numero_guia);
+            ELSE
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    numeros := numeros || ARRAY(SELECT numero_guia FROM nuevas);
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    numeros := numeros || ARRAY(SELECT numero_guia FROM viejas);
+                END IF;
+            END IF;
+            IF cardinality(numeros) > 0 THEN
+                PERFORM recalcular_estado_guias(numeros);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """, *_triggers_por_evento('trg_estado_guias', 'despachos', 'actualizar_estado_guias'),
+        *_triggers_por_evento('trg_estado_guias', 'recepciones', 'actualizar_estado_guias'), """
+        CREATE OR REPLACE TRIGGER trg_estado_guias_insert
+        AFTER INSERT ON guias
+        REFERENCING NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estado_guias();
+    """, _llenar_estado_guias]),
+
+    # Pendientes de recepción: índices parciales que solo contienen las guías
+    # DESPACHADA (entran al despachar, salen al recepcionar)
+    (7, "Índices de estado y pendientes", [
+        indice_concurrente("idx_guias_estado", "ON guias(estado)"),
+        indice_concurrente("idx_guias_pendientes",
+                           "ON guias(fecha_despacho, numero_guia) WHERE estado = 'DESPACHADA'"),
+        indice_concurrente("idx_guias_pendientes_mensajero",
+                           "ON guias(mensajero, fecha_despacho, numero_guia) WHERE estado = 'DESPACHADA'"),
+    ]),
+
+    # Pendientes por día de despacho (en ZONA_NEGOCIO) / mensajero, para los
+    # tramos de antigüedad de /pendiente sin recorrer las guías. Lo mantiene
+    # un trigger sobre los cambios de estado en `guias`, igual que
+    # despachos_diarios; resumir_pendientes() también es repetible.
+    (8, "Resumen de pendientes por día", ["""
+        CREATE TABLE IF NOT EXISTS pendientes_diarios (
+            fecha     DATE NOT NULL,
+            mensajero TEXT NOT NULL DEFAULT '',
+            total     INTEGER NOT NULL,
+            PRIMARY KEY (fecha, mensajero)
+        );
+        CREATE INDEX IF NOT EXISTS idx_pendientes_diarios_mensajero ON pendientes_diarios(mensajero, fecha);
+    """, *_triggers_por_evento('trg_resumen_pendientes', 'guias', 'resumir_pendientes')]),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+
+# ---------- Repetibles ----------
+
+def _sql_resumir_despachos():
+    return f"""
+        CREATE OR REPLACE FUNCTION resumir_despachos() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                DELETE FROM despachos_diarios;
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO despachos_diarios AS r (fecha, mensajero, zona, total)
+                SELECT (fecha AT TIME ZONE '{ZONA_NEGOCIO}')::date, COALESCE(mensajero, ''), COALESCE(zona, ''), -COUNT(*)
+                FROM viejas GROUP BY 1, 2, 3
+                ON CONFLICT (fecha, mensajero, zona) DO UPDATE SET total = r.total + EXCLUDED.total;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO despachos_diarios AS r (fecha, mensajero, zona, total)
+                SELECT (fecha AT TIME ZONE '{ZONA_NEGOCIO}')::date, COALESCE(mensajero, ''), COALESCE(zona, ''), COUNT(*)
+                FROM nuevas GROUP BY 1, 2, 3
+                ON CONFLICT (fecha, mensajero, zona) DO UPDATE SET total = r.total + EXCLUDED.total;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM despachos_diarios WHERE total <= 0;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def _sql_resumir_pendientes():
+    return f"""
+        CREATE OR REPLACE FUNCTION resumir_pendientes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                DELETE FROM pendientes_diarios;
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO pendientes_diarios AS r (fecha, mensajero, total)
+                SELECT (fecha_despacho AT TIME ZONE '{ZONA_NEGOCIO}')::date, COALESCE(mensajero, ''), -COUNT(*)
+                FROM viejas WHERE estado = 'DESPACHADA' GROUP BY 1, 2
+                ON CONFLICT (fecha, mensajero) DO UPDATE SET total = r.total + EXCLUDED.total;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO pendientes_diarios AS r (fecha, mensajero, total)
+                SELECT (fecha_despacho AT TIME ZONE '{ZONA_NEGOCIO}')::date, COALESCE(mensajero, ''), COUNT(*)
+                FROM nuevas WHERE estado = 'DESPACHADA' GROUP BY 1, 2
+                ON CONFLICT (fecha, mensajero) DO UPDATE SET total = r.total + EXCLUDED.total;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM pendientes_diarios WHERE total <= 0;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def reconstruir_resumen_despachos(cur) -> int:
+    """
+    Regenera despachos_diarios desde cero. Bloquea las escrituras en
+    despachos hasta el commit, para no perder despachos concurrentes.
+    """
+    cur.execute("LOCK TABLE despachos IN SHARE MODE;")
+    cur.execute("DELETE FROM despachos_diarios;")
+    cur.execute("""
+        INSERT INTO despachos_diarios(fecha, mensajero, zona, total)
+        SELECT (fecha AT TIME ZONE %s)::date, COALESCE(mensajero, ''), COALESCE(zona, ''), COUNT(*)
+        FROM despachos
+        GROUP BY 1, 2, 3;
+    """, (ZONA_NEGOCIO,))
+    return cur.rowcount
+
+
+def reconstruir_resumen_pendientes(cur) -> int:
+    """Regenera pendientes_diarios desde el estado guardado en `guias`."""
+    cur.execute("LOCK TABLE guias IN SHARE MODE;")
+    cur.execute("DELETE FROM pendientes_diarios;")
+    cur.execute("INSERT INTO pendientes_diarios(fecha, mensajero, total)" + SQL_PENDIENTES_DIARIOS,
+                (ZONA_NEGOCIO,))
+    return cur.rowcount
+
+
+def reconstruir_estado_guias(cur) -> int:
+    """
+    Recalcula el estado de todas las guías cuyo valor guardado no coincide
+    con despachos/recepciones. Devuelve cuántas cambiaron.
+    """
+    cur.execute("LOCK TABLE despachos, recepciones IN SHARE MODE;")
+    cur.execute(f"""
+        UPDATE guias g
+        SET {SET_ESTADO}
+        FROM ({SQL_ESTADO_DERIVADO}) e
+        WHERE g.numero_guia = e.numero_guia AND {ESTADO_DISTINTO};
+    """)
+    return cur.rowcount
+
+
+# nombre -> (SQL actual, función(cur) que regenera lo que depende de él).
+# Se crean antes de las migraciones (los triggers las necesitan; plpgsql no
+# valida las tablas al crear la función) y se regeneran después.
+REPETIBLES = {
+    'resumir_despachos': (_sql_resumir_despachos, reconstruir_resumen_despachos),
+    'resumir_pendientes': (_sql_resumir_pendientes, reconstruir_resumen_pendientes),
+}
+
+
+def _checksum(sql):
+    return hashlib.sha256(sql.encode()).hexdigest()[:16]
+
+
+# ---------- Chequeo al arrancar ----------
+
+def faltantes(cur):
+    """
+    Lo que falta aplicar en la base de `cur` (lista vacía = al día), con una
+    sola consulta. Sin las tablas de control, falta todo.
+    """
+    try:
+        cur.execute("""
+            SELECT (SELECT max(version) FROM schema_version),
+                   (SELECT json_object_agg(nombre, checksum) FROM schema_repetibles);
+        """)
+        version, checksums = cur.fetchone()
+    except psycopg2.Error as e:
+        if e.pgcode != errorcodes.UNDEFINED_TABLE:
+            raise
+        cur.connection.rollback()
+        version, checksums = None, None
+    version, checksums = version or 0, checksums or {}
+    falta = [f"{v:03d} {descripcion}" for v, descripcion, _ in MIGRACIONES if v > version]
+    falta += [f"repetible {nombre}" for nombre, (sql, _) in REPETIBLES.items()
+              if checksums.get(nombre) != _checksum(sql())]
+    return falta
+
+
+# ---------- Aplicación ----------
+
+def _ejecutar(cur, paso):
+    if callable(paso):
+        paso(cur)
+    else:
+        cur.execute(paso)
+
+
+def _en_transaccion(conn, pasos):
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL lock_timeout = %s;", (LOCK_TIMEOUT,))
+            for paso in pasos:
+                _ejecutar(cur, paso)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+
+def _aplicar(conn, version, descripcion, pasos):
+    """
+    Los pasos normales seguidos van en una transacción; los que van fuera de
+    transacción cortan el grupo. El registro en schema_version va en la última.
+    """
+    grupo = []
+    for paso in pasos:
+        if isinstance(paso, fuera_de_transaccion):
+            if grupo:
+                _en_transaccion(conn, grupo)
+                grupo = []
+            with conn.cursor() as cur:
+                _ejecutar(cur, paso.paso)
+        else:
+            grupo.append(paso)
+    grupo.append(lambda cur: cur.execute(
+        "INSERT INTO schema_version(version, descripcion) VALUES (%s, %s);", (version, descripcion)))
+    _en_transaccion(conn, grupo)
+
+
+def migrar(dsn, salida=logging.info) -> list:
+    """
+    Aplica en orden las migraciones que falten y las repetibles que cambiaron.
+    Devuelve lo aplicado. Usa su propia conexión (directa: el advisory lock y
+    los pasos en autocommit no pasan por un pooler en modo transacción).
+    """
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    aplicado = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s);", (LLAVE_MIGRACION,))
+            cur.execute(SQL_CONTROL)
+            cur.execute("SELECT version FROM schema_version;")
+            aplicadas = {r[0] for r in cur.fetchall()}
+            cur.execute("SELECT nombre, checksum FROM schema_repetibles;")
+            checksums = dict(cur.fetchall())
+
+        cambiadas = []
+        for nombre, (sql, _) in REPETIBLES.items():
+            texto = sql()
+            if checksums.get(nombre) != _checksum(texto):
+                _en_transaccion(conn, [texto])
+                cambiadas.append((nombre, texto))
+
+        for version, descripcion, pasos in MIGRACIONES:
+            if version in aplicadas:
+                continue
+            salida(f"Migración {version:03d}: {descripcion}")
+            _aplicar(conn, version, descripcion, pasos)
+            aplicado.append(f"{version:03d} {descripcion}")
+
+        # El checksum se guarda junto con la regeneración: si esta falla, la
+        # próxima corrida la repite
+        for nombre, texto in cambiadas:
+            salida(f"Repetible {nombre}: regenerando")
+            _en_transaccion(conn, [REPETIBLES[nombre][1], lambda cur, n=nombre, t=texto: cur.execute("""
+                INSERT INTO schema_repetibles(nombre, checksum) VALUES (%s, %s)
+                ON CONFLICT (nombre) DO UPDATE SET checksum = EXCLUDED.checksum, aplicada = now();
+            """, (n, _checksum(t)))])
+            aplicado.append(f"repetible {nombre}")
+    finally:
+        try:
+            conn.close()   # libera también el advisory lock
+        except Exception:
+            pass
+    return aplicado
+
+
+# ---------- Línea de comandos ----------
+
+def _dsn_entorno():
+    # Igual que app.py: la migración del deploy también va con sslmode=require
+    dsn = (normalize_db_url(os.getenv("DATABASE_URL_DIRECTA", ""))
+           or dsn_directo(normalize_db_url(os.getenv("DATABASE_URL", ""))))
+    if not dsn:
+        raise click.ClickException("DATABASE_URL no está definida.")
+    return dsn
+
+
+@click.group()
+def cli():
+    """Migraciones del esquema."""
+
+
+@cli.command("migrar")
+def migrar_cmd():
+    """Aplica las migraciones pendientes."""
+    aplicado = migrar(_dsn_entorno(), salida=click.echo)
+    click.echo(f"Esquema al día (versión {VERSION_ESQUEMA})" + ("" if aplicado else ", nada que aplicar"))
+
+
+@cli.command("estado")
+def estado_cmd():
+    """Muestra lo que falta aplicar; sale con 1 si falta algo."""
+    with psycopg2.connect(_dsn_entorno()) as conn:
+        with conn.cursor() as cur:
+            falta = faltantes(cur)
+    conn.close()
+    for f in falta:
+        click.echo(f"pendiente: {f}")
+    click.echo(f"versión del código: {VERSION_ESQUEMA}")
+    if falta:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    cli()
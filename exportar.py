@@ -0,0 +1,150 @@
+import csv
+import io
+import tempfile
+import uuid
+import zlib
+from datetime import date, datetime
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+# =========================
+#   Exportación en streaming
+# =========================
+#
+# Las filas se leen con un cursor con nombre (server-side) en lotes de
+# TAMANO_LOTE, así el proceso nunca tiene el resultado completo en memoria.
+# - xlsx: openpyxl en modo write_only (las filas van a disco a medida que
+#   llegan); el archivo terminado se envía por trozos.
+# - csv / csv.gz: cada lote se escribe y se envía de inmediato.
+
+TAMANO_LOTE = 2000
+TAMANO_TROZO = 64 * 1024
+
+FORMATOS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+}
+
+
+def formato_valido(valor) -> str:
+    valor = (valor or '').strip().lower()
+    return valor if valor in FORMATOS else 'xlsx'
+
+
+class Hoja:
+    """Una hoja del export: columnas, primeras filas (para anchos) y el resto."""
+
+    def __init__(self, nombre, columnas, filas, muestra=(), formato_fecha=None):
+        self.nombre = nombre
+        self.columnas = list(columnas)
+        self.filas = filas
+        self.muestra = list(muestra)
+        self.formato_fecha = formato_fecha
+
+
+def hoja_desde_consulta(conn, nombre, sql, params, formato_fecha=None, lote=TAMANO_LOTE) -> Hoja:
+    """
+    Abre un cursor con nombre sobre `sql`. Debe consumirse dentro de la misma
+    transacción de `conn` (los cursores con nombre viven en la transacción).
+    """
+    cur = conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}")
+    cur.itersize = lote
+    cur.execute(sql, params)
+    primero = cur.fetchmany(lote)
+    columnas = [d[0] for d in cur.description]
+
+    def filas():
+        try:
+            bloque = primero
+            while bloque:
+                yield from bloque
+                bloque = cur.fetchmany(lote)
+        finally:
+            cur.close()
+
+    return Hoja(nombre, columnas, filas(), muestra=primero[:200], formato_fecha=formato_fecha)
+
+
+def _excel(valor):
+    # Excel no admite zona horaria: se deja la hora local de la sesión.
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.replace(tzinfo=None)
+    return valor
+
+
+def escribir_xlsx(destino, hojas):
+    """
+    Escribe las hojas en `destino` (ruta o archivo) en modo write_only.
+    Anchos automáticos calculados con la muestra (primer lote) de cada hoja.
+    """
+    wb = Workbook(write_only=True)
+    for hoja in hojas:
+        ws = wb.create_sheet(hoja.nombre)
+        for idx, col in enumerate(hoja.columnas or [" "], start=1):
+            max_len = max([len(str(col))] + [len(str(f[idx - 1])) for f in hoja.muestra if idx <= len(f)])
+            ws.column_dimensions[get_column_letter(idx)].width = max(12, min(40, max_len + 2))
+        ws.append(hoja.columnas)
+
+        fmt = hoja.formato_fecha or "yyyy-mm-dd hh:mm:ss"
+        fechas = {i for i, c in enumerate(hoja.columnas) if "fecha" in c.lower()}
+        for fila in hoja.filas:
+            valores = [_excel(v) for v in fila]
+            for i in fechas:
+                if isinstance(valores[i], (datetime, date)):
+                    celda = WriteOnlyCell(ws, value=valores[i])
+                    celda.number_format = fmt
+                    valores[i] = celda
+            ws.append(valores)
+    wb.save(destino)
+
+
+def trozos_xlsx(hojas):
+    """Genera el .xlsx en un archivo temporal y lo entrega por trozos."""
+    with tempfile.TemporaryFile() as tmp:
+        escribir_xlsx(tmp, hojas)
+        tmp.seek(0)
+        while True:
+            trozo = tmp.read(TAMANO_TROZO)
+            if not trozo:
+                break
+            yield trozo
+
+
+def trozos_csv(hoja, comprimir=False, lote=TAMANO_LOTE):
+    """CSV (UTF-8 con BOM para Excel) por lotes; gzip incremental si comprimir."""
+    gz = zlib.compressobj(wbits=31) if comprimir else None
+    buf = io.StringIO()
+    w = csv.writer(buf)
+
+    def vaciar():
+        datos = buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+        return gz.compress(datos) if gz else datos
+
+    # El encabezado sale de inmediato, sin esperar el primer lote
+    buf.write('\ufeff')
+    w.writerow(hoja.columnas)
+    if not gz:
+        yield vaciar()
+    for n, fila in enumerate(hoja.filas, start=1):
+        w.writerow(fila)
+        if n % lote == 0:
+            datos = vaciar()
+            if datos:
+                yield datos
+    datos = buf.getvalue().encode('utf-8')
+    if gz:
+        datos = gz.compress(datos) + gz.flush()
+    if datos:
+        yield datos
+
+
+def trozos(formato, hojas):
+    """Trozos de bytes del export. CSV solo lleva la primera hoja."""
+    if formato == 'xlsx':
+        return trozos_xlsx(hojas)
+    return trozos_csv(hojas[0], comprimir=(formato == 'csv.gz'))
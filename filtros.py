@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+
+# =========================
+#   Filtros de listados
+# =========================
+#
+# Un solo lugar donde los parámetros de la URL (fi/ff, mensajero, cliente,
+# número de guía, tipo) se convierten en condiciones SQL que pueden usar
+# índices:
+# - Fechas: rango semiabierto sobre la columna tal cual,
+#     fecha >= inicio_del_dia(fi) AND fecha < inicio_del_dia(ff + 1)
+#   en lugar de DATE(fecha) >= fi, que obliga a recorrer la tabla.
+# - Igualdades sobre la columna sin funciones alrededor.
+# - Número de guía "contiene": ILIKE '%x%' sobre la columna, que con pg_trgm
+#   usa un índice GIN (sin pg_trgm sigue siendo correcto, pero secuencial).
+
+
+def _dia(valor):
+    """'YYYY-MM-DD' -> date, o None si viene vacío o no es una fecha."""
+    try:
+        return date.fromisoformat((valor or '').strip())
+    except ValueError:
+        return None
+
+
+def _dia_siguiente(dia):
+    """Día siguiente, o None para date.max (ese rango no tiene cota superior)."""
+    return dia + timedelta(days=1) if dia < date.max else None
+
+
+def _escapar_like(texto: str) -> str:
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class Filtros:
+    """
+    Acumula condiciones y parámetros. Los valores vacíos o inválidos no
+    agregan condición.
+
+        f = Filtros(ZONA_NEGOCIO)
+        f.igual('d.mensajero', args.get('mensajero'))
+        f.rango_fechas('d.fecha', args.get('fi'), args.get('ff'))
+        sql += f.sql
+        params += f.params
+    """
+
+    def __init__(self, zona=None):
+        # zona: zona horaria en la que se interpretan fi/ff para columnas
+        # TIMESTAMPTZ. None = la de la sesión de Postgres.
+        self.zona = zona
+        self.condiciones = []
+        self.params = []
+
+    @property
+    def sql(self) -> str:
+        return ''.join(f" AND {c}" for c in self.condiciones)
+
+    def igual(self, columna, valor, convertir=str):
+        if isinstance(valor, str):
+            valor = valor.strip()
+        if valor is None or valor == '':
+            return self
+        try:
+            valor = convertir(valor)
+        except (TypeError, ValueError):
+            return self
+        self.condiciones.append(f"{columna} = %s")
+        self.params.append(valor)
+        return self
+
+    def contiene(self, columna, valor):
+        valor = (valor or '').strip()
+        if valor:
+            self.condiciones.append(f"{columna} ILIKE %s")
+            self.params.append(f"%{_escapar_like(valor)}%")
+        return self
+
+    def _inicio(self, dia):
+        if self.zona:
+            self.params += [dia, self.zona]
+            return "(%s::timestamp AT TIME ZONE %s)"
+        self.params.append(dia)
+        return "%s::date"
+
+    def rango_fechas(self, columna, fi, ff):
+        """Días [fi, ff] completos sobre una columna TIMESTAMPTZ."""
+        fi, ff = _dia(fi), _dia(ff)
+        hasta = ff and _dia_siguiente(ff)
+        if fi:
+            self.condiciones.append(f"{columna} >= {self._inicio(fi)}")
+        if hasta:
+            self.condiciones.append(f"{columna} < {self._inicio(hasta)}")
+        return self
+
+    def rango_dias(self, columna, fi, ff):
+        """Días [fi, ff] sobre una columna DATE."""
+        fi, ff = _dia(fi), _dia(ff)
+        hasta = ff and _dia_siguiente(ff)
+        if fi:
+            self.condiciones.append(f"{columna} >= %s")
+            self.params.append(fi)
+        if hasta:
+            self.condiciones.append(f"{columna} < %s")
+            self.params.append(hasta)
+        return self
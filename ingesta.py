@@ -0,0 +1,171 @@
+import csv
+import math
+from io import StringIO
+
+from openpyxl import load_workbook
+
+# =========================
+#   Ingesta masiva de guías
+# =========================
+#
+# La base se copia a una tabla temporal con COPY y se fusiona en `guias`
+# con un solo INSERT ... ON CONFLICT, en vez de un SELECT + INSERT por fila.
+
+COLUMNAS_GUIAS = ['remitente', 'numero_guia', 'destinatario', 'direccion', 'ciudad']
+
+TAMANO_LOTE = 5000
+
+
+def _a_texto(valor):
+    """
+    Normaliza una celda a texto para COPY:
+    - None / NaN -> None (NULL)
+    - 7000129785.0 -> '7000129785' (Excel lee los números como float)
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, float):
+        if math.isnan(valor):
+            return None
+        if valor.is_integer():
+            return str(int(valor))
+    texto = str(valor).strip()
+    return texto or None
+
+
+def normalizar_fila(fila) -> tuple:
+    """Convierte una secuencia en el orden de COLUMNAS_GUIAS a una tupla de textos."""
+    return tuple(_a_texto(v) for v in fila)
+
+
+class ColumnasFaltantes(ValueError):
+    def __init__(self, faltantes):
+        super().__init__("Faltan columnas: " + ", ".join(faltantes))
+        self.faltantes = faltantes
+
+
+def _indices_columnas(encabezado) -> list:
+    nombres = [str(c).strip().lower() if c is not None else '' for c in encabezado]
+    faltantes = [c for c in COLUMNAS_GUIAS if c not in nombres]
+    if faltantes:
+        raise ColumnasFaltantes(faltantes)
+    return [nombres.index(c) for c in COLUMNAS_GUIAS]
+
+
+def _agrupar(filas, indices, tamano):
+    lote = []
+    for fila in filas:
+        if fila is None or not any(v not in (None, '') for v in fila):
+            continue  # fila vacía
+        lote.append(normalizar_fila(fila[i] if i < len(fila) else None for i in indices))
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _lotes_xlsx(ruta, tamano):
+    wb = load_workbook(ruta, read_only=True, data_only=True)
+    filas = wb.worksheets[0].iter_rows(values_only=True)
+    try:
+        indices = _indices_columnas(next(filas, ()))
+    except Exception:
+        wb.close()
+        raise
+
+    def gen():
+        try:
+            yield from _agrupar(filas, indices, tamano)
+        finally:
+            wb.close()
+    return gen()
+
+
+def _lotes_csv(ruta, tamano):
+    f = open(ruta, 'r', encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        muestra = f.read(4096)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        filas = csv.reader(f, dialecto)
+        indices = _indices_columnas(next(filas, []))
+    except Exception:
+        f.close()
+        raise
+
+    def gen():
+        try:
+            yield from _agrupar(filas, indices, tamano)
+        finally:
+            f.close()
+    return gen()
+
+
+def leer_lotes(ruta, tamano=TAMANO_LOTE):
+    """
+    Lee la base (.xlsx o .csv) en streaming y devuelve un generador de lotes
+    de `tamano` tuplas, sin cargar el archivo completo en memoria.
+    El encabezado se valida al llamar (lanza ColumnasFaltantes).
+    """
+    if ruta.lower().endswith('.csv'):
+        return _lotes_csv(ruta, tamano)
+    return _lotes_xlsx(ruta, tamano)
+
+
+def _copiar_lote(cur, lote):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(lote)
+    buffer.seek(0)
+    cur.copy_expert(
+        "COPY guias_staging (" + ", ".join(COLUMNAS_GUIAS) + ") FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+
+def ingestar_guias(cur, lotes) -> dict:
+    """
+    Carga los lotes en una tabla temporal y los fusiona en `guias`.
+    Debe ejecutarse dentro de una transacción (la tabla se borra al hacer commit).
+
+    Devuelve {'total', 'insertadas', 'duplicadas', 'omitidas'}:
+    - duplicadas: ya existían en `guias` o venían repetidas en el archivo
+    - omitidas: filas sin numero_guia
+    """
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS guias_staging (
+            remitente    TEXT,
+            numero_guia  TEXT,
+            destinatario TEXT,
+            direccion    TEXT,
+            ciudad       TEXT
+        ) ON COMMIT DROP;
+    """)
+
+    total, omitidas = 0, 0
+    idx_numero = COLUMNAS_GUIAS.index('numero_guia')
+    for lote in lotes:
+        validas = [f for f in lote if f[idx_numero]]
+        total += len(lote)
+        omitidas += len(lote) - len(validas)
+        if validas:
+            _copiar_lote(cur, validas)
+
+    cur.execute("""
+        INSERT INTO guias(remitente, numero_guia, destinatario, direccion, ciudad)
+        SELECT remitente, numero_guia, destinatario, direccion, ciudad
+        FROM guias_staging
+        ON CONFLICT (numero_guia) DO NOTHING;
+    """)
+    insertadas = cur.rowcount
+
+    return {
+        'total': total,
+        'insertadas': insertadas,
+        'duplicadas': total - omitidas - insertadas,
+        'omitidas': omitidas,
+    }
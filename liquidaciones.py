@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+# =========================
+#   Liquidación por período
+# =========================
+#
+# Todos los mensajeros de un período en una sola consulta: suma de
+# despachos_diarios (conteo por día / mensajero / zona) por la tarifa de la
+# zona del despacho (o la zona actual del mensajero si el despacho no la
+# tiene). Un período cerrado (fecha_fin antes de hoy) se guarda en
+# `liquidaciones` la primera vez y desde ahí se lee tal cual, con la tarifa
+# vigente al cerrarlo.
+
+COLUMNAS = ['mensajero', 'zona', 'cantidad_guias', 'tarifa', 'total_pagar']
+
+_SQL_CALCULO = """
+    SELECT dd.mensajero,
+           COALESCE(z.nombre, '')          AS zona,
+           SUM(dd.total)::int              AS cantidad_guias,
+           COALESCE(z.tarifa, 0)           AS tarifa,
+           SUM(dd.total) * COALESCE(z.tarifa, 0) AS total_pagar
+    FROM despachos_diarios dd
+    LEFT JOIN mensajeros m ON m.nombre = dd.mensajero
+    LEFT JOIN zonas z      ON z.nombre = COALESCE(NULLIF(dd.zona, ''), m.zona)
+    WHERE dd.fecha >= %(fi)s AND dd.fecha < %(hasta)s
+    GROUP BY dd.mensajero, z.nombre, z.tarifa
+"""
+
+
+def _filas(cur) -> list:
+    columnas = [c[0] for c in cur.description]
+    return [dict(zip(columnas, fila)) for fila in cur.fetchall()]
+
+
+def _sin_creada(filas):
+    """Separa la fecha de la instantánea (igual en todas las filas)."""
+    creada = filas[0]['creada'] if filas else None
+    for f in filas:
+        del f['creada']
+    return filas, creada
+
+
+def liquidar(cur, fi, ff, zona_negocio, recalcular=False):
+    """
+    Liquidación de todos los mensajeros entre los días fi y ff (date, inclusive).
+
+    Devuelve (filas, creada): filas son dicts con COLUMNAS ordenados por
+    mensajero; creada es la fecha de la instantánea guardada o None si el
+    período sigue abierto y se calculó en vivo.
+    recalcular: descarta la instantánea del período y la vuelve a generar.
+    """
+    params = {'fi': fi, 'ff': ff, 'hasta': ff + timedelta(days=1)}
+    cur.execute("SELECT %s < (now() AT TIME ZONE %s)::date;", (ff, zona_negocio))
+    cerrado = cur.fetchone()[0]
+
+    if not cerrado:
+        cur.execute(_SQL_CALCULO + " ORDER BY dd.mensajero, zona;", params)
+        return _filas(cur), None
+
+    if recalcular:
+        cur.execute("DELETE FROM liquidaciones WHERE fecha_inicio = %(fi)s AND fecha_fin = %(ff)s;", params)
+    else:
+        cur.execute("""
+            SELECT mensajero, zona, cantidad_guias, tarifa, total_pagar, creada
+            FROM liquidaciones
+            WHERE fecha_inicio = %(fi)s AND fecha_fin = %(ff)s
+            ORDER BY mensajero, zona;
+        """, params)
+        filas = _filas(cur)
+        if filas:
+            return _sin_creada(filas)
+
+    cur.execute(f"""
+        INSERT INTO liquidaciones(fecha_inicio, fecha_fin, mensajero, zona, cantidad_guias, tarifa, total_pagar)
+        SELECT %(fi)s, %(ff)s, c.* FROM ({_SQL_CALCULO}) c
+        ON CONFLICT (fecha_inicio, fecha_fin, mensajero, zona) DO UPDATE
+        SET cantidad_guias = EXCLUDED.cantidad_guias, tarifa = EXCLUDED.tarifa,
+            total_pagar = EXCLUDED.total_pagar, creada = now()
+        RETURNING mensajero, zona, cantidad_guias, tarifa, total_pagar, creada;
+    """, params)
+    return _sin_creada(sorted(_filas(cur), key=lambda f: (f['mensajero'], f['zona'])))
@@ -0,0 +1,200 @@
+import uuid
+
+# =========================
+#   Operaciones por lote
+# =========================
+#
+# Validan una lista completa de guías con una sola consulta sobre
+# unnest(%s::text[]) y escriben con un solo INSERT ... ON CONFLICT,
+# en vez de 3-4 consultas por guía.
+
+# Resultados por guía
+OK = 'OK'
+FALTANTE = 'FALTANTE'
+RECEPCIONADA = 'RECEPCIONADA'
+DESPACHADA = 'DESPACHADA'
+SIN_DESPACHO = 'SIN_DESPACHO'
+
+TAMANO_LOTE_CONSULTA = 2000
+
+
+def unicos(numeros) -> list:
+    """Quita vacíos y duplicados conservando el orden."""
+    vistos = set()
+    salida = []
+    for n in numeros:
+        n = (n or '').strip()
+        if n and n not in vistos:
+            vistos.add(n)
+            salida.append(n)
+    return salida
+
+
+def _estado_lote(cur, numeros) -> list:
+    """
+    Una sola consulta para toda la lista. Devuelve, en el orden de entrada,
+    dicts con numero_guia, existe, despachada, mensajero, recepcionada, tipo.
+    """
+    cur.execute("""
+        SELECT u.numero_guia,
+               g.numero_guia IS NOT NULL AS existe,
+               d.numero_guia IS NOT NULL AS despachada,
+               d.mensajero,
+               r.numero_guia IS NOT NULL AS recepcionada,
+               r.tipo
+        FROM unnest(%s::text[]) WITH ORDINALITY AS u(numero_guia, ord)
+        LEFT JOIN guias g       ON g.numero_guia = u.numero_guia
+        LEFT JOIN despachos d   ON d.numero_guia = u.numero_guia
+        LEFT JOIN recepciones r ON r.numero_guia = u.numero_guia
+        ORDER BY u.ord;
+    """, (numeros,))
+    columnas = [c[0] for c in cur.description]
+    return [dict(zip(columnas, fila)) for fila in cur.fetchall()]
+
+
+def despachar_lote(cur, numeros, mensajero, zona, fecha) -> list:
+    """
+    Despacha las guías a `mensajero` en una sola transacción.
+
+    Devuelve una lista de dicts en el orden de entrada:
+      {'numero_guia', 'resultado', 'detalle'}
+    donde resultado es OK, FALTANTE, RECEPCIONADA (detalle = tipo) o
+    DESPACHADA (detalle = mensajero que ya la tiene).
+    """
+    numeros = unicos(numeros)
+    if not numeros:
+        return []
+
+    resultados = []
+    for e in _estado_lote(cur, numeros):
+        numero = e['numero_guia']
+        if not e['existe']:
+            resultados.append({'numero_guia': numero, 'resultado': FALTANTE, 'detalle': ''})
+        elif e['recepcionada']:
+            resultados.append({'numero_guia': numero, 'resultado': RECEPCIONADA, 'detalle': e['tipo']})
+        elif e['despachada']:
+            resultados.append({'numero_guia': numero, 'resultado': DESPACHADA, 'detalle': e['mensajero']})
+        else:
+            resultados.append({'numero_guia': numero, 'resultado': OK, 'detalle': mensajero})
+
+    validas = [r['numero_guia'] for r in resultados if r['resultado'] == OK]
+    if validas:
+        # ON CONFLICT cubre a otro operador despachando la misma guía entre
+        # la validación y el INSERT.
+        cur.execute("""
+            INSERT INTO despachos(numero_guia, mensajero, zona, fecha)
+            SELECT numero_guia, %s, %s, %s
+            FROM unnest(%s::text[]) AS u(numero_guia)
+            ON CONFLICT (numero_guia) DO NOTHING
+            RETURNING numero_guia;
+        """, (mensajero, zona, fecha, validas))
+        insertadas = {row[0] for row in cur.fetchall()}
+        perdidas = [n for n in validas if n not in insertadas]
+        if perdidas:
+            cur.execute("SELECT numero_guia, mensajero FROM despachos WHERE numero_guia = ANY(%s);", (perdidas,))
+            ganadores = dict(cur.fetchall())
+            for r in resultados:
+                if r['numero_guia'] in ganadores:
+                    r['resultado'] = DESPACHADA
+                    r['detalle'] = ganadores[r['numero_guia']]
+
+    return resultados
+
+
+def recepcionar_lote(cur, items, tipo, fecha, motivo_defecto='') -> list:
+    """
+    Registra la recepción (ENTREGADA o DEVUELTA) de un lote de guías.
+
+    `items` es una lista de (numero_guia, motivo); el motivo solo se guarda
+    en DEVUELTA y, si viene vacío, se usa `motivo_defecto`.
+
+    Devuelve una lista de dicts en el orden de entrada:
+      {'numero_guia', 'resultado', 'detalle'}
+    donde resultado es OK (detalle = tipo), FALTANTE, SIN_DESPACHO o
+    RECEPCIONADA (detalle = tipo ya registrado).
+    """
+    motivos = {}
+    for numero, motivo in items:
+        numero = (numero or '').strip()
+        if numero and numero not in motivos:
+            motivos[numero] = (motivo or '').strip()
+    numeros = list(motivos)
+    if not numeros:
+        return []
+
+    resultados = []
+    for e in _estado_lote(cur, numeros):
+        numero = e['numero_guia']
+        if not e['existe']:
+            resultados.append({'numero_guia': numero, 'resultado': FALTANTE, 'detalle': ''})
+        elif not e['despachada']:
+            resultados.append({'numero_guia': numero, 'resultado': SIN_DESPACHO, 'detalle': ''})
+        elif e['recepcionada']:
+            resultados.append({'numero_guia': numero, 'resultado': RECEPCIONADA, 'detalle': e['tipo']})
+        else:
+            resultados.append({'numero_guia': numero, 'resultado': OK, 'detalle': tipo})
+
+    validas = [r['numero_guia'] for r in resultados if r['resultado'] == OK]
+    if validas:
+        if tipo == 'DEVUELTA':
+            motivos_validas = [motivos[n] or motivo_defecto for n in validas]
+        else:
+            motivos_validas = [''] * len(validas)
+        cur.execute("""
+            INSERT INTO recepciones(numero_guia, tipo, motivo, fecha)
+            SELECT u.numero_guia, %s, u.motivo, %s
+            FROM unnest(%s::text[], %s::text[]) AS u(numero_guia, motivo)
+            ON CONFLICT (numero_guia) DO NOTHING
+            RETURNING numero_guia;
+        """, (tipo, fecha, validas, motivos_validas))
+        insertadas = {row[0] for row in cur.fetchall()}
+        perdidas = [n for n in validas if n not in insertadas]
+        if perdidas:
+            cur.execute("SELECT numero_guia, tipo FROM recepciones WHERE numero_guia = ANY(%s);", (perdidas,))
+            ganadores = dict(cur.fetchall())
+            for r in resultados:
+                if r['numero_guia'] in ganadores:
+                    r['resultado'] = RECEPCIONADA
+                    r['detalle'] = ganadores[r['numero_guia']]
+
+    return resultados
+
+
+def consultar_estados(conn, numeros, lote=TAMANO_LOTE_CONSULTA):
+    """
+    Estado actual de cada guía de `numeros` con una sola consulta, leída con
+    un cursor con nombre para no tener decenas de miles de filas en memoria.
+
+    Generador de dicts en el orden de entrada:
+      {'numero_guia', 'estado', 'motivo', 'mensajero', 'zona', 'fecha'}
+    estado: FALTANTE, EN VERIFICACION (sin despacho), DESPACHADA o el tipo de
+    recepción (ENTREGADA / DEVUELTA). fecha: la de la recepción o la del despacho.
+    Debe consumirse dentro de la transacción de `conn`.
+    """
+    cur = conn.cursor(name=f"estados_{uuid.uuid4().hex[:12]}")
+    cur.itersize = lote
+    # El estado vive en la fila de `guias` (lo mantienen triggers): una
+    # búsqueda por clave primaria por guía
+    cur.execute("""
+        SELECT u.numero_guia,
+               CASE WHEN g.numero_guia IS NULL THEN %s
+                    ELSE g.estado END                          AS estado,
+               COALESCE(g.motivo, '')                          AS motivo,
+               COALESCE(g.mensajero, '')                       AS mensajero,
+               COALESCE(g.zona, '')                            AS zona,
+               COALESCE(g.fecha_recepcion, g.fecha_despacho)   AS fecha
+        FROM unnest(%s::text[]) WITH ORDINALITY AS u(numero_guia, ord)
+        LEFT JOIN guias g ON g.numero_guia = u.numero_guia
+        ORDER BY u.ord;
+    """, (FALTANTE, list(numeros)))
+    try:
+        columnas = None
+        while True:
+            bloque = cur.fetchmany(lote)
+            if not bloque:
+                break
+            columnas = columnas or [c[0] for c in cur.description]
+            for fila in bloque:
+                yield dict(zip(columnas, fila))
+    finally:
+        cur.close()
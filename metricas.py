@@ -0,0 +1,277 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+
+from psycopg2 import extensions
+
+# =========================
+#   Métricas por petición
+# =========================
+#
+# Por cada petición se mide el tiempo total, el tiempo en la base, cuántas
+# consultas hizo, cuántas filas devolvieron y cuánto esperó una conexión del
+# pool. Las consultas se cuentan en el cursor (ConexionMedida), así entran
+# también las que no pasan por db_exec / db_fetch*.
+#
+# Los totales por ruta se exponen en formato de texto de Prometheus
+# (Registro.texto(), ruta /metrics). Son por proceso: con varios workers cada
+# uno tiene los suyos.
+#
+# Detector de N+1: una petición con más de `max_consultas` consultas se anota
+# en el log con las sentencias más repetidas y suma en mensajeria_n_mas_1_total.
+#
+# observar_consultas(funcion): además, cada consulta (dentro o fuera de una
+# petición) se pasa a funcion(cur, sql, params, segundos); la usa el registro
+# de consultas lentas. En un cursor con nombre el tiempo es el acumulado de
+# sus fetch y se informa hasta que la función devuelva True.
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Sentencias distintas que se guardan por petición para el detector
+MAX_SENTENCIAS = 200
+
+_actual = contextvars.ContextVar('medicion', default=None)
+_observador = None
+
+
+class Medicion:
+    __slots__ = ('inicio', 'db', 'consultas', 'filas', 'espera_pool', 'estado', 'sentencias')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.db = 0.0
+        self.consultas = 0
+        self.filas = 0
+        self.espera_pool = 0.0
+        self.estado = None
+        self.sentencias = Counter()
+
+    def consulta(self, sql, segundos, filas):
+        self.db += segundos
+        self.consultas += 1
+        self.filas += max(filas, 0)
+        clave = sql if isinstance(sql, str) else repr(sql)
+        if clave in self.sentencias or len(self.sentencias) < MAX_SENTENCIAS:
+            self.sentencias[clave] += 1
+
+
+def actual():
+    """Medición de la petición en curso, o None (hilos de trabajos, CLI)."""
+    return _actual.get()
+
+
+def observar_consultas(funcion):
+    global _observador
+    _observador = funcion
+
+
+def espera_pool(segundos):
+    m = _actual.get()
+    if m is not None:
+        m.espera_pool += segundos
+
+
+# ---------- Cursor / conexión medidos ----------
+
+class _CursorMedido:
+    def execute(self, query, vars=None):
+        m = _actual.get()
+        if self.name:
+            # [sql, params, segundos en fetch, ya informada]
+            self._pendiente = [query, vars, 0.0, False]
+        if m is None and _observador is None:
+            return super().execute(query, vars)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            segundos = time.perf_counter() - t0
+            # En un cursor con nombre las filas llegan al hacer fetch
+            filas = self.rowcount if self.description is not None and not self.name else 0
+            if m is not None:
+                m.consulta(query, segundos, filas)
+            if _observador is not None and not self.name:
+                _observador(self, query, vars, segundos)
+
+    def executemany(self, query, vars_list):
+        m = _actual.get()
+        if m is None:
+            return super().executemany(query, vars_list)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            m.consulta(query, time.perf_counter() - t0, 0)
+
+    def copy_expert(self, sql, file, size=8192):
+        m = _actual.get()
+        if m is None:
+            return super().copy_expert(sql, file, size)
+        t0 = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            m.consulta(sql, time.perf_counter() - t0, 0)
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        filas = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._contar_fetch(filas, time.perf_counter() - t0)
+        return filas
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        filas = super().fetchall()
+        self._contar_fetch(filas, time.perf_counter() - t0)
+        return filas
+
+    def _contar_fetch(self, filas, segundos):
+        if not self.name:
+            return
+        m = _actual.get()
+        if m is not None:
+            m.filas += len(filas)
+            m.db += segundos
+        pendiente = getattr(self, '_pendiente', None)
+        if pendiente and _observador is not None and not pendiente[3]:
+            pendiente[2] += segundos
+            pendiente[3] = bool(_observador(self, pendiente[0], pendiente[1], pendiente[2]))
+
+
+_cursores = {}
+_lock_cursores = threading.Lock()
+
+
+def _cursor_medido(base):
+    with _lock_cursores:
+        clase = _cursores.get(base)
+        if clase is None:
+            clase = type(f"{base.__name__}Medido", (_CursorMedido, base), {})
+            _cursores[base] = clase
+        return clase
+
+
+class ConexionMedida(extensions.connection):
+    """connection_factory de psycopg2: todos sus cursores se miden."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = _cursor_medido(base)
+        return super().cursor(*args, **kwargs)
+
+
+# ---------- Registro y exposición ----------
+
+def _etiquetas(**valores):
+    partes = []
+    for k, v in valores.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{k}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+
+class _Histograma:
+    __slots__ = ('buckets', 'conteos', 'suma', 'total')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.conteos[i] += 1
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre, **etiquetas):
+        for limite, n in zip(self.buckets, self.conteos):
+            yield f"{nombre}_bucket{_etiquetas(**etiquetas, le=limite)} {n}"
+        yield f"{nombre}_bucket{_etiquetas(**etiquetas, le='+Inf')} {self.total}"
+        yield f"{nombre}_sum{_etiquetas(**etiquetas)} {self.suma:.6f}"
+        yield f"{nombre}_count{_etiquetas(**etiquetas)} {self.total}"
+
+
+HISTOGRAMAS = (
+    ('mensajeria_peticion_segundos', 'Duración de la petición', BUCKETS_SEGUNDOS),
+    ('mensajeria_db_segundos', 'Tiempo en consultas por petición', BUCKETS_SEGUNDOS),
+    ('mensajeria_espera_pool_segundos', 'Espera por una conexión del pool por petición', BUCKETS_SEGUNDOS),
+    ('mensajeria_consultas', 'Consultas por petición', BUCKETS_CONSULTAS),
+)
+
+
+class Registro:
+    def __init__(self, max_consultas=50):
+        self.max_consultas = max_consultas
+        self._lock = threading.Lock()
+        self._peticiones = Counter()   # (ruta, metodo, estado) -> n
+        self._filas = Counter()        # ruta -> filas devueltas
+        self._n_mas_1 = Counter()      # ruta -> peticiones sobre max_consultas
+        self._histogramas = {}         # (nombre, ruta) -> _Histograma
+
+    def iniciar(self):
+        _actual.set(Medicion())
+
+    def fijar_estado(self, estado):
+        m = _actual.get()
+        if m is not None:
+            m.estado = estado
+
+    def terminar(self, ruta, metodo):
+        """Cierra la medición de la petición en curso y la suma a los totales."""
+        m = _actual.get()
+        if m is None:
+            return None
+        _actual.set(None)
+        duracion = time.perf_counter() - m.inicio
+        ruta = ruta or 'sin_ruta'
+        if m.consultas > self.max_consultas:
+            repetidas = "; ".join(f"{n}x {' '.join(sql.split())[:120]}"
+                                  for sql, n in m.sentencias.most_common(3))
+            logging.warning("Posible N+1 en %s: %d consultas (%.0f ms en la base). Más repetidas: %s",
+                            ruta, m.consultas, m.db * 1000, repetidas)
+        with self._lock:
+            self._peticiones[(ruta, metodo, m.estado or 500)] += 1
+            self._filas[ruta] += m.filas
+            if m.consultas > self.max_consultas:
+                self._n_mas_1[ruta] += 1
+            for (nombre, _, buckets), valor in zip(HISTOGRAMAS, (duracion, m.db, m.espera_pool, m.consultas)):
+                h = self._histogramas.get((nombre, ruta))
+                if h is None:
+                    h = self._histogramas[(nombre, ruta)] = _Histograma(buckets)
+                h.observar(valor)
+        return m
+
+    def texto(self, pool=None) -> str:
+        """Exposición en formato de texto de Prometheus (0.0.4)."""
+        lineas = []
+        with self._lock:
+            lineas += ["# HELP mensajeria_peticiones_total Peticiones atendidas",
+                       "# TYPE mensajeria_peticiones_total counter"]
+            lineas += [f"mensajeria_peticiones_total{_etiquetas(ruta=r, metodo=me, estado=e)} {n}"
+                       for (r, me, e), n in sorted(self._peticiones.items())]
+            lineas += ["# HELP mensajeria_filas_total Filas devueltas por las consultas",
+                       "# TYPE mensajeria_filas_total counter"]
+            lineas += [f"mensajeria_filas_total{_etiquetas(ruta=r)} {n}" for r, n in sorted(self._filas.items())]
+            lineas += [f"# HELP mensajeria_n_mas_1_total Peticiones con más de {self.max_consultas} consultas",
+                       "# TYPE mensajeria_n_mas_1_total counter"]
+            lineas += [f"mensajeria_n_mas_1_total{_etiquetas(ruta=r)} {n}" for r, n in sorted(self._n_mas_1.items())]
+            for nombre, ayuda, _ in HISTOGRAMAS:
+                lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram"]
+                for (n, ruta), h in sorted(self._histogramas.items()):
+                    if n == nombre:
+                        lineas += h.lineas(nombre, ruta=ruta)
+        # Sin pool (nadie pidió todavía una conexión) solo va el indicador en 0
+        lineas += ["# HELP mensajeria_pool_abierto 1 si el pool de conexiones está abierto",
+                   "# TYPE mensajeria_pool_abierto gauge", f"mensajeria_pool_abierto {int(pool is not None)}"]
+        if pool is not None:
+            stats = pool.estadisticas()
+            for clave in ('abiertas', 'en_uso', 'libres', 'esperando', 'maximo'):
+                lineas += [f"# TYPE mensajeria_pool_{clave} gauge", f"mensajeria_pool_{clave} {stats[clave]}"]
+            for clave in ('creadas', 'descartadas', 'recicladas', 'timeouts', 'rechazadas', 'entregadas'):
+                lineas += [f"# TYPE mensajeria_pool_{clave}_total counter", f"mensajeria_pool_{clave}_total {stats[clave]}"]
+        return "\n".join(lineas) + "\n"
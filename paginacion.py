@@ -0,0 +1,149 @@
+import base64
+import json
+import os
+from datetime import date, datetime
+
+# =========================
+#   Paginación por keyset
+# =========================
+#
+# En vez de OFFSET, cada página continúa desde la clave de la última (o la
+# primera) fila mostrada: WHERE (k1, k2) < (%s, %s) ORDER BY k1 DESC, k2 DESC.
+# Con un índice sobre las claves, cada página cuesta lo mismo sin importar
+# cuántas filas tenga la tabla.
+#
+# El cursor viaja en la URL como token opaco (JSON en base64url):
+#   {"d": "s" | "a", "k": [valores de las claves]}
+#   s = siguiente (después de la última fila), a = anterior (antes de la primera)
+# Lo puede escribir cualquiera: cada valor se valida contra el tipo de su
+# clave (datetime, date, int o str) y, si no corresponde, se vuelve a la
+# primera página en lugar de llegar a la consulta.
+#
+# El total exacto obligaría a un COUNT(*) sobre todo el filtro; si se pide,
+# se usa la estimación del planificador (EXPLAIN, no ejecuta la consulta).
+
+PAGINA_DEFECTO = int(os.getenv("PAGINA_TAMANO", "100"))
+PAGINA_MAX = int(os.getenv("PAGINA_MAX", "1000"))
+
+
+def tamano_pagina(valor) -> int:
+    """Normaliza el parámetro ?n= al rango [1, PAGINA_MAX]."""
+    try:
+        n = int(valor)
+    except (TypeError, ValueError):
+        return PAGINA_DEFECTO
+    return max(1, min(n, PAGINA_MAX))
+
+
+def _json_valor(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def codificar_cursor(direccion, valores) -> str:
+    crudo = json.dumps({"d": direccion, "k": [_json_valor(v) for v in valores]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+
+def _valor_clave(valor, tipo):
+    """Valor del token convertido al tipo de la clave; ValueError si no corresponde."""
+    if valor is None:
+        return None
+    if tipo in (datetime, date):
+        if not isinstance(valor, str):
+            raise ValueError(valor)
+        return tipo.fromisoformat(valor)
+    if tipo is int:
+        if isinstance(valor, bool) or not isinstance(valor, int) or not -2 ** 63 <= valor < 2 ** 63:
+            raise ValueError(valor)
+        return valor
+    if not isinstance(valor, str) or '\x00' in valor:
+        raise ValueError(valor)
+    return valor
+
+
+def decodificar_cursor(token, tipos):
+    """
+    Devuelve (direccion, valores) o None si el token falta o no es válido.
+    tipos: tipo de cada clave, en orden (datetime, date, int o str).
+    """
+    if not token:
+        return None
+    try:
+        crudo = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        datos = json.loads(crudo)
+        direccion, valores = datos["d"], datos["k"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    if direccion not in ('s', 'a') or not isinstance(valores, list) or len(valores) != len(tipos):
+        return None
+    try:
+        return direccion, [_valor_clave(v, t) for v, t in zip(valores, tipos)]
+    except ValueError:
+        return None
+
+
+def contar_aproximado(fetchone, sql, params) -> int:
+    """Filas que el planificador estima para `sql` (sin ejecutarla)."""
+    plan = fetchone("EXPLAIN (FORMAT JSON) " + sql, params)['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class Pagina:
+    def __init__(self, filas, tamano, cursor=None, siguiente=None, anterior=None, total_aprox=None):
+        self.filas = filas
+        self.tamano = tamano
+        self.cursor = cursor
+        self.siguiente = siguiente
+        self.anterior = anterior
+        self.total_aprox = total_aprox
+
+
+def paginar(fetchall, sql, params, claves, cursor=None, tamano=None, estimar=None) -> Pagina:
+    """
+    Ejecuta una página de `sql` ordenada DESC por `claves`.
+
+    fetchall(sql, params) -> lista de dicts (p. ej. db_fetchall_dict).
+    sql: SELECT con su WHERE ya armado y SIN ORDER BY / LIMIT.
+    claves: lista de (expresion_sql, columna_en_resultado, tipo) que define un
+            orden total (la última debe ser única, p. ej. numero_guia o id);
+            tipo es datetime, date, int o str y valida los cursores.
+    cursor: token recibido en ?cursor= (o None para la primera página).
+    estimar: fetchone(sql, params) para estimar el total con contar_aproximado;
+             None para no estimar (una sola consulta acotada).
+    """
+    tamano = tamano_pagina(tamano)
+    total_aprox = contar_aproximado(estimar, sql, params) if estimar else None
+    exprs = [e for e, _, _ in claves]
+    columnas = [c for _, c, _ in claves]
+    token = decodificar_cursor(cursor, [t for _, _, t in claves])
+    if token is None:
+        cursor = None
+    hacia_atras = token is not None and token[0] == 'a'
+
+    params = list(params)
+    if token:
+        op = '>' if hacia_atras else '<'
+        sql += f" AND ({', '.join(exprs)}) {op} ({', '.join(['%s'] * len(exprs))})"
+        params += token[1]
+    orden = 'ASC' if hacia_atras else 'DESC'
+    sql += " ORDER BY " + ", ".join(f"{e} {orden}" for e in exprs) + " LIMIT %s"
+    params.append(tamano + 1)
+
+    filas = list(fetchall(sql, params))
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+    if hacia_atras:
+        filas.reverse()
+
+    siguiente = anterior = None
+    if filas:
+        if hacia_atras or hay_mas:
+            siguiente = codificar_cursor('s', [filas[-1][c] for c in columnas])
+        if (token and not hacia_atras) or (hacia_atras and hay_mas):
+            anterior = codificar_cursor('a', [filas[0][c] for c in columnas])
+    return Pagina(filas, tamano, cursor=cursor, siguiente=siguiente, anterior=anterior,
+                  total_aprox=total_aprox)
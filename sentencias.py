@@ -0,0 +1,79 @@
+import logging
+import re
+import threading
+import weakref
+from urllib.parse import urlparse
+
+import psycopg2
+from psycopg2 import errorcodes, extensions
+
+# =========================
+#   Sentencias preparadas
+# =========================
+#
+# Las consultas puntuales más usadas (¿existe la guía?, su despacho, su
+# recepción) se registran una vez con un nombre. En cada conexión se hace
+# PREPARE la primera vez que se usan y después solo EXECUTE: Postgres no
+# vuelve a analizar ni planear la consulta en cada petición.
+#
+# PgBouncer en modo transacción (el pooler de Neon) reparte las transacciones
+# entre varias conexiones del servidor, así que un PREPARE hecho en una puede
+# no existir en la siguiente. Con esa URL (o PG_PREPARAR=0) se ejecuta la
+# consulta normal. Si aun así falla un EXECUTE por eso, se desactiva la
+# preparación para todo el proceso y se repite la consulta sin preparar.
+
+# Errores que indican que el PREPARE no sobrevive entre transacciones
+_ERRORES_POOLER = {errorcodes.INVALID_SQL_STATEMENT_NAME, errorcodes.DUPLICATE_PREPARED_STATEMENT}
+
+
+def es_pooler(dsn: str) -> bool:
+    """URL de un PgBouncer: host del pooler de Neon o el puerto por defecto 6432."""
+    parsed = urlparse(dsn)
+    return bool(parsed.hostname and '-pooler' in parsed.hostname) or parsed.port == 6432
+
+
+class Sentencias:
+    def __init__(self, preparar=True):
+        self.preparar = preparar
+        self._sql = {}        # nombre -> (sql con %s, sql con $n, tipos)
+        self._preparadas = weakref.WeakKeyDictionary()   # conexión -> nombres ya preparados
+        self._lock = threading.Lock()
+
+    def registrar(self, nombre, sql, tipos=()):
+        """
+        sql usa %s como el resto de la app; tipos: tipo Postgres de cada
+        parámetro (p. ej. ('text',)) para que el plan no dependa del primer valor.
+        """
+        contador = iter(range(1, sql.count('%s') + 1))
+        numerada = re.sub(r'%s', lambda _: f"${next(contador)}", sql).rstrip().rstrip(';')
+        self._sql[nombre] = (sql, numerada, tuple(tipos))
+        return nombre
+
+    def ejecutar(self, cur, nombre, params=()):
+        """Ejecuta la sentencia `nombre` en `cur` (preparada si se puede)."""
+        sql, numerada, tipos = self._sql[nombre]
+        if not self.preparar:
+            cur.execute(sql, params)
+            return cur
+        conn = cur.connection
+        nueva_transaccion = conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+        try:
+            with self._lock:
+                preparadas = self._preparadas.setdefault(conn, set())
+            if nombre not in preparadas:
+                firma = f"({', '.join(tipos)})" if tipos else ""
+                cur.execute(f"PREPARE {nombre}{firma} AS {numerada};")
+                preparadas.add(nombre)
+            marcadores = ", ".join(["%s"] * len(params))
+            cur.execute(f"EXECUTE {nombre}({marcadores});" if params else f"EXECUTE {nombre};", params)
+        except psycopg2.Error as e:
+            if e.pgcode not in _ERRORES_POOLER:
+                raise
+            logging.warning("Sentencias preparadas desactivadas (%s): la conexión pasa por un pooler", e.pgcode)
+            self.preparar = False
+            if not nueva_transaccion:
+                raise
+            # Era la primera consulta de la transacción: se puede deshacer y repetir
+            conn.rollback()
+            cur.execute(sql, params)
+        return cur
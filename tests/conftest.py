@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+@pytest.fixture
+def dsn_pruebas():
+    """
+    Base de pruebas para los tests que tocan Postgres (TEST_DATABASE_URL).
+    Nunca se usa DATABASE_URL: los tests escriben y borran datos.
+    """
+    dsn = os.getenv("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("Defina TEST_DATABASE_URL (una base de pruebas) para correr este test")
+    return dsn
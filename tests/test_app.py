@@ -0,0 +1,112 @@
+import base64
+import importlib
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+
+@pytest.fixture(scope='module')
+def app_sin_base(tmp_path_factory):
+    """app.py importada contra una base que no existe: importar no la toca."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATABASE_URL', 'postgresql://nadie@127.0.0.1:9/ninguna?connect_timeout=1')
+        mp.setenv('CACHE_NOTIFY', '0')
+        mp.chdir(tmp_path_factory.mktemp('app'))   # data/ y logs van a un directorio temporal
+        modulo = importlib.import_module('app')
+        yield modulo
+
+
+def test_monitoreo_sin_inicializar(app_sin_base):
+    cliente = app_sin_base.app.test_client()
+    assert app_sin_base.pool is None
+
+    r = cliente.get('/health/pool')
+    assert r.status_code == 503
+    assert r.get_json()['ok'] is False
+
+    r = cliente.get('/metrics')
+    assert r.status_code == 200
+    assert "mensajeria_pool_abierto 0" in r.get_data(as_text=True)
+
+    # Ninguna de las dos intentó conectarse ni arrancar la app
+    assert app_sin_base.pool is None
+    assert not app_sin_base._inicializada
+
+
+def _basic(usuario, clave):
+    return {'Authorization': 'Basic ' + base64.b64encode(f"{usuario}:{clave}".encode()).decode()}
+
+
+@pytest.fixture
+def cliente(app_sin_base, monkeypatch):
+    """Cliente de una app que se da por arrancada, para rutas que no consultan la base."""
+    monkeypatch.setattr(app_sin_base, '_inicializada', True)
+    monkeypatch.setattr(app_sin_base, 'escucha', None)
+    monkeypatch.setattr(app_sin_base.cache, 'sincronizar', lambda forzar=False: None)
+    return app_sin_base.app.test_client()
+
+
+def test_admin_sin_clave_configurada_no_existe(app_sin_base, cliente, monkeypatch):
+    monkeypatch.setattr(app_sin_base, 'ADMIN_CLAVE', '')
+    assert cliente.get('/admin/consultas_lentas', headers=_basic('admin', '')).status_code == 404
+
+
+def test_admin_pide_usuario_y_clave(app_sin_base, cliente, monkeypatch):
+    monkeypatch.setattr(app_sin_base, 'ADMIN_CLAVE', 's3creta')
+
+    r = cliente.get('/admin/consultas_lentas')
+    assert r.status_code == 401
+    assert r.headers['WWW-Authenticate'].startswith('Basic')
+    assert cliente.get('/admin/consultas_lentas', headers=_basic('admin', 'otra')).status_code == 401
+    assert cliente.get('/admin/consultas_lentas', headers=_basic('otro', 's3creta')).status_code == 401
+
+    r = cliente.get('/admin/consultas_lentas', headers=_basic('admin', 's3creta'))
+    assert r.status_code == 200
+    assert 'Consultas lentas' in r.get_data(as_text=True)
+
+
+def test_init_solo_post_con_clave(app_sin_base, cliente, monkeypatch):
+    monkeypatch.setattr(app_sin_base, 'ADMIN_CLAVE', 's3creta')
+    assert cliente.get('/init').status_code == 405
+    assert cliente.post('/init').status_code == 401
+
+
+def _txt(texto):
+    return FileStorage(io.BytesIO(texto.encode('utf-8')), filename='devueltas.txt')
+
+
+def test_parse_recepciones_una_guia_por_linea(app_sin_base):
+    items, invalidas = app_sin_base._parse_txt_recepciones(
+        _txt("\ufeffG1,Dirección errada\nG2;Cerrado\n\nG3\tNo recibe\nG4\n"))
+    assert items == [('G1', 'Dirección errada'), ('G2', 'Cerrado'), ('G3', 'No recibe'), ('G4', '')]
+    assert invalidas == []
+
+
+def test_parse_recepciones_rechaza_lineas_con_varias_guias(app_sin_base):
+    items, invalidas = app_sin_base._parse_txt_recepciones(_txt("G1,ok\nG2 G3 G4\nG5 No estaba,x\n,sin guía\n"))
+    assert items == [('G1', 'ok')]
+    assert invalidas == [(2, 'G2 G3 G4'), (3, 'G5 No estaba,x'), (4, ',sin guía')]
+
+
+def test_lote_devuelta_con_lineas_invalidas_no_registra_nada(cliente):
+    r = cliente.post('/registrar_recepcion', data={
+        'estado': 'DEVUELTA', 'motivo': '',
+        'archivo_txt': (io.BytesIO(b"G1,ok\nG2 G3\n<b>G4</b> x\n"), 'devueltas.txt'),
+    }, follow_redirects=True)
+    cuerpo = r.get_data(as_text=True)
+    assert "no se registró ninguna" in cuerpo
+    assert "Línea 2: G2 G3" in cuerpo
+    assert "Línea 3: &lt;b&gt;G4&lt;/b&gt; x" in cuerpo
+
+
+@pytest.mark.parametrize('fi,ff', [('2024-05-01', '9999-12-31'), ('2024-05-02', '2024-05-01'), ('2024-05-01', 'x')])
+def test_periodo_invalido(app_sin_base, fi, ff):
+    assert app_sin_base._periodo({'fecha_inicio': fi, 'fecha_fin': ff}) is None
+
+
+def test_liquidacion_hasta_el_ultimo_dia_posible_se_rechaza(cliente):
+    r = cliente.post('/liquidacion', data={'fecha_inicio': '2024-05-01', 'fecha_fin': '9999-12-31'})
+    assert r.status_code == 302
+    with cliente.session_transaction() as sesion:
+        assert ('danger', 'Formato de fechas inválido') in sesion['_flashes']
@@ -0,0 +1,176 @@
+import threading
+import time
+import uuid
+
+import psycopg2
+
+import esquema
+from cache import CacheReferencias, EscuchaCambios, dsn_directo, normalize_db_url
+
+
+def _cache_con(datos, versiones):
+    """CacheReferencias sobre una tabla 'zonas' en memoria; cuenta las recargas."""
+    cargas = []
+
+    def cargar():
+        cargas.append(1)
+        return list(datos)
+
+    cache = CacheReferencias(lambda: dict(versiones), intervalo=0)
+    cache.registrar('zonas', cargar)
+    return cache, cargas
+
+
+def _agregar(nombre):
+    return lambda zs: zs + [nombre]
+
+
+# ---------- CacheReferencias.aplicar ----------
+
+def test_aplicar_siguiente_version_sin_recargar():
+    cache, cargas = _cache_con(['A'], {'zonas': 3})
+    assert cache.get('zonas') == ['A']
+    cache.aplicar('zonas', 4, _agregar('B'))
+    assert cache.get('zonas') == ['A', 'B']
+    assert len(cargas) == 1
+
+
+def test_aplicar_version_vieja_se_ignora():
+    cache, cargas = _cache_con(['A'], {'zonas': 3})
+    cache.get('zonas')
+    cache.aplicar('zonas', 3, _agregar('X'))
+    cache.aplicar('zonas', 2, _agregar('Y'))
+    assert cache.get('zonas') == ['A']
+    assert len(cargas) == 1
+
+
+def test_aplicar_duplicado_una_sola_vez():
+    cache, cargas = _cache_con(['A'], {'zonas': 3})
+    cache.get('zonas')
+    cache.aplicar('zonas', 4, _agregar('B'))
+    cache.aplicar('zonas', 4, _agregar('B'))
+    assert cache.get('zonas') == ['A', 'B']
+    assert len(cargas) == 1
+
+
+def test_aplicar_fuera_de_orden_recarga():
+    datos, versiones = ['A'], {'zonas': 3}
+    cache, cargas = _cache_con(datos, versiones)
+    cache.get('zonas')
+    # Llega la 5 antes que la 4: no se puede aplicar encima, se recarga
+    datos[:] = ['A', 'B', 'C']
+    versiones['zonas'] = 5
+    cache.aplicar('zonas', 5, _agregar('C'))
+    assert cache.get('zonas') == ['A', 'B', 'C']
+    assert len(cargas) == 2
+    # La 4 que llega tarde ya está incluida en la recarga
+    cache.aplicar('zonas', 4, _agregar('B'))
+    assert cache.get('zonas') == ['A', 'B', 'C']
+    assert len(cargas) == 2
+
+
+def test_aplicar_antes_de_cargar_no_inventa_datos():
+    cache, cargas = _cache_con(['A'], {'zonas': 7})
+    cache.aplicar('zonas', 1, _agregar('X'))
+    assert cache.get('zonas') == ['A']
+    assert len(cargas) == 1
+
+
+def test_sincronizar_vence_solo_si_cambio_la_version():
+    datos, versiones = ['A'], {'zonas': 1}
+    cache, cargas = _cache_con(datos, versiones)
+    cache.get('zonas')
+    cache.sincronizar(forzar=True)
+    cache.get('zonas')
+    assert len(cargas) == 1
+    versiones['zonas'] = 2
+    cache.sincronizar(forzar=True)
+    cache.get('zonas')
+    assert len(cargas) == 2
+
+
+# ---------- LISTEN / NOTIFY contra Postgres ----------
+
+def test_notify_de_otra_conexion_llega_al_cache(dsn_pruebas):
+    esquema.migrar(dsn_pruebas, salida=lambda *a: None)
+    lectura = psycopg2.connect(dsn_pruebas)
+    lectura.autocommit = True
+    escritura = psycopg2.connect(dsn_pruebas)
+    nombre = f"TEST-{uuid.uuid4().hex[:8]}"
+
+    def leer_versiones():
+        with lectura.cursor() as cur:
+            cur.execute("SELECT tabla, version FROM versiones;")
+            return dict(cur.fetchall())
+
+    def cargar():
+        cargas.append(1)
+        with lectura.cursor() as cur:
+            cur.execute("SELECT nombre FROM zonas;")
+            return [r[0] for r in cur.fetchall()]
+
+    cargas = []
+    cache = CacheReferencias(leer_versiones, intervalo=3600)
+    cache.registrar('zonas', cargar)
+    avisos = []
+    recibido = threading.Event()
+
+    def manejar(evento):
+        # Lo mismo que app._aplicar_aviso para una tabla de referencia
+        avisos.append(evento)
+        fila = evento['clave'] if evento['op'] != 'DELETE' else None
+        claves = {evento['clave'], evento['anterior']}
+        cache.aplicar('zonas', evento['version'],
+                      lambda zs: [z for z in zs if z not in claves] + ([fila] if fila else []))
+        if nombre in claves:
+            recibido.set()
+
+    escucha = EscuchaCambios(dsn_pruebas, esquema.CANAL_CAMBIOS, manejar, espera=0.2)
+    escucha.start()
+    try:
+        limite = time.monotonic() + 5
+        while not escucha.conectado and time.monotonic() < limite:
+            time.sleep(0.02)
+        assert escucha.conectado
+        assert nombre not in cache.get('zonas')
+
+        with escritura.cursor() as cur:
+            cur.execute("INSERT INTO zonas(nombre, tarifa) VALUES (%s, 1000);", (nombre,))
+        escritura.commit()
+
+        assert recibido.wait(5), "no llegó el NOTIFY"
+        evento = next(e for e in avisos if e['clave'] == nombre)
+        assert evento['tabla'] == 'zonas' and evento['op'] == 'INSERT'
+        # Llegó como delta: está en el cache sin recargar la tabla
+        assert nombre in cache.get('zonas')
+        assert len(cargas) == 1
+    finally:
+        escucha.detener()
+        with escritura.cursor() as cur:
+            cur.execute("DELETE FROM zonas WHERE nombre = %s;", (nombre,))
+        escritura.commit()
+        escritura.close()
+        lectura.close()
+        escucha.join(2)
+
+
+def test_normalize_db_url():
+    assert normalize_db_url('') == ''
+    assert normalize_db_url('postgresql://u@h/db?channel_binding=require') == (
+        'postgresql://u@h/db?sslmode=require&application_name=mensajeria_plataf')
+    assert 'sslmode=disable' in normalize_db_url('postgresql://u@h/db?sslmode=disable')
+
+
+def test_dsn_directo_quita_el_pooler():
+    assert dsn_directo('postgresql://u@ep-x-pooler.neon.tech/db') == 'postgresql://u@ep-x.neon.tech/db'
+    assert dsn_directo('postgresql://u@localhost/db') == 'postgresql://u@localhost/db'
+
+
+def test_dsn_de_la_linea_de_comandos_normalizado(monkeypatch):
+    monkeypatch.delenv('DATABASE_URL_DIRECTA', raising=False)
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://u@ep-x-pooler.neon.tech/db?channel_binding=require')
+    assert esquema._dsn_entorno() == (
+        'postgresql://u@ep-x.neon.tech/db?sslmode=require&application_name=mensajeria_plataf')
+    monkeypatch.setenv('DATABASE_URL_DIRECTA', 'postgresql://u@ep-x.neon.tech/db?channel_binding=require')
+    assert esquema._dsn_entorno() == (
+        'postgresql://u@ep-x.neon.tech/db?sslmode=require&application_name=mensajeria_plataf')
@@ -0,0 +1,86 @@
+import os
+import time
+
+import pytest
+
+from cache_export import TMP_ABANDONADO, CacheExport
+
+
+def test_clave_ignora_orden_vacios_y_paginacion():
+    versiones = {'despachos': 3, 'mensajeros': 1}
+    a = CacheExport.clave('export', [('mensajero', 'ANA'), ('fi', '2024-01-01'), ('ff', '')], 'csv', versiones)
+    b = CacheExport.clave('export', [('cursor', 'abc'), ('fi', '2024-01-01 '), ('n', '50'), ('mensajero', 'ANA'),
+                                     ('formato', 'csv'), ('total', '1')], 'csv', dict(reversed(versiones.items())))
+    assert a == b
+    assert len(a) == 32
+
+
+@pytest.mark.parametrize('cambio', [
+    {'endpoint': 'otro'},
+    {'args': [('mensajero', 'LUIS')]},
+    {'formato': 'xlsx'},
+    {'versiones': {'despachos': 4, 'mensajeros': 1}},
+])
+def test_clave_cambia_con_lo_que_cambia_el_contenido(cambio):
+    base = {'endpoint': 'export', 'args': [('mensajero', 'ANA')], 'formato': 'csv',
+            'versiones': {'despachos': 3, 'mensajeros': 1}}
+    assert CacheExport.clave(**base) != CacheExport.clave(**dict(base, **cambio))
+
+
+def test_guardar_y_buscar(tmp_path):
+    cache = CacheExport(str(tmp_path), 1024)
+    assert cache.buscar('k', 'csv') is None
+    assert list(cache.guardar('k', 'csv', iter([b'a,b\n', b'1,2\n']))) == [b'a,b\n', b'1,2\n']
+    ruta = cache.buscar('k', 'csv')
+    with open(ruta, 'rb') as f:
+        assert f.read() == b'a,b\n1,2\n'
+    assert os.listdir(tmp_path) == ['k.csv']
+
+
+def test_envio_cortado_no_deja_archivo(tmp_path):
+    cache = CacheExport(str(tmp_path), 1024)
+
+    def trozos():
+        yield b'a,b\n'
+        raise RuntimeError("se cayó la consulta")
+
+    with pytest.raises(RuntimeError):
+        list(cache.guardar('k', 'csv', trozos()))
+    assert cache.buscar('k', 'csv') is None
+    assert os.listdir(tmp_path) == []
+
+    # El cliente corta la descarga: el generador se cierra sin terminar
+    gen = cache.guardar('k', 'csv', iter([b'x' * 10, b'y' * 10]))
+    next(gen)
+    gen.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_recortar_borra_los_menos_usados(tmp_path):
+    cache = CacheExport(str(tmp_path), 1024)
+    for i, clave in enumerate(('vieja', 'media', 'nueva')):
+        list(cache.guardar(clave, 'csv', iter([b'x' * 10])))
+        os.utime(cache.buscar(clave, 'csv'), (1000 + i, 1000 + i))
+    cache.buscar('vieja', 'csv')  # un acierto la vuelve la más reciente
+    cache.max_bytes = 25
+    cache.recortar()
+    assert sorted(os.listdir(tmp_path)) == ['nueva.csv', 'vieja.csv']
+
+
+def test_recortar_limpia_tmp_abandonados(tmp_path):
+    cache = CacheExport(str(tmp_path), 1024)
+    viejo = tmp_path / 'k.csv.abc.tmp'
+    reciente = tmp_path / 'k.csv.def.tmp'
+    viejo.write_bytes(b'x')
+    reciente.write_bytes(b'x')
+    antes = time.time() - TMP_ABANDONADO - 10
+    os.utime(viejo, (antes, antes))
+    cache.recortar()
+    assert sorted(os.listdir(tmp_path)) == ['k.csv.def.tmp']
+
+
+def test_inactivo_con_tope_cero(tmp_path):
+    directorio = tmp_path / 'exports'
+    cache = CacheExport(str(directorio), 0)
+    assert not cache.activo
+    assert not directorio.exists()
@@ -0,0 +1,119 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from psycopg2 import extensions
+
+import conexiones
+from conexiones import PoolAgotado, PoolConexiones
+
+
+class ConexionFalsa:
+    def __init__(self):
+        self.closed = 0
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def conectar_lento(monkeypatch):
+    """psycopg2.connect falso que tarda en abrir, para que las aperturas se solapen."""
+    abiertas = []
+
+    def conectar(dsn, **kwargs):
+        time.sleep(0.01)
+        conn = ConexionFalsa()
+        abiertas.append(conn)
+        return conn
+
+    monkeypatch.setattr(conexiones.psycopg2, 'connect', conectar)
+    return abiertas
+
+
+@pytest.fixture
+def cambios_frecuentes():
+    # Cambio de hilo casi en cada instrucción: abre las ventanas de carrera
+    anterior = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(anterior)
+
+
+def test_nunca_entrega_mas_que_maximo(conectar_lento, cambios_frecuentes):
+    # edad_max=0: cada devolución recicla, así cada obtener abre una conexión nueva
+    pool = PoolConexiones('falso', minimo=0, maximo=3, espera=10, cola_max=100, edad_max=0)
+    lock = threading.Lock()
+    en_uso = [0]
+    picos = []
+
+    def trabajar():
+        for _ in range(5):
+            conn = pool.obtener()
+            with lock:
+                en_uso[0] += 1
+                abiertas = sum(1 for c in conectar_lento if not c.closed)
+                picos.append((en_uso[0], len(pool._en_uso), abiertas))
+            # Se retiene más de lo que tarda abrir: una apertura de más se ve
+            time.sleep(0.03)
+            with lock:
+                en_uso[0] -= 1
+            pool.devolver(conn)
+
+    hilos = [threading.Thread(target=trabajar) for _ in range(20)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert max(p[0] for p in picos) <= 3
+    assert max(p[1] for p in picos) <= 3
+    assert max(p[2] for p in picos) <= 3
+    stats = pool.estadisticas()
+    assert stats['entregadas'] == 100 and stats['recicladas'] == 100
+    assert stats['en_uso'] == 0 and stats['abiertas'] == 0
+
+
+def test_falla_al_abrir_libera_el_lugar(monkeypatch):
+    intentos = []
+
+    def conectar(dsn, **kwargs):
+        intentos.append(1)
+        if len(intentos) == 1:
+            raise conexiones.psycopg2.OperationalError("sin red")
+        return ConexionFalsa()
+
+    monkeypatch.setattr(conexiones.psycopg2, 'connect', conectar)
+    pool = PoolConexiones('falso', minimo=0, maximo=1, espera=0.5)
+    with pytest.raises(conexiones.psycopg2.OperationalError):
+        pool.obtener()
+    conn = pool.obtener()
+    assert pool.estadisticas()['en_uso'] == 1
+    pool.devolver(conn)
+
+
+def test_agotado_tras_la_espera(conectar_lento):
+    pool = PoolConexiones('falso', minimo=0, maximo=1, espera=0.05)
+    conn = pool.obtener()
+    with pytest.raises(PoolAgotado):
+        pool.obtener()
+    pool.devolver(conn)
+    assert pool.obtener() is conn
+    assert pool.estadisticas()['timeouts'] == 1
+
+
+def test_descarta_cerrada_sin_pasar_de_maximo(conectar_lento):
+    pool = PoolConexiones('falso', minimo=0, maximo=1, espera=1)
+    conn = pool.obtener()
+    pool.devolver(conn)
+    conn.closed = 1
+    nueva = pool.obtener()
+    assert nueva is not conn
+    stats = pool.estadisticas()
+    assert stats['descartadas'] == 1 and stats['abiertas'] == 1
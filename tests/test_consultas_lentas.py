@@ -0,0 +1,116 @@
+import json
+import os
+from datetime import date
+from logging.handlers import RotatingFileHandler
+
+import pytest
+
+from consultas_lentas import ConsultasLentas, explicable, resumir_params
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT * FROM guias WHERE numero_guia = %s",
+    "  with p AS (SELECT 1) SELECT * FROM p",
+    "select count(*) from despachos",
+])
+def test_explicable(sql):
+    assert explicable(sql)
+
+
+@pytest.mark.parametrize('sql', [
+    "UPDATE guias SET estado = 'x'",
+    "INSERT INTO zonas VALUES ('a', 1)",
+    "WITH b AS (DELETE FROM recepciones RETURNING *) SELECT * FROM b",
+    "SELECT * FROM guias FOR UPDATE",
+    "SELECT * FROM guias FOR SHARE",
+    "SELECT nextval('s')",
+    "SELECT pg_advisory_lock(1)",
+    "SELECT pg_notify('c', 'x')",
+    "SELECT reconstruir_resumen()",
+    "EXPLAIN SELECT 1",
+    "",
+])
+def test_no_explicable(sql):
+    assert not explicable(sql)
+
+
+def test_resumir_params_no_guarda_textos():
+    assert resumir_params(None) is None
+    assert resumir_params(('7000129785', 42, None, True, date(2024, 5, 1), ['a', 'b'], b'xy')) == (
+        "[<texto 10>, 42, None, True, datetime.date(2024, 5, 1), <lista 2>, <texto 2>]")
+    assert resumir_params({'guia': 'Calle 5 # 3-2', 'n': 3}) == "{'guia': <texto 13>, 'n': 3}"
+    assert len(resumir_params(['x'] * 1000)) == 1000
+
+
+class CursorFalso:
+    name = None
+
+
+def _registro(tmp_path):
+    ruta = str(tmp_path / 'logs' / 'lentas.log')
+    return ConsultasLentas('postgresql://no-se-usa', ruta, umbral=0.1, muestreo=0, origen=lambda: 'ver_despacho')
+
+
+def _cerrar(registro):
+    for h in list(registro._log.handlers):
+        if isinstance(h, RotatingFileHandler) and h.baseFilename == os.path.abspath(registro.ruta_log):
+            h.close()
+            registro._log.removeHandler(h)
+
+
+def test_observar_anota_solo_las_lentas(tmp_path):
+    registro = _registro(tmp_path)
+    try:
+        assert not registro.observar(CursorFalso(), "SELECT 1", None, 0.05)
+        assert registro.observar(CursorFalso(), "SELECT *\n  FROM guias WHERE numero_guia = %s",
+                                 ('7000129785',), 0.3)
+        entradas = list(registro.entradas())
+    finally:
+        _cerrar(registro)
+    assert len(entradas) == 1
+    e = entradas[0]
+    assert e['sql'] == "SELECT * FROM guias WHERE numero_guia = %s"
+    assert e['params'] == "[<texto 10>]"
+    assert e['origen'] == 'ver_despacho' and e['ms'] == 300.0
+    assert '7000129785' not in (tmp_path / 'logs' / 'lentas.log').read_text(encoding='utf-8')
+
+
+def _escribir_log(ruta, entradas):
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    ruta.write_text("".join(json.dumps(e) + "\n" for e in entradas), encoding='utf-8')
+
+
+def test_entradas_lee_solo_el_final_del_log_actual(tmp_path):
+    registro = _registro(tmp_path)
+    _cerrar(registro)
+    ruta = tmp_path / 'logs' / 'lentas.log'
+    _escribir_log(ruta, [{'sql': f"SELECT {i}", 'ms': 1} for i in range(100)])
+    (tmp_path / 'logs' / 'lentas.log.1').write_text(json.dumps({'sql': 'ROTADA', 'ms': 1}) + "\n")
+    linea = len(json.dumps({'sql': "SELECT 99", 'ms': 1})) + 1
+    leidas = [e['sql'] for e in registro.entradas(max_bytes=linea * 3 + 5)]
+    # La primera línea del tramo queda cortada y se descarta
+    assert leidas == ["SELECT 97", "SELECT 98", "SELECT 99"]
+    assert len(list(registro.entradas())) == 100
+
+
+def test_entradas_sin_log(tmp_path):
+    registro = _registro(tmp_path)
+    _cerrar(registro)
+    assert list(registro.entradas()) == []
+
+
+def test_peores_agrupa_por_sentencia(tmp_path):
+    registro = _registro(tmp_path)
+    _cerrar(registro)
+    _escribir_log(tmp_path / 'logs' / 'lentas.log', [
+        {'fecha': '2024-05-01T10:00:00', 'origen': 'a', 'sql': 'SELECT A', 'ms': 100, 'plan': 'Seq Scan'},
+        {'fecha': '2024-05-01T10:01:00', 'origen': 'b', 'sql': 'SELECT A', 'ms': 300, 'plan_error': 'timeout'},
+        {'fecha': '2024-05-01T10:02:00', 'origen': 'a', 'sql': 'SELECT B', 'ms': 350},
+    ])
+    a, b = registro.peores()
+    assert (a['sql'], a['veces'], a['total_ms'], a['max_ms'], a['promedio_ms']) == ('SELECT A', 2, 400, 300, 200)
+    assert a['origenes'] == 'a, b'
+    # Un error posterior no tapa el último plan conseguido
+    assert a['plan'] == 'Seq Scan' and a['plan_error'] is None
+    assert [f['sql'] for f in registro.peores(orden='max')] == ['SELECT B', 'SELECT A']
+    assert len(registro.peores(limite=1)) == 1
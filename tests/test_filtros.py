@@ -0,0 +1,58 @@
+from datetime import date
+
+from filtros import Filtros
+
+
+def test_sin_valores_no_agrega_condiciones():
+    f = (Filtros('America/Bogota')
+         .igual('mensajero', '  ')
+         .igual('cliente_id', None, convertir=int)
+         .contiene('numero_guia', '')
+         .rango_fechas('fecha', '', None)
+         .rango_dias('fecha', 'no-es-fecha', ''))
+    assert f.sql == ''
+    assert f.params == []
+
+
+def test_igual_recorta_y_convierte():
+    f = Filtros().igual('d.mensajero', ' ANA ').igual('r.cliente_id', '12', convertir=int)
+    assert f.sql == " AND d.mensajero = %s AND r.cliente_id = %s"
+    assert f.params == ['ANA', 12]
+
+
+def test_igual_con_valor_no_convertible_se_ignora():
+    f = Filtros().igual('r.cliente_id', 'abc', convertir=int)
+    assert f.sql == '' and f.params == []
+
+
+def test_contiene_escapa_comodines():
+    f = Filtros().contiene('numero_guia', r' 70_0%\ ')
+    assert f.sql == " AND numero_guia ILIKE %s"
+    assert f.params == [r'%70\_0\%\\%']
+
+
+def test_rango_fechas_semiabierto_en_la_zona():
+    f = Filtros('America/Bogota').rango_fechas('fecha', '2024-03-01', '2024-03-31')
+    assert f.sql == (" AND fecha >= (%s::timestamp AT TIME ZONE %s)"
+                     " AND fecha < (%s::timestamp AT TIME ZONE %s)")
+    assert f.params == [date(2024, 3, 1), 'America/Bogota', date(2024, 4, 1), 'America/Bogota']
+
+
+def test_rango_fechas_sin_zona_usa_la_de_la_sesion():
+    f = Filtros().rango_fechas('r.fecha', None, '2024-12-31')
+    assert f.sql == " AND r.fecha < %s::date"
+    assert f.params == [date(2025, 1, 1)]
+
+
+def test_rango_dias_sobre_columna_date():
+    f = Filtros('America/Bogota').rango_dias('dia', '2024-02-28', '2024-02-29')
+    assert f.sql == " AND dia >= %s AND dia < %s"
+    assert f.params == [date(2024, 2, 28), date(2024, 3, 1)]
+
+
+def test_ultimo_dia_posible_no_tiene_cota_superior():
+    f = Filtros('America/Bogota').rango_fechas('fecha', '2024-03-01', '9999-12-31')
+    assert f.sql == " AND fecha >= (%s::timestamp AT TIME ZONE %s)"
+    assert f.params == [date(2024, 3, 1), 'America/Bogota']
+    f = Filtros().rango_dias('dia', None, '9999-12-31')
+    assert f.sql == "" and f.params == []
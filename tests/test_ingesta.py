@@ -0,0 +1,79 @@
+import pytest
+from openpyxl import Workbook
+
+from ingesta import COLUMNAS_GUIAS, ColumnasFaltantes, _a_texto, leer_lotes, normalizar_fila
+
+
+@pytest.mark.parametrize('valor,esperado', [
+    (None, None),
+    (float('nan'), None),
+    (7000129785.0, '7000129785'),
+    (12.5, '12.5'),
+    (42, '42'),
+    ('  Cra 7 # 12-30 ', 'Cra 7 # 12-30'),
+    ('   ', None),
+    ('', None),
+])
+def test_a_texto(valor, esperado):
+    assert _a_texto(valor) == esperado
+
+
+def test_normalizar_fila():
+    assert normalizar_fila(['ACME', 7000129785.0, ' Ana ', None, '']) == ('ACME', '7000129785', 'Ana', None, None)
+
+
+def _csv(tmp_path, texto, nombre='base.csv'):
+    ruta = tmp_path / nombre
+    ruta.write_text(texto, encoding='utf-8')
+    return str(ruta)
+
+
+def test_csv_con_punto_y_coma_y_columnas_en_otro_orden(tmp_path):
+    ruta = _csv(tmp_path,
+                "\ufeffCiudad;NUMERO_GUIA;remitente;direccion;destinatario;extra\n"
+                "Bogotá;G1;ACME;Cra 7;Ana;x\n"
+                ";;;;;\n"
+                "Cali;G2;ACME;Cl 5;Luis;y\n")
+    lotes = list(leer_lotes(ruta))
+    assert lotes == [[('ACME', 'G1', 'Ana', 'Cra 7', 'Bogotá'),
+                      ('ACME', 'G2', 'Luis', 'Cl 5', 'Cali')]]
+
+
+def test_csv_filas_cortas_completan_con_null(tmp_path):
+    ruta = _csv(tmp_path, ",".join(COLUMNAS_GUIAS) + "\nACME,G1\n")
+    assert list(leer_lotes(ruta)) == [[('ACME', 'G1', None, None, None)]]
+
+
+def test_lotes_de_tamano_fijo(tmp_path):
+    filas = "".join(f"ACME,G{i},Ana,Cra 7,Bogotá\n" for i in range(7))
+    ruta = _csv(tmp_path, ",".join(COLUMNAS_GUIAS) + "\n" + filas)
+    lotes = list(leer_lotes(ruta, tamano=3))
+    assert [len(l) for l in lotes] == [3, 3, 1]
+    assert lotes[-1][0][1] == 'G6'
+
+
+def test_encabezado_incompleto_falla_al_llamar(tmp_path):
+    ruta = _csv(tmp_path, "remitente,numero_guia,ciudad\nACME,G1,Cali\n")
+    with pytest.raises(ColumnasFaltantes) as err:
+        leer_lotes(ruta)
+    assert err.value.faltantes == ['destinatario', 'direccion']
+
+
+def test_xlsx_con_numeros_como_float(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(COLUMNAS_GUIAS)
+    ws.append(['ACME', 7000129785.0, 'Ana', 'Cra 7', 'Bogotá'])
+    ws.append([None] * 5)
+    ws.append(['ACME', 'G2', None, 'Cl 5', 'Cali'])
+    ruta = str(tmp_path / 'base.xlsx')
+    wb.save(ruta)
+    assert list(leer_lotes(ruta)) == [[('ACME', '7000129785', 'Ana', 'Cra 7', 'Bogotá'),
+                                       ('ACME', 'G2', None, 'Cl 5', 'Cali')]]
+
+
+def test_xlsx_vacio(tmp_path):
+    ruta = str(tmp_path / 'vacia.xlsx')
+    Workbook().save(ruta)
+    with pytest.raises(ColumnasFaltantes):
+        leer_lotes(ruta)
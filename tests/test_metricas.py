@@ -0,0 +1,107 @@
+import logging
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import metricas
+from metricas import ConexionMedida, Registro, _etiquetas, _Histograma
+
+
+def test_etiquetas_escapa_comillas_barras_y_saltos():
+    assert _etiquetas(ruta='a"b', otra='c\\d\ne') == '{ruta="a\\"b",otra="c\\\\d\\ne"}'
+
+
+def test_histograma_acumulativo():
+    h = _Histograma((1, 5))
+    for v in (0.5, 3, 7):
+        h.observar(v)
+    assert list(h.lineas('x', ruta='r')) == [
+        'x_bucket{ruta="r",le="1"} 1',
+        'x_bucket{ruta="r",le="5"} 2',
+        'x_bucket{ruta="r",le="+Inf"} 3',
+        'x_sum{ruta="r"} 10.500000',
+        'x_count{ruta="r"} 3',
+    ]
+
+
+def _peticion(registro, ruta, consultas, estado=200, sql="SELECT 1"):
+    registro.iniciar()
+    m = metricas.actual()
+    for _ in range(consultas):
+        m.consulta(sql, 0.001, 2)
+    registro.fijar_estado(estado)
+    return registro.terminar(ruta, 'GET')
+
+
+def test_terminar_suma_a_los_totales():
+    registro = Registro()
+    _peticion(registro, 'despachos', 3)
+    _peticion(registro, 'despachos', 1, estado=404)
+    assert metricas.actual() is None
+    texto = registro.texto()
+    assert 'mensajeria_peticiones_total{ruta="despachos",metodo="GET",estado="200"} 1' in texto
+    assert 'mensajeria_peticiones_total{ruta="despachos",metodo="GET",estado="404"} 1' in texto
+    assert 'mensajeria_filas_total{ruta="despachos"} 8' in texto
+    assert 'mensajeria_consultas_count{ruta="despachos"} 2' in texto
+    assert 'mensajeria_consultas_bucket{ruta="despachos",le="2"} 1' in texto
+    assert texto.endswith("\n")
+
+
+def test_terminar_sin_medicion_no_hace_nada():
+    assert Registro().terminar('x', 'GET') is None
+
+
+def test_detector_n_mas_1(caplog):
+    registro = Registro(max_consultas=5)
+    with caplog.at_level(logging.WARNING):
+        _peticion(registro, 'pendientes', 5)
+        assert not caplog.records
+        _peticion(registro, 'pendientes', 6, sql="SELECT *\n  FROM guias WHERE numero_guia = %s")
+    assert "Posible N+1 en pendientes: 6 consultas" in caplog.text
+    assert "6x SELECT * FROM guias WHERE numero_guia = %s" in caplog.text
+    assert 'mensajeria_n_mas_1_total{ruta="pendientes"} 1' in registro.texto()
+
+
+def test_sentencias_distintas_acotadas(monkeypatch):
+    monkeypatch.setattr(metricas, 'MAX_SENTENCIAS', 2)
+    m = metricas.Medicion()
+    for sql in ("A", "B", "C", "A"):
+        m.consulta(sql, 0, 0)
+    assert m.consultas == 4
+    assert dict(m.sentencias) == {'A': 2, 'B': 1}
+
+
+class PoolFalso:
+    def estadisticas(self):
+        return dict.fromkeys(('abiertas', 'en_uso', 'libres', 'esperando', 'maximo', 'creadas',
+                              'descartadas', 'recicladas', 'timeouts', 'rechazadas', 'entregadas'), 7)
+
+
+def test_texto_con_pool():
+    assert "mensajeria_pool_abierto 0" in Registro().texto()
+    texto = Registro().texto(PoolFalso())
+    assert "mensajeria_pool_abierto 1" in texto
+    assert "# TYPE mensajeria_pool_en_uso gauge\nmensajeria_pool_en_uso 7" in texto
+    assert "# TYPE mensajeria_pool_timeouts_total counter\nmensajeria_pool_timeouts_total 7" in texto
+
+
+def test_conexion_medida_cuenta_consultas_y_filas(dsn_pruebas):
+    conn = psycopg2.connect(dsn_pruebas, connection_factory=ConexionMedida)
+    registro = Registro()
+    try:
+        registro.iniciar()
+        with conn.cursor() as cur:
+            cur.execute("SELECT generate_series(1, 3);")
+            cur.fetchall()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT 1 AS uno;")
+        with conn.cursor(name='medida') as cur:
+            cur.execute("SELECT generate_series(1, 5);")
+            cur.fetchmany(2)
+            cur.fetchall()
+        m = registro.terminar('prueba', 'GET')
+    finally:
+        conn.close()
+    assert m.consultas == 3
+    assert m.filas == 3 + 1 + 5
+    assert m.db > 0
@@ -0,0 +1,125 @@
+import base64
+import json
+from datetime import date, datetime, timezone
+
+import pytest
+
+import paginacion
+from paginacion import codificar_cursor, decodificar_cursor, paginar, tamano_pagina
+
+CLAVES = [('fecha', 'fecha', datetime), ('numero_guia', 'numero_guia', str)]
+TIPOS = [datetime, str]
+
+
+def _token(datos):
+    crudo = json.dumps(datos).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip('=')
+
+
+class Consultas:
+    """fetchall falso: guarda cada (sql, params) y devuelve `filas`."""
+
+    def __init__(self, filas):
+        self.filas = filas
+        self.hechas = []
+
+    def __call__(self, sql, params):
+        self.hechas.append((sql, params))
+        return self.filas
+
+
+def _filas(n):
+    return [{'fecha': datetime(2024, 1, 1, tzinfo=timezone.utc), 'numero_guia': f"G{i:03d}"} for i in range(n)]
+
+
+def test_tamano_pagina():
+    assert tamano_pagina(None) == paginacion.PAGINA_DEFECTO
+    assert tamano_pagina('abc') == paginacion.PAGINA_DEFECTO
+    assert tamano_pagina('0') == 1
+    assert tamano_pagina(10 ** 9) == paginacion.PAGINA_MAX
+
+
+def test_ida_y_vuelta_del_cursor():
+    fecha = datetime(2024, 5, 1, 13, 30, tzinfo=timezone.utc)
+    token = codificar_cursor('s', [fecha, '7000129785'])
+    assert decodificar_cursor(token, TIPOS) == ('s', [fecha, '7000129785'])
+    token = codificar_cursor('a', [date(2024, 5, 1), 'ANA', ''])
+    assert decodificar_cursor(token, [date, str, str]) == ('a', [date(2024, 5, 1), 'ANA', ''])
+    assert decodificar_cursor(codificar_cursor('s', [None, 42]), [datetime, int]) == ('s', [None, 42])
+
+
+@pytest.mark.parametrize('token', [
+    None, '', '%%%', 'bm8tanNvbg',
+    _token({'d': 'x', 'k': ['2024-01-01', 'G1']}),
+    _token({'d': 's', 'k': ['2024-01-01']}),
+    _token({'d': 's', 'k': 'no-es-lista'}),
+    _token({'k': ['2024-01-01', 'G1']}),
+    _token(['s', ['2024-01-01', 'G1']]),
+])
+def test_tokens_mal_formados(token):
+    assert decodificar_cursor(token, TIPOS) is None
+
+
+@pytest.mark.parametrize('valores,tipos', [
+    (['no-es-fecha', 'G1'], TIPOS),
+    ([20240101, 'G1'], TIPOS),
+    (['2024-01-01', 123], TIPOS),
+    (['2024-01-01', 'G\x001'], TIPOS),
+    (['2024-01-01T10:00:00', 'ANA'], [date, str]),
+    (['2024-01-01', '5'], [datetime, int]),
+    (['2024-01-01', 1.5], [datetime, int]),
+    (['2024-01-01', True], [datetime, int]),
+    (['2024-01-01', 2 ** 70], [datetime, int]),
+])
+def test_valores_de_otro_tipo(valores, tipos):
+    assert decodificar_cursor(_token({'d': 's', 'k': valores}), tipos) is None
+
+
+def test_primera_pagina():
+    consultas = Consultas(_filas(3))
+    pagina = paginar(consultas, "SELECT * FROM t WHERE 1=1", [], CLAVES, tamano=2)
+    sql, params = consultas.hechas[0]
+    assert sql.endswith(" ORDER BY fecha DESC, numero_guia DESC LIMIT %s")
+    assert params == [3]
+    assert [f['numero_guia'] for f in pagina.filas] == ['G000', 'G001']
+    assert pagina.anterior is None
+    assert decodificar_cursor(pagina.siguiente, TIPOS)[1][1] == 'G001'
+
+
+def test_pagina_siguiente_y_anterior():
+    fecha = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    siguiente = codificar_cursor('s', [fecha, 'G001'])
+    consultas = Consultas(_filas(2))
+    pagina = paginar(consultas, "SELECT * FROM t WHERE 1=1", ['x'], CLAVES, cursor=siguiente, tamano=2)
+    sql, params = consultas.hechas[0]
+    assert " AND (fecha, numero_guia) < (%s, %s) ORDER BY fecha DESC" in sql
+    assert params == ['x', fecha, 'G001', 3]
+    assert pagina.siguiente is None and pagina.anterior is not None
+
+    consultas = Consultas(list(reversed(_filas(3))))
+    pagina = paginar(consultas, "SELECT * FROM t WHERE 1=1", [], CLAVES,
+                     cursor=codificar_cursor('a', [fecha, 'G005']), tamano=2)
+    sql, _ = consultas.hechas[0]
+    assert " AND (fecha, numero_guia) > (%s, %s) ORDER BY fecha ASC" in sql
+    # Al ir hacia atrás se piden en orden inverso y se devuelven en el de la vista
+    assert [f['numero_guia'] for f in pagina.filas] == ['G001', 'G002']
+    assert pagina.siguiente is not None and pagina.anterior is not None
+
+
+def test_cursor_con_tipos_invalidos_vuelve_a_la_primera_pagina():
+    malo = _token({'d': 's', 'k': ['ayer', 'G1']})
+    consultas = Consultas(_filas(1))
+    pagina = paginar(consultas, "SELECT * FROM t WHERE 1=1", [], CLAVES, cursor=malo)
+    sql, params = consultas.hechas[0]
+    assert '(fecha, numero_guia) <' not in sql
+    assert params == [paginacion.PAGINA_DEFECTO + 1]
+    assert pagina.cursor is None
+
+
+def test_total_estimado_con_el_plan():
+    plan = {'QUERY PLAN': [{'Plan': {'Plan Rows': 1234}}]}
+    pedidas = []
+    pagina = paginar(Consultas([]), "SELECT 1", [], CLAVES,
+                     estimar=lambda sql, params: pedidas.append(sql) or plan)
+    assert pagina.total_aprox == 1234
+    assert pedidas[0].startswith("EXPLAIN (FORMAT JSON) SELECT 1")
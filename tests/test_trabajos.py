@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+
+import pytest
+
+import trabajos
+from conexiones import PoolAgotado
+from trabajos import Trabajos
+
+
+class Base:
+    """Tabla `trabajos` falsa: guarda cada sentencia ejecutada."""
+
+    def __init__(self):
+        self.sentencias = []
+
+    @contextmanager
+    def conectar(self):
+        base = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=()):
+                base.sentencias.append((' '.join(sql.split()), params))
+
+        class Conexion:
+            def cursor(self):
+                return Cursor()
+
+        yield Conexion()
+
+    def estados(self):
+        return [p[0] for sql, p in self.sentencias if sql.startswith("UPDATE trabajos SET estado")]
+
+
+@contextmanager
+def sin_conexion():
+    raise PoolAgotado("sin conexiones libres", 1)
+    yield
+
+
+def _trabajo(progreso, n):
+    progreso.fijar_total(n)
+    for _ in range(n):
+        progreso.avanzar()
+    return {'filas': n}
+
+
+def _esperar(cola, tipo):
+    cola._pools[tipo].shutdown(wait=True)
+
+
+@pytest.fixture(autouse=True)
+def sin_intervalo(monkeypatch):
+    monkeypatch.setattr(trabajos, 'INTERVALO_PROGRESO', 0)
+
+
+def test_avance_que_no_se_puede_escribir_no_hace_fallar_el_trabajo(tmp_path):
+    base = Base()
+    cola = Trabajos(base.conectar, str(tmp_path), {'carga': 1}, conectar_progreso=sin_conexion)
+    cola.encolar('carga', _trabajo, 5)
+    _esperar(cola, 'carga')
+    assert base.estados() == [trabajos.EN_CURSO, trabajos.TERMINADO]
+    final = base.sentencias[-1]
+    assert '"filas": 5' in final[1][3]   # resultado
+    assert final[1][1:3] == (5, 5)       # progreso, total
+
+
+def test_avance_con_conexion_propia(tmp_path):
+    base, avances = Base(), Base()
+    cola = Trabajos(base.conectar, str(tmp_path), {}, conectar_progreso=avances.conectar)
+    cola.encolar('lote', _trabajo, 3)
+    _esperar(cola, 'lote')
+    # Los avances no usan el conectar del trabajo
+    assert [p[:2] for _, p in avances.sentencias] == [(0, 3), (1, 3), (2, 3), (3, 3)]
+    assert not any("progreso = %s, total = %s WHERE" in sql for sql, _ in base.sentencias)
+    assert base.estados() == [trabajos.EN_CURSO, trabajos.TERMINADO]
+
+
+def test_error_del_trabajo_queda_en_error(tmp_path):
+    base = Base()
+
+    def falla(progreso):
+        raise ValueError("archivo corrupto")
+
+    cola = Trabajos(base.conectar, str(tmp_path), {})
+    cola.encolar('carga', falla)
+    _esperar(cola, 'carga')
+    assert base.estados() == [trabajos.EN_CURSO, trabajos.ERROR]
+    assert base.sentencias[-1][1][1] == "archivo corrupto"
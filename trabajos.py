@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# =========================
+#   Trabajos en segundo plano
+# =========================
+#
+# Cargas de base, lotes grandes y exports pesados se encolan aquí en vez de
+# correr dentro de la petición. Cada tipo de trabajo tiene su propio pool de
+# hilos con un máximo de trabajos simultáneos, así una carga grande no deja
+# sin conexiones ni CPU a las páginas interactivas.
+#
+# El estado vive en la tabla `trabajos` (no en memoria): cualquier worker
+# responde /jobs/<id>, aunque el trabajo corra en otro.
+# - progreso / total: se escriben como mucho una vez por INTERVALO_PROGRESO,
+#   con `conectar_progreso` (el trabajo ya tiene tomada su conexión). Son
+#   informativos: si no se pueden escribir se anota en el log y el trabajo
+#   sigue.
+# - resultado: JSON con el resumen; archivo: ruta del resultado descargable.
+# - Un trabajo PENDIENTE o EN_CURSO cuyo `actualizado` no se movió en
+#   ABANDONADO_MIN minutos es de un proceso que murió: se marca ERROR.
+
+PENDIENTE = 'PENDIENTE'
+EN_CURSO = 'EN_CURSO'
+TERMINADO = 'TERMINADO'
+ERROR = 'ERROR'
+
+INTERVALO_PROGRESO = 1.0
+ABANDONADO_MIN = int(os.getenv("TRABAJO_ABANDONADO_MIN", "60"))
+RETENCION_DIAS = int(os.getenv("TRABAJO_RETENCION_DIAS", "7"))
+
+SQL_ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS trabajos (
+        id          TEXT PRIMARY KEY,
+        tipo        TEXT NOT NULL,
+        descripcion TEXT NOT NULL DEFAULT '',
+        estado      TEXT NOT NULL DEFAULT 'PENDIENTE',
+        progreso    BIGINT NOT NULL DEFAULT 0,
+        total       BIGINT,
+        mensaje     TEXT NOT NULL DEFAULT '',
+        resultado   JSONB,
+        archivo     TEXT,
+        nombre_archivo TEXT,
+        proceso     TEXT NOT NULL DEFAULT '',
+        creado      TIMESTAMPTZ NOT NULL DEFAULT now(),
+        iniciado    TIMESTAMPTZ,
+        terminado   TIMESTAMPTZ,
+        actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos(estado, actualizado);
+"""
+
+
+class Progreso:
+    """Lo que recibe la función del trabajo para informar avance y resultado."""
+
+    def __init__(self, runner, id_trabajo):
+        self._runner = runner
+        self.id = id_trabajo
+        self.progreso = 0
+        self.total = None
+        self.archivo = None
+        self.nombre_archivo = None
+        self._ultimo = 0.0
+
+    def fijar_total(self, total):
+        self.total = total
+        self._guardar(forzar=True)
+
+    def avanzar(self, n=1, mensaje=None):
+        self.progreso += n
+        self._guardar(mensaje=mensaje)
+
+    def ruta_resultado(self, ext, nombre_descarga):
+        """Ruta donde el trabajo escribe su archivo descargable."""
+        self.archivo = os.path.join(self._runner.directorio, f"{self.id}.{ext}")
+        self.nombre_archivo = nombre_descarga
+        return self.archivo
+
+    def _guardar(self, forzar=False, mensaje=None):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo < INTERVALO_PROGRESO:
+            return
+        self._ultimo = ahora
+        try:
+            self._runner._actualizar(self.id, progreso=self.progreso, total=self.total,
+                                     conectar=self._runner._conectar_progreso,
+                                     **({'mensaje': mensaje} if mensaje is not None else {}))
+        except Exception:
+            logging.warning("No se pudo guardar el avance del trabajo %s", self.id, exc_info=True)
+
+
+class Trabajos:
+    def __init__(self, conectar, directorio, limites, conectar_progreso=None):
+        """
+        conectar: context manager que entrega una conexión (get_conn de la app).
+        limites: {tipo: trabajos simultáneos}; un tipo no listado usa 1.
+        conectar_progreso: el de las escrituras de avance (por defecto, conectar).
+        """
+        self._conectar = conectar
+        self._conectar_progreso = conectar_progreso or conectar
+        self.directorio = directorio
+        self.limites = dict(limites)
+        self._pools = {}
+        self._lock = threading.Lock()
+        self.proceso = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(directorio, exist_ok=True)
+
+    def _pool(self, tipo):
+        # Los hilos se crean en el primer trabajo, ya dentro del worker (después del fork)
+        with self._lock:
+            pool = self._pools.get(tipo)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.limites.get(tipo, 1),
+                                          thread_name_prefix=f"trabajo-{tipo}")
+                self._pools[tipo] = pool
+            return pool
+
+    def _ejecutar(self, sql, params=(), conectar=None):
+        with (conectar or self._conectar)() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+
+    def _actualizar(self, id_trabajo, conectar=None, **campos):
+        asignaciones = ", ".join(f"{c} = %s" for c in campos)
+        valores = [json.dumps(v, default=str) if c == 'resultado' else v for c, v in campos.items()]
+        self._ejecutar(f"UPDATE trabajos SET {asignaciones}, actualizado = now() WHERE id = %s;",
+                       (*valores, id_trabajo), conectar=conectar)
+
+    def encolar(self, tipo, funcion, *args, descripcion='') -> str:
+        """
+        Registra el trabajo y lo envía al pool de su tipo. `funcion(progreso,
+        *args)` corre en otro hilo, sin contexto de petición; lo que devuelve
+        (un dict) queda como resultado. Devuelve el id.
+        """
+        id_trabajo = uuid.uuid4().hex
+        self._ejecutar("INSERT INTO trabajos(id, tipo, descripcion, proceso) VALUES (%s, %s, %s, %s);",
+                       (id_trabajo, tipo, descripcion, self.proceso))
+        self._pool(tipo).submit(self._correr, id_trabajo, funcion, args)
+        return id_trabajo
+
+    def _correr(self, id_trabajo, funcion, args):
+        progreso = Progreso(self, id_trabajo)
+        try:
+            self._ejecutar("UPDATE trabajos SET estado = %s, iniciado = now(), actualizado = now() WHERE id = %s;",
+                           (EN_CURSO, id_trabajo))
+            resultado = funcion(progreso, *args)
+        except Exception as e:
+            logging.exception("Falló el trabajo %s", id_trabajo)
+            if progreso.archivo:
+                try:
+                    os.remove(progreso.archivo)
+                except OSError:
+                    pass
+            try:
+                self._actualizar(id_trabajo, estado=ERROR, mensaje=str(e)[:500] or type(e).__name__,
+                                 terminado=datetime.now(timezone.utc))
+            except Exception:
+                logging.exception("No se pudo marcar el trabajo %s como fallido", id_trabajo)
+            return
+        try:
+            total = progreso.total if progreso.total is not None else progreso.progreso
+            self._actualizar(id_trabajo, estado=TERMINADO, progreso=max(progreso.progreso, total or 0),
+                             total=total, resultado=resultado, archivo=progreso.archivo,
+                             nombre_archivo=progreso.nombre_archivo, terminado=datetime.now(timezone.utc))
+        except Exception:
+            logging.exception("No se pudo guardar el resultado del trabajo %s", id_trabajo)
+
+    def obtener(self, id_trabajo):
+        """Estado del trabajo como dict, o None si no existe."""
+        with self._conectar() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, tipo, descripcion, estado, progreso, total, mensaje, resultado,
+                           archivo, nombre_archivo, creado, iniciado, terminado, actualizado
+                    FROM trabajos WHERE id = %s;
+                """, (id_trabajo,))
+                fila = cur.fetchone()
+                if not fila:
+                    return None
+                return dict(zip([c[0] for c in cur.description], fila))
+
+    def limpiar(self):
+        """
+        Marca como ERROR los trabajos abandonados y borra los terminados hace
+        más de RETENCION_DIAS (con su archivo). Se llama al arrancar.
+        """
+        self._ejecutar("""
+            UPDATE trabajos SET estado = %s, mensaje = 'Interrumpido: el proceso se reinició', terminado = now()
+            WHERE estado IN (%s, %s) AND actualizado < now() - %s * interval '1 minute';
+        """, (ERROR, PENDIENTE, EN_CURSO, ABANDONADO_MIN))
+        with self._conectar() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM trabajos
+                    WHERE creado < now() - %s * interval '1 day' AND estado IN (%s, %s)
+                    RETURNING archivo;
+                """, (RETENCION_DIAS, TERMINADO, ERROR))
+                archivos = [r[0] for r in cur.fetchall() if r[0]]
+        for ruta in archivos:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass